@@ -0,0 +1,4 @@
+"""Offline micro-benchmarks for the message -> args -> PGN -> embed hot path
+
+Run with: python -m benchmarks --output results.json [--compare baseline.json]
+"""
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Optional, Sequence
+
+from chess_bot.bot import async_create_gif, concat_c2g_args, create_gif, extract_game_headers, make_gif_embed
+from chess_bot.process import run_process_sync
+from chess_bot.render import RenderOptions, get_atlas, render_gif, render_options, render_png
+from chess_bot.request import RenderRequest, parse_message
+from chess_bot.spool import RenderedGIF
+from tests.fakes import make_bot_user, make_message, write_fake_c2g, write_fake_cgf
+
+from .pgns import REAL_PGN, SAMPLE_PGNS
+
+EMBED_HEADERS = ["White", "Black", "WhiteElo", "BlackElo", "Link", "Date", "Result", "Termination"]
+RENDER_REQUEST = RenderRequest(
+    search_type="id",
+    id_or_username="11219006649",
+    time="real",
+    disable=("player-bars",),
+    light="255,255,255",
+    dark="0,0,0",
+)
+
+
+def summarize(timings: list[float]) -> dict[str, Any]:
+    """Summarize per call timings, in microseconds"""
+    micros = [t * 1e6 for t in timings]
+    return {
+        "unit": "us",
+        "rounds": len(micros),
+        "min": min(micros),
+        "median": statistics.median(micros),
+        "mean": statistics.mean(micros),
+        "stdev": statistics.stdev(micros) if len(micros) > 1 else 0.0,
+    }
+
+
+def bench(func: Callable[[], Any], rounds: int, number: int) -> dict[str, Any]:
+    func()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return summarize(timings)
+
+
+def bench_async(func: Callable[[], Awaitable[Any]], rounds: int) -> dict[str, Any]:
+    async def run():
+        await func()
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await func()
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    return summarize(asyncio.run(run()))
+
+
+def render_uncached(options: RenderOptions) -> bytes:
+    """Render without any sprite or frame rasterized and encoded before, like a process's first render"""
+    get_atlas.cache_clear()
+    return render_gif(options)
+
+
+def run_benchmarks(
+    quick: bool = False, cgf_latency: float = 0.0, c2g_latency: float = 0.0, gif_size: int = 512 * 1024
+) -> dict[str, Any]:
+    """Run every benchmark, returning the results keyed by benchmark name"""
+    rounds, number, process_rounds = (3, 10, 2) if quick else (20, 1000, 20)
+    results = {}
+
+    bot_user = make_bot_user()
+    messages = {
+        "id": make_message("id:11219006649"),
+        "player_all_options": make_message(
+            "player:hikaru time:real disable:player-bars,clock light:255,255,255 dark:0,0,0"
+        ),
+        "not_for_bot": make_message("just chatting"),
+    }
+    for name, message in messages.items():
+        results[f"parse_message[{name}]"] = bench(lambda: parse_message(message, bot_user), rounds, number)
+
+    for name, pgn in SAMPLE_PGNS.items():
+        results[f"extract_game_headers[{name}]"] = bench(
+            lambda: extract_game_headers(pgn, EMBED_HEADERS), rounds, number
+        )
+        results[f"concat_c2g_args[{name}]"] = bench(
+            lambda: concat_c2g_args(pgn, Path("chess.gif"), RENDER_REQUEST), rounds, number
+        )
+
+        gif = RenderedGIF("chess.gif", Path(tempfile.gettempdir()))
+        gif.write(b"GIF89a" + b"\0" * gif_size)
+        results[f"make_gif_embed[{name}]"] = bench(lambda: make_gif_embed(pgn, gif), rounds, number)
+
+    # The native renderer against c2g, when it is installed, rendering the same games with the same options
+    c2g = shutil.which("c2g")
+    with tempfile.TemporaryDirectory() as directory:
+        output = Path(directory) / "chess.gif"
+        for name, pgn in {**SAMPLE_PGNS, "real": REAL_PGN}.items():
+            options = render_options(pgn, RENDER_REQUEST)
+            results[f"render_native[{name}]"] = {
+                **bench(lambda: render_gif(options), process_rounds, 1),
+                "bytes": len(render_gif(options)),
+            }
+            # The final position only, what format:png sends instead of the whole game
+            results[f"render_png[{name}]"] = {
+                **bench(lambda: render_png(options), process_rounds, 1),
+                "bytes": len(render_png(options)),
+            }
+            if not quick or name == "real":
+                results[f"render_native_uncached[{name}]"] = bench(
+                    lambda: render_uncached(options), process_rounds, 1
+                )
+            if c2g is not None:
+                c2g_args = concat_c2g_args(pgn, output, RENDER_REQUEST)
+                results[f"render_c2g[{name}]"] = {
+                    **bench(lambda: run_process_sync(c2g_args), process_rounds, 1),
+                    "bytes": output.stat().st_size,
+                }
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory)
+        write_fake_cgf(path, SAMPLE_PGNS["long"], latency=cgf_latency)
+        write_fake_c2g(path, size=gif_size, latency=c2g_latency)
+        old_path = os.environ["PATH"]
+        os.environ["PATH"] = f"{directory}{os.pathsep}{old_path}"
+        output = path / "chess.gif"
+
+        try:
+            results["create_gif[long]"] = bench(lambda: create_gif(RENDER_REQUEST, output), process_rounds, 1)
+            results["async_create_gif[long]"] = bench_async(
+                lambda: async_create_gif(RENDER_REQUEST, output), process_rounds
+            )
+        finally:
+            os.environ["PATH"] = old_path
+
+    return results
+
+
+def metadata() -> dict[str, Any]:
+    from importlib import metadata as importlib_metadata
+
+    try:
+        version = importlib_metadata.version("chess_bot")
+    except importlib_metadata.PackageNotFoundError:
+        version = "unknown"
+
+    return {
+        "version": version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], threshold: float = 0.1) -> list[str]:
+    """Compare median timings with a baseline, flagging the ones slower by more than threshold"""
+    lines = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            lines.append(f"{name}: {result['median']:.1f}us (new)")
+            continue
+
+        ratio = result["median"] / base["median"] if base["median"] else float("inf")
+        flag = " REGRESSION" if ratio > 1 + threshold else ""
+        lines.append(f"{name}: {base['median']:.1f}us -> {result['median']:.1f}us ({ratio:.2f}x){flag}")
+    return lines
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the chess_bot hot path")
+    parser.add_argument("--output", help="write results as JSON to this file", type=Path, default=None)
+    parser.add_argument("--compare", help="baseline JSON results to compare against", type=Path, default=None)
+    parser.add_argument(
+        "--threshold", help="relative slowdown reported as a regression", type=float, default=0.1
+    )
+    parser.add_argument("--quick", help="run few rounds, as a smoke test", action="store_true")
+    parser.add_argument("--cgf-latency", help="seconds the fake cgf sleeps for", type=float, default=0.0)
+    parser.add_argument("--c2g-latency", help="seconds the fake c2g sleeps for", type=float, default=0.0)
+    parser.add_argument("--gif-size", help="bytes written by the fake c2g", type=int, default=512 * 1024)
+    parsed = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        quick=parsed.quick,
+        cgf_latency=parsed.cgf_latency,
+        c2g_latency=parsed.c2g_latency,
+        gif_size=parsed.gif_size,
+    )
+    report = {"meta": metadata(), "results": results}
+
+    if parsed.output is not None:
+        parsed.output.write_text(json.dumps(report, indent=2, sort_keys=True))
+
+    if parsed.compare is not None:
+        baseline = json.loads(parsed.compare.read_text())["results"]
+        lines = compare(results, baseline, parsed.threshold)
+    else:
+        lines = [
+            f"{name}: {result['median']:.1f}us" + (f" ({result['bytes']} bytes)" if "bytes" in result else "")
+            for name, result in results.items()
+        ]
+
+    print("\n".join(lines))
+    return 1 if any(line.endswith("REGRESSION") for line in lines) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
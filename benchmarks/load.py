@@ -0,0 +1,432 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+from pathlib import Path
+import random
+import resource
+import socket
+import sys
+import tempfile
+import tracemalloc
+from typing import Any, Optional, Sequence
+
+import aiohttp
+from aiohttp import web
+import discord
+
+from chess_bot.bot import Chess2GIF
+from chess_bot.cache import PGNCache
+from chess_bot.scheduler import DEFAULT_MAX_QUEUE_SIZE, RenderScheduler
+from chess_bot.spool import GIFSpool
+from chess_bot.traffic import TraceEvent, read_trace
+from tests.fakes import (
+    BOT_USER_DATA,
+    FakeAttachment,
+    FakeBot,
+    FakeGuild,
+    FakeState,
+    make_bot_user,
+    write_fake_c2g,
+    write_fake_ffmpeg,
+    write_fake_game_cgf,
+)
+
+from .__main__ import metadata
+from .pgns import SAMPLE_PGNS
+
+# The game id in the links of the sample PGNs, replaced by the fake cgf
+SAMPLE_LINK_ID = "11219006649"
+# Uploads of every size the bot may send, up to a server's upload limit
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+
+
+class FakeDiscord:
+    """A local stand-in for Discord: a gateway turning trace events into messages, and a REST API
+
+    Replies are sent over HTTP to a server on localhost, which reads every upload in full and
+    answers after latency seconds, so sending a GIF costs about what it costs against Discord.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.state = FakeState()
+        self.message_ids = itertools.count(1000)
+        self.replies = 0
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.edits = 0
+        self.deletes = 0
+        self.url = ""
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application(client_max_size=MAX_UPLOAD_SIZE)
+        self.app.router.add_post("/channels/{channel_id}/messages", self.create_message)
+        self.app.router.add_patch("/channels/{channel_id}/messages/{message_id}", self.edit_message)
+        self.app.router.add_delete("/channels/{channel_id}/messages/{message_id}", self.delete_message)
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(self._runner, sock).start()
+        self.url = "http://127.0.0.1:{}".format(sock.getsockname()[1])
+        self.session = aiohttp.ClientSession()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    # The gateway
+
+    def message_create(self, event: TraceEvent, id: int) -> discord.Message:
+        """Build the message of a trace event, from the MESSAGE_CREATE payload Discord would send"""
+        guild = FakeGuild(int(event.guild, 16)) if event.guild is not None else None
+        channel = LoadChannel(self, int(event.channel, 16), guild)
+        data = {
+            "id": str(id),
+            "channel_id": str(channel.id),
+            "attachments": [],
+            "embeds": [],
+            "edited_timestamp": None,
+            "type": 0,
+            "pinned": False,
+            "mention_everyone": False,
+            "tts": False,
+            "content": f"<@!{BOT_USER_DATA['id']}> {event.to_content()}",
+            "author": {
+                "username": "a-user",
+                "id": str(int(event.author, 16)),
+                "discriminator": "0002",
+                "avatar": None,
+            },
+            "mentions": [BOT_USER_DATA],
+        }
+        if guild is not None:
+            data["guild_id"] = str(guild.id)
+        return discord.Message(state=self.state, channel=channel, data=data)
+
+    # The REST API
+
+    async def create_message(self, request: web.Request) -> web.Response:
+        attachments = []
+        if request.content_type == "multipart/form-data":
+            reader = await request.multipart()
+            async for part in reader:
+                body = await part.read()
+                filename = part.filename
+                if filename is not None:
+                    self.uploads += 1
+                    self.uploaded_bytes += len(body)
+                    attachments.append({"filename": filename, "url": f"{self.url}/attachments/{filename}"})
+        else:
+            await request.read()
+        self.replies += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response({"id": str(next(self.message_ids)), "attachments": attachments})
+
+    async def edit_message(self, request: web.Request) -> web.Response:
+        await request.read()
+        self.edits += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response({"id": request.match_info["message_id"]})
+
+    async def delete_message(self, request: web.Request) -> web.Response:
+        self.deletes += 1
+        await asyncio.sleep(self.latency)
+        return web.Response(status=204)
+
+    async def request(self, method: str, path: str, **kwargs) -> dict:
+        assert self.session is not None, "the fake Discord was not started"
+        async with self.session.request(method, f"{self.url}{path}", **kwargs) as response:
+            response.raise_for_status()
+            return await response.json() if response.status != 204 else {}
+
+
+class LoadChannel:
+    """A channel whose messages are sent to the fake Discord's REST API"""
+
+    def __init__(self, discord_: FakeDiscord, id: int, guild: Optional[FakeGuild]):
+        self.discord = discord_
+        self.id = id
+        self.guild = guild
+
+    async def send(
+        self,
+        content: Optional[str] = None,
+        *,
+        embed: Optional[discord.Embed] = None,
+        file: Optional[discord.File] = None,
+        files: Optional[Sequence[discord.File]] = None,
+    ) -> LoadMessage:
+        files = list(files or ([file] if file is not None else []))
+        payload = {"content": content, "embed": embed.to_dict() if embed is not None else None}
+        path = f"/channels/{self.id}/messages"
+        if not files:
+            data = await self.discord.request("POST", path, json=payload)
+            return LoadMessage(self, data)
+
+        form = aiohttp.FormData()
+        form.add_field("payload_json", json.dumps(payload))
+        for index, attached in enumerate(files):
+            form.add_field(f"file{index}", attached.fp, filename=attached.filename)
+        try:
+            data = await self.discord.request("POST", path, data=form)
+        finally:
+            for attached in files:
+                attached.close()
+        return LoadMessage(self, data)
+
+
+class LoadMessage:
+    def __init__(self, channel: LoadChannel, data: dict):
+        self.channel = channel
+        self.id = int(data["id"])
+        self.attachments = [FakeAttachment(attachment["url"]) for attachment in data["attachments"]]
+
+    @property
+    def path(self) -> str:
+        return f"/channels/{self.channel.id}/messages/{self.id}"
+
+    async def edit(self, content: Optional[str] = None, embed: Optional[discord.Embed] = None):
+        payload = {"content": content, "embed": embed.to_dict() if embed is not None else None}
+        await self.channel.discord.request("PATCH", self.path, json=payload)
+
+    async def delete(self):
+        await self.channel.discord.request("DELETE", self.path)
+
+
+def synthetic_trace(count: int, rate: float, seed: int = 0) -> list[TraceEvent]:
+    """Make up a trace of count requests arriving rate times a second on average
+
+    A few popular players and servers make most of the requests, like in production.
+    """
+    rng = random.Random(seed)
+
+    def pick(prefix: str, population: int) -> str:
+        # Weighted towards the first ones
+        index = min(int(rng.paretovariate(1.2)), population)
+        return f"{prefix}{index:04x}"
+
+    events = []
+    at = 0.0
+    for _ in range(count):
+        at += rng.expovariate(rate)
+        search_type = "player" if rng.random() < 0.7 else "id"
+        target = pick("a", 50) if search_type == "player" else f"{rng.getrandbits(40):010x}"
+        options = ("format:png",) if rng.random() < 0.1 else ()
+        events.append(
+            TraceEvent(
+                at=round(at, 3),
+                author=pick("b", 500),
+                channel=pick("c", 100),
+                guild=pick("d", 40),
+                search_type=search_type,
+                targets=(target,),
+                options=options,
+            )
+        )
+    return events
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """The nearest-rank percentile of values, which must be sorted"""
+    if not values:
+        return 0.0
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def peak_rss() -> int:
+    """The peak resident set size of this process, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+async def replay(
+    cog: Chess2GIF, discord_: FakeDiscord, events: Sequence[TraceEvent], speed: float = 1.0
+) -> dict[str, Any]:
+    """Deliver every event's message to the cog at speed times the rate it was recorded at
+
+    Messages are delivered on schedule whether or not earlier ones were answered, like the gateway
+    delivers them. Latency is from delivering a message to on_message returning, once it was answered.
+    """
+    loop = asyncio.get_running_loop()
+    latencies: list[float] = []
+    first = events[0].at if events else 0.0
+
+    async def deliver(message: discord.Message):
+        delivered = loop.time()
+        await cog.on_message(message)
+        latencies.append(loop.time() - delivered)
+
+    started = loop.time()
+    rss_before = peak_rss()
+    tasks = []
+    for index, event in enumerate(events):
+        delay = started + (event.at - first) / speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(deliver(discord_.message_create(event, index + 1))))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    duration = loop.time() - started
+
+    latencies.sort()
+    return {
+        "speed": speed,
+        "requests": len(events),
+        "errors": sum(isinstance(result, BaseException) for result in results),
+        "duration": duration,
+        "throughput": len(latencies) / duration if duration else 0.0,
+        "latency_ms": {
+            name: percentile(latencies, fraction) * 1000
+            for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))
+        },
+        "replies": discord_.replies,
+        "uploads": discord_.uploads,
+        "uploaded_bytes": discord_.uploaded_bytes,
+        "edits": discord_.edits,
+        "deletes": discord_.deletes,
+        "peak_rss_bytes": peak_rss(),
+        "peak_rss_growth_bytes": peak_rss() - rss_before,
+    }
+
+
+async def run_load(
+    events: Sequence[TraceEvent],
+    speed: float,
+    spool_dir: Path,
+    max_renders: Optional[int] = None,
+    max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+    placeholders: bool = False,
+    rest_latency: float = 0.0,
+    trace_memory: bool = False,
+) -> dict[str, Any]:
+    """Replay events against a new cog, with cold caches, through a new fake Discord"""
+    discord_ = FakeDiscord(latency=rest_latency)
+    await discord_.start()
+    cog = Chess2GIF(
+        bot=FakeBot(make_bot_user()),
+        scheduler=RenderScheduler(max_concurrency=max_renders, max_queue_size=max_queue_size),
+        pgn_cache=PGNCache(),
+        spool=GIFSpool(spool_dir),
+        placeholders=placeholders,
+    )
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        report = await replay(cog, discord_, events, speed)
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            report["python_heap_bytes"] = {"current": current, "peak": peak}
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        await discord_.close()
+    return report
+
+
+def format_report(report: dict[str, Any]) -> str:
+    latency = report["latency_ms"]
+    line = (
+        f"{report['speed']:g}x: {report['requests']} requests in {report['duration']:.1f}s, "
+        f"{report['throughput']:.1f}/s, "
+        f"latency p50 {latency['p50']:.0f}ms p90 {latency['p90']:.0f}ms p99 {latency['p99']:.0f}ms "
+        f"max {latency['max']:.0f}ms, {report['uploads']} uploads, {report['errors']} errors, "
+        f"peak RSS {report['peak_rss_bytes'] / 2 ** 20:.0f}MiB "
+        f"(+{report['peak_rss_growth_bytes'] / 2 ** 20:.1f}MiB)"
+    )
+    if "python_heap_bytes" in report:
+        line += f", Python heap {report['python_heap_bytes']['current'] / 2 ** 20:.1f}MiB"
+    return line
+
+
+def parse_speeds(value: str) -> list[float]:
+    return [float(speed) for speed in value.split(",")]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.load",
+        description="Replay recorded requests against the bot, with a fake Discord, cgf and c2g",
+    )
+    parser.add_argument(
+        "trace", help="trace recorded with --record-traffic, made up if not given", type=Path, nargs="?"
+    )
+    parser.add_argument("--requests", help="number of made up requests", type=int, default=200)
+    parser.add_argument("--rate", help="made up requests per second", type=float, default=10.0)
+    parser.add_argument(
+        "--speed",
+        help="comma separated multiples of the trace's rate to replay it at, one run each",
+        type=parse_speeds,
+        default=[1.0],
+    )
+    parser.add_argument("--max-renders", help="render slots, defaults to the number of cores", type=int)
+    parser.add_argument(
+        "--max-queue-size",
+        help="requests waiting for a render slot",
+        type=int,
+        default=DEFAULT_MAX_QUEUE_SIZE,
+    )
+    parser.add_argument("--placeholders", help="post placeholders while rendering", action="store_true")
+    parser.add_argument("--cgf-latency", help="seconds the fake cgf sleeps for", type=float, default=0.3)
+    parser.add_argument("--c2g-latency", help="seconds the fake c2g sleeps for", type=float, default=1.0)
+    parser.add_argument(
+        "--ffmpeg-latency", help="seconds the fake ffmpeg sleeps for", type=float, default=0.5
+    )
+    parser.add_argument("--gif-size", help="bytes written by the fake c2g", type=int, default=512 * 1024)
+    parser.add_argument(
+        "--rest-latency", help="seconds the fake Discord takes to answer", type=float, default=0.05
+    )
+    parser.add_argument(
+        "--trace-memory", help="also report the Python heap, slowing the bot down", action="store_true"
+    )
+    parser.add_argument("--output", help="write the reports as JSON to this file", type=Path, default=None)
+    parsed = parser.parse_args(argv)
+
+    if parsed.trace is not None:
+        events = read_trace(parsed.trace)
+    else:
+        events = synthetic_trace(parsed.requests, parsed.rate)
+    reports = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory)
+        write_fake_game_cgf(path, SAMPLE_PGNS["long"], SAMPLE_LINK_ID, latency=parsed.cgf_latency)
+        write_fake_c2g(path, size=parsed.gif_size, latency=parsed.c2g_latency)
+        write_fake_ffmpeg(path, latency=parsed.ffmpeg_latency)
+        old_path = os.environ["PATH"]
+        os.environ["PATH"] = f"{directory}{os.pathsep}{old_path}"
+        try:
+            for speed in parsed.speed:
+                report = asyncio.run(
+                    run_load(
+                        events,
+                        speed,
+                        spool_dir=path / f"spool-{speed:g}",
+                        max_renders=parsed.max_renders,
+                        max_queue_size=parsed.max_queue_size,
+                        placeholders=parsed.placeholders,
+                        rest_latency=parsed.rest_latency,
+                        trace_memory=parsed.trace_memory,
+                    )
+                )
+                print(format_report(report), flush=True)
+                reports.append(report)
+        finally:
+            os.environ["PATH"] = old_path
+
+    if parsed.output is not None:
+        report_meta = {**metadata(), "trace": str(parsed.trace) if parsed.trace is not None else None}
+        parsed.output.write_text(json.dumps({"meta": report_meta, "runs": reports}, indent=2))
+    return 1 if any(report["errors"] for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
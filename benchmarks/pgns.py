@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+# A legal sequence that can be repeated forever: both knights go out and back
+KNIGHT_SHUFFLE = ["Nf3", "Nf6", "Ng1", "Ng8"]
+
+HEADERS = """[Event "Live Chess"]
+[Site "Chess.com"]
+[Date "2021.04.03"]
+[Round "-"]
+[White "magnus_carlsen"]
+[Black "Hikaru"]
+[Result "1/2-1/2"]
+[CurrentPosition "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"]
+[Timezone "UTC"]
+[ECO "A04"]
+[ECOUrl "https://www.chess.com/openings/Reti-Opening"]
+[UTCDate "2021.04.03"]
+[UTCTime "13:00:00"]
+[WhiteElo "2847"]
+[BlackElo "3205"]
+[TimeControl "180"]
+[Termination "Game drawn by repetition"]
+[StartTime "13:00:00"]
+[EndDate "2021.04.03"]
+[EndTime "13:03:49"]
+[Link "https://www.chess.com/game/live/11219006649"]
+"""
+
+
+def generate_pgn(plies: int, clock: bool = True) -> str:
+    """Generate a chess.com style PGN with the given number of half moves"""
+    moves = []
+    for ply in range(plies):
+        number = ply // 2 + 1
+        move = KNIGHT_SHUFFLE[ply % len(KNIGHT_SHUFFLE)]
+        prefix = f"{number}." if ply % 2 == 0 else f"{number}..."
+        comment = f" {{[%clk 0:0{2 - ply // 200}:{59 - ply % 60:02d}]}}" if clock else ""
+        moves.append(f"{prefix} {move}{comment}")
+
+    return f"{HEADERS}\n{' '.join(moves)} 1/2-1/2\n"
+
+
+SAMPLE_PGNS = {
+    "short": generate_pgn(10),
+    "medium": generate_pgn(80),
+    "long": generate_pgn(300),
+}
+
+
+# A real game, its moves are not repeated like the generated ones
+REAL_PGN = """
+[Event "Live Chess"]
+[Site "Chess.com"]
+[Date "2021.03.11"]
+[Round "-"]
+[White "SXSH-2021"]
+[Black "pepegasacrifice"]
+[Result "0-1"]
+[CurrentPosition "6k1/5pb1/4p1p1/6Pr/p7/6KP/8/8 w - -"]
+[Timezone "UTC"]
+[ECO "D20"]
+[ECOUrl "https://www.chess.com/openings/Queens-Gambit-Accepted-3.Nc3-Nf6"]
+[UTCDate "2021.03.11"]
+[UTCTime "08:30:14"]
+[WhiteElo "1286"]
+[BlackElo "1402"]
+[TimeControl "60"]
+[Termination "pepegasacrifice won on time"]
+[StartTime "08:30:14"]
+[EndDate "2021.03.11"]
+[EndTime "08:32:22"]
+[Link "https://www.chess.com/game/live/9190563687"]
+
+1. d4 {[%clk 0:00:59.9]} 1... d5 {[%clk 0:00:59.9]} 2. c4 {[%clk 0:00:58.1]} 2... Nf6 {[%clk 0:00:59.5]} 3. Nc3 {[%clk 0:00:57.9]} 3... dxc4 {[%clk 0:00:58.5]} 4. f3 {[%clk 0:00:57.7]} 4... g6 {[%clk 0:00:58.1]} 5. e4 {[%clk 0:00:56.8]} 5... Bg7 {[%clk 0:00:57.8]} 6. Bxc4 {[%clk 0:00:55.7]} 6... O-O {[%clk 0:00:56.9]} 7. e5 {[%clk 0:00:54.9]} 7... Nfd7 {[%clk 0:00:53]} 8. Nge2 {[%clk 0:00:53.4]} 8... a6 {[%clk 0:00:52.1]} 9. O-O {[%clk 0:00:52.6]} 9... b5 {[%clk 0:00:51.4]} 10. Bb3 {[%clk 0:00:52.5]} 10... a5 {[%clk 0:00:50.1]} 11. Nxb5 {[%clk 0:00:50.8]} 11... a4 {[%clk 0:00:49.1]} 12. Bc4 {[%clk 0:00:49]} 12... c6 {[%clk 0:00:47.4]} 13. Nbc3 {[%clk 0:00:48.2]} 13... Ba6 {[%clk 0:00:44.3]} 14. Bxa6 {[%clk 0:00:46.8]} 14... Nxa6 {[%clk 0:00:44.1]} 15. Ng3 {[%clk 0:00:46.4]} 15... Nb4 {[%clk 0:00:43.4]} 16. d5 {[%clk 0:00:46.3]} 16... Nxd5 {[%clk 0:00:42.4]} 17. Nxd5 {[%clk 0:00:46]} 17... cxd5 {[%clk 0:00:41.8]} 18. Qxd5 {[%clk 0:00:45.6]} 18... Nxe5 {[%clk 0:00:40.9]} 19. Qxd8 {[%clk 0:00:40.9]} 19... Rfxd8 {[%clk 0:00:39.6]} 20. f4 {[%clk 0:00:40.6]} 20... Ng4 {[%clk 0:00:38.3]} 21. f5 {[%clk 0:00:39.1]} 21... Bd4+ {[%clk 0:00:36.4]} 22. Kh1 {[%clk 0:00:35.7]} 22... Ne3 {[%clk 0:00:36.3]} 23. Bxe3 {[%clk 0:00:32.9]} 23... Bxe3 {[%clk 0:00:36.1]} 24. fxg6 {[%clk 0:00:32.5]} 24... hxg6 {[%clk 0:00:35.5]} 25. Ne4 {[%clk 0:00:29.3]} 25... Bh6 {[%clk 0:00:34.8]} 26. Nc5 {[%clk 0:00:27.7]} 26... Bg7 {[%clk 0:00:34]} 27. Nb7 {[%clk 0:00:25.7]} 27... Rdb8 {[%clk 0:00:33]} 28. Nc5 {[%clk 0:00:23.3]} 28... Rxb2 {[%clk 0:00:32.3]} 29. Rad1 {[%clk 0:00:22.9]} 29... Rab8 {[%clk 0:00:31.3]} 30. Nd7 {[%clk 0:00:21]} 30... Rd8 {[%clk 0:00:30.1]} 31. Rf3 {[%clk 0:00:19.2]} 31... Rbb8 {[%clk 0:00:27.4]} 32. Rh3 {[%clk 0:00:18]} 32... Rbc8 {[%clk 0:00:25.9]} 33. a3 {[%clk 0:00:16.5]} 33... e6 {[%clk 0:00:24]} 34. Rdd3 {[%clk 0:00:14.9]} 34... Bb2 {[%clk 0:00:22.9]} 35. g3 {[%clk 0:00:11.8]} 35... Rc3 {[%clk 0:00:21.8]} 36. Rxc3 {[%clk 0:00:09.9]} 36... Bxc3 {[%clk 0:00:21.2]} 37. Kg2 {[%clk 0:00:09]} 37... Rxd7 {[%clk 0:00:20.5]} 38. g4 {[%clk 0:00:08.1]} 38... Rd2+ {[%clk 0:00:19.8]} 39. Kf3 {[%clk 0:00:07.7]} 39... Bg7 {[%clk 0:00:19.5]} 40. Rh4 {[%clk 0:00:05.9]} 40... Rb2 {[%clk 0:00:19.2]} 41. Ke4 {[%clk 0:00:04.2]} 41... Rb3 {[%clk 0:00:18.2]} 42. h3 {[%clk 0:00:03.9]} 42... Rxa3 {[%clk 0:00:17.7]} 43. Kf4 {[%clk 0:00:02.3]} 43... Rc3 {[%clk 0:00:17.2]} 44. g5 {[%clk 0:00:02.1]} 44... Rc4+ {[%clk 0:00:16.4]} 45. Kf3 {[%clk 0:00:01.9]} 45... Rxh4 {[%clk 0:00:16]} 46. Kg3 {[%clk 0:00:00.2]} 46... Rh5 {[%clk 0:00:15.5]} 0-1
+"""  # noqa
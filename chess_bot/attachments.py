@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import logging
+import time
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import aiohttp
+
+from .fetch import LazySession
+
+DEFAULT_ATTACHMENT_INDEX_ENTRIES = 4096
+# Unsigned attachment URLs carry no expiry, Discord stops serving them after about a day
+DEFAULT_ATTACHMENT_MAX_AGE = 20 * 60 * 60.0
+# URLs are not linked this close to their expiry, the embed has to load before the link dies
+EXPIRY_MARGIN = 15 * 60.0
+# A URL is checked again with the CDN when it was last checked this long ago
+DEFAULT_VERIFY_INTERVAL = 5 * 60.0
+VERIFY_TIMEOUT = 5.0
+
+
+class UploadedGIF(NamedTuple):
+    url: str
+    pgn: str
+    expires_at: float
+    verified_at: float
+
+
+def url_expiry(url: str) -> Optional[float]:
+    """Return when a signed CDN URL expires, from its ex parameter, a hex timestamp"""
+    expiry = parse_qs(urlsplit(url).query).get("ex")
+    if not expiry:
+        return None
+    try:
+        return float(int(expiry[0], 16))
+    except ValueError:
+        return None
+
+
+class AttachmentIndex:
+    """Remembers the CDN URL of the GIFs already uploaded, so they can be linked instead of uploaded
+
+    Entries are kept by render key until their URL is about to expire. A URL not checked recently
+    is checked with a HEAD request, as the message it was attached to may have been deleted. The
+    checks share a keep-alive HTTP session.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_ATTACHMENT_INDEX_ENTRIES,
+        max_age: float = DEFAULT_ATTACHMENT_MAX_AGE,
+        verify_interval: float = DEFAULT_VERIFY_INTERVAL,
+    ):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.verify_interval = verify_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, UploadedGIF] = OrderedDict()
+        self._session = LazySession(
+            lambda: aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=VERIFY_TIMEOUT))
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self._session.get()
+
+    async def close(self):
+        await self._session.close()
+
+    async def get(self, key: str) -> Optional[UploadedGIF]:
+        """Return the uploaded GIF for a render key, None if there is none or its URL is gone"""
+        uploaded = self._entries.get(key)
+        now = time.time()
+        if uploaded is None or uploaded.expires_at - EXPIRY_MARGIN <= now:
+            self._miss(key)
+            return None
+
+        if now - uploaded.verified_at >= self.verify_interval:
+            if not await is_reachable(self.session, uploaded.url):
+                logging.info("Uploaded GIF is gone, uploading it again: %s", uploaded.url)
+                self._miss(key)
+                return None
+            uploaded = uploaded._replace(verified_at=now)
+            self._entries[key] = uploaded
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return uploaded
+
+    def put(self, key: str, url: str, pgn: str):
+        """Remember the URL a GIF was uploaded to"""
+        now = time.time()
+        expires_at = url_expiry(url)
+        if expires_at is None:
+            expires_at = now + self.max_age
+        self._entries[key] = UploadedGIF(url, pgn, min(expires_at, now + self.max_age), verified_at=now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _miss(self, key: str):
+        self._entries.pop(key, None)
+        self.misses += 1
+
+
+async def is_reachable(session: aiohttp.ClientSession, url: str) -> bool:
+    """Check the CDN still serves a URL"""
+    try:
+        async with session.head(url, allow_redirects=True) as response:
+            return response.status == 200
+    except Exception as e:
+        logging.warning("Could not check %s: %r", url, e)
+        return False
@@ -1,197 +1,1091 @@
 from __future__ import annotations
 
 import asyncio
-from contextlib import contextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
 import functools
 import json
 import logging
+import math
+import os
 from pathlib import Path
-import re
-import subprocess
-from typing import Optional
+from typing import AsyncContextManager, AsyncIterator, Optional, TypeVar, Union
 import uuid
+import weakref
 
 import discord
 from discord.ext import commands
 
-PGN_HEADER_PATTERN = r"(?<=\[{header}\s\")([a-zA-Z\s0-9\-\/\.\:]+)"
+from .attachments import AttachmentIndex, UploadedGIF
+from .budget import DEFAULT_BOARD_SIZE, DEFAULT_UPLOAD_LIMIT, GIFTooLargeError, SizeBudget
+from .cache import CachedGIF, GIFCache, PGNCache, make_cache_key
+from .fetch import FetchError, GameFetcher
+from .interactions import (
+    GIF_COMMAND_NAME,
+    INTERACTION_CREATE,
+    ORIGINAL,
+    Interaction,
+    InteractionMessage,
+    register_commands,
+)
+from .logs import Payload, correlate
+from .metrics import GIF_BYTES, OVERSIZED_RENDERS, REJECTED_REQUESTS, RENDER_QUEUE, STAGE_ERRORS, track_stage
+from .pgn import Game, as_game
+from .process import (
+    NO_LIMITS,
+    ProcessError,
+    ProcessKilledError,
+    ProcessLimits,
+    ProcessTimeoutError,
+    run_process,
+    run_process_sync,
+)
+from .progress import QUEUED, RENDERING, RenderProgress
+from .ratelimit import RateLimitedError, RateLimiter
+from .render import NativeRenderer
+from .request import MISSING_SEARCH_OPTION_ERROR, RenderRequest, parse_message, parse_options, split_batch
+from .scheduler import RenderScheduler, RenderTicket, SchedulerBusyError
+from .singleflight import SingleFlight
+from .spool import GIFOutput, GIFSpool, RenderedGIF, gif_size, open_gif_file, unlink_gif
+from .transcode import TRANSCODED_FORMATS, transcode
+from .worker import RenderQueue, loggable_c2g_args
+
+# c2g can only write to a path, have it write to the pipe we read from
+C2G_STDOUT = "/dev/stdout"
+# Requests without format: are rendered in the default format, which is not picked per request
+DEFAULT_FORMAT = "gif"
+# What renders GIFs, they look different so their renders and cache entries are kept apart
+C2G_RENDERER = "c2g"
+NATIVE_RENDERER = "native"
+# Formats Discord shows inside an embed, anything else is shown as an attachment
+EMBEDDED_FORMATS = ("gif", "png", "webp")
+# cgf can't answer last:N, only the HTTP fetcher can
+ONLY_LATEST_GAME_ERROR = "I can only fetch a player's latest game right now"
+T = TypeVar("T")
 
 
 class Chess2GIF(commands.Cog):
-    def __init__(self, bot):
+    def __init__(
+        self,
+        bot,
+        scheduler: Optional[RenderScheduler] = None,
+        gif_cache: Optional[GIFCache] = None,
+        pgn_cache: Optional[PGNCache] = None,
+        spool: Optional[GIFSpool] = None,
+        render_queue: Optional[RenderQueue] = None,
+        size_budget: Optional[SizeBudget] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        shed_queue_depth: Optional[int] = None,
+        attachment_index: Optional[AttachmentIndex] = None,
+        fetch_limits: ProcessLimits = NO_LIMITS,
+        render_limits: ProcessLimits = NO_LIMITS,
+        placeholders: bool = False,
+        fetcher: Optional[GameFetcher] = None,
+        renderer: Optional[NativeRenderer] = None,
+        default_format: str = DEFAULT_FORMAT,
+        mentions: bool = True,
+    ):
         self.bot = bot
+        self.scheduler = scheduler if scheduler is not None else RenderScheduler()
+        self.gif_cache = gif_cache
+        self.pgn_cache = pgn_cache
+        self.spool = spool
+        self.render_queue = render_queue
+        self.size_budget = size_budget if size_budget is not None else SizeBudget()
+        self.rate_limiter = rate_limiter
+        # Batches are turned away once this many renders are waiting, saving the queue for single games
+        self.shed_queue_depth = shed_queue_depth
+        self.attachment_index = attachment_index
+        self.fetch_limits = fetch_limits
+        self.render_limits = render_limits
+        # Fetches games over HTTP instead of with cgf, when given
+        self.fetcher = fetcher
+        # Renders GIFs without c2g, when given
+        self.renderer = renderer
+        # PNGs are always rendered natively, c2g only renders GIFs
+        self.png_renderer = renderer if renderer is not None else NativeRenderer(processes=1)
+        # The format of requests that don't choose one
+        self.default_format = default_format
+        # Answer messages mentioning the bot, on top of /gif commands
+        self.mentions = mentions
+        self.renders = SingleFlight()
+        # Post a placeholder right away for requests that need a render, edited as the render advances
+        self.placeholders = placeholders
+        # Progress of the renders in flight, by request key, gone once nothing follows it
+        self.progress: weakref.WeakValueDictionary[tuple[str, ...], RenderProgress] = (
+            weakref.WeakValueDictionary()
+        )
+        # Tasks answering messages, by message id, cancelled if their message is deleted
+        self.in_flight: dict[int, asyncio.Task] = {}
+
+        RENDER_QUEUE.set_function("queued", function=lambda: self.scheduler.queue_depth)
+        RENDER_QUEUE.set_function("running", function=lambda: self.scheduler.running)
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         """Return the GIF of a chess game"""
-        check, error = is_valid_message(message, self.bot.user)
-        if check is False:
-            if error is not None:
-                # Communicate to the user if there is an error because, apparently,
-                # the message was not supposed to be ignored.
-                await self.handle_message_not_valid_error(message, error)
+        if not self.mentions:
+            return
+        with track_stage("validation"):
+            request, error = parse_message(message, self.bot.user)
+        if request is None and error is None:
             return
+        await self.answer(message, request, error)
 
-        args = process_message(message)
-        file_name = str(uuid.uuid4())
+    @commands.Cog.listener()
+    async def on_socket_response(self, payload: dict):
+        """Answer /gif commands, discord.py dispatches interactions as raw gateway events only"""
+        if payload.get("t") != INTERACTION_CREATE:
+            return
+        interaction = Interaction(self.bot, payload["d"])
+        if interaction.is_command(GIF_COMMAND_NAME):
+            await self.on_gif_command(interaction)
+
+    async def on_gif_command(self, interaction: Interaction):
+        """Return the GIF of a chess game, deferring the response as renders take longer than 3 seconds"""
+        with track_stage("validation"):
+            request, error = parse_options(interaction.options)
+        if request is None or error is not None:
+            STAGE_ERRORS.inc("validation")
+            logging.error("Not valid command: %s, failed with %s", interaction, error)
+            await interaction.respond(error or MISSING_SEARCH_OPTION_ERROR, ephemeral=True)
+            return
+
+        await interaction.defer()
+        try:
+            await self.answer(interaction, request, None)
+        finally:
+            if not interaction.channel.responded:
+                # Requests turned away silently, like repeated ones over a rate limit, stop thinking
+                await delete_message(InteractionMessage(interaction, ORIGINAL))
 
-        with tmp_file_path(f"{file_name}.gif") as output_path:
-            game_pgn, error = create_gif(args, output_path)
+    async def answer(
+        self,
+        message: Union[discord.Message, Interaction],
+        request: Optional[RenderRequest],
+        error: Optional[str],
+    ):
+        """Answer a request made by mentioning the bot or with /gif, replying in the same channel"""
+        # Logged with the id of the message or interaction, through fetching, rendering and uploading
+        with correlate(str(message.id)):
+            if request is not None:
+                batch, error = split_batch(request)
+                # Attachments in a message share the upload limit
+                limit = upload_limit(message) // max(len(batch), 1)
+                batch = [
+                    request._replace(upload_limit=limit, format=request.format or self.default_format)
+                    for request in batch
+                ]
 
-            if error is not None or game_pgn is None:
-                await self.handle_subprocess_error(message, error)
+            if request is None or error is not None:
+                if error is not None:
+                    # Communicate to the user if there is an error because, apparently,
+                    # the message was not supposed to be ignored.
+                    STAGE_ERRORS.inc("validation")
+                    await self.handle_message_not_valid_error(message, error)
                 return
 
-            embed, gif_file = make_gif_embed(game_pgn, Path(output_path))
-            await message.channel.send(embed=embed, file=gif_file)
+            try:
+                self.admit(message, batch)
+            except RateLimitedError as e:
+                await self.handle_rate_limited_error(message, e)
+                return
+            except SchedulerBusyError as e:
+                await self.handle_scheduler_busy_error(message, e)
+                return
+
+            task = asyncio.current_task()
+            if task is not None:
+                self.in_flight[message.id] = task
+            try:
+                if len(batch) > 1:
+                    await self.send_batch(message, batch)
+                else:
+                    await self.send_single(message, batch[0])
+            except asyncio.CancelledError:
+                logging.info("Cancelled: %s", message)
+                raise
+            finally:
+                self.in_flight.pop(message.id, None)
+
+    @property
+    def gif_renderer(self) -> str:
+        """The name of what renders GIFs, workers always render with c2g"""
+        if self.renderer is not None and self.render_queue is None:
+            return NATIVE_RENDERER
+        return C2G_RENDERER
+
+    @commands.Cog.listener()
+    async def on_message_delete(self, message: discord.Message):
+        """Stop working on a deleted message, killing its processes unless others are waiting on them"""
+        task = self.in_flight.get(message.id)
+        if task is not None:
+            task.cancel()
+
+    def cog_unload(self):
+        for task in self.in_flight.values():
+            task.cancel()
+        if self.fetcher is not None:
+            asyncio.ensure_future(self.fetcher.close())
+        if self.attachment_index is not None:
+            asyncio.ensure_future(self.attachment_index.close())
+        if self.renderer is not None:
+            self.renderer.close()
+        self.png_renderer.close()
+
+    async def send_single(self, message: discord.Message, request: RenderRequest):
+        """Fetch and render a game, replying with its GIF"""
+        game = self.get_cached_game(request)
+        if game is None and request.search_type != "id":
+            # A player's GIF can only be looked up with their game
+            game = await self.resolve_game(message, request)
+            if game is None:
+                return
+
+        uploaded = await self.get_uploaded_gif(request, game)
+        if uploaded is not None:
+            # Games already posted can skip rendering and uploading entirely
+            await self.send_uploaded_gif(message, Game.from_pgn(uploaded.pgn), uploaded.url)
+            return
+
+        cached = self.get_cached_gif(request, game)
+        if cached is not None:
+            # Games already rendered can skip fetching and rendering entirely
+            await self.send_gif(message, request, Game.from_pgn(cached.pgn), cached.path)
+            return
+
+        if game is None:
+            game = await self.resolve_game(message, request)
+            if game is None:
+                return
+
+        try:
+            ticket = self.enqueue_render(message, request, game)
+        except SchedulerBusyError as e:
+            await self.handle_scheduler_busy_error(message, e)
+            return
+
+        placeholder: Optional[Placeholder] = None
+        try:
+            gif_context = self.acquire_gif(request, ticket, game)
+            progress = self.progress.get(request_key(request, self.gif_renderer))
+            if self.placeholders and progress is not None:
+                # Posted while the render starts, not before
+                placeholder = Placeholder(message.channel, progress, ticket)
+            elif ticket is not None and ticket.queued:
+                ahead = self.scheduler.ahead(ticket)
+                await message.channel.send(
+                    f"Your game is queued behind {ahead} other request(s), I'll post it shortly"
+                )
+
+            async with gif_context as (game, gif, error):
+                if error is not None or game is None:
+                    await self.handle_subprocess_error(message, error)
+                    return
+
+                footer = None
+                if ticket is not None and ticket.queued:
+                    footer = f"Waited {ticket.wait_time:.1f}s in the render queue"
+                await self.send_gif(message, request, game, gif, footer=footer, placeholder=placeholder)
+        except GIFTooLargeError as e:
+            await self.handle_gif_too_large_error(message, e)
+        except ProcessError as e:
+            await self.handle_process_error(message, e)
+        finally:
+            if placeholder is not None:
+                await placeholder.close()
+            if ticket is not None:
+                self.release_unused_ticket(ticket)
+
+    async def send_batch(self, message: discord.Message, batch: list[RenderRequest]):
+        """Fetch and render several games concurrently, replying with a single message"""
+        # Games asked for more than once are fetched and rendered once
+        keys = [request_key(request, self.gif_renderer) for request in batch]
+        distinct: dict[tuple[str, ...], RenderRequest] = {}
+        for key, request in zip(keys, batch):
+            distinct.setdefault(key, request)
+
+        # Fetched concurrently before queueing, render slots are only held while rendering
+        results = await asyncio.gather(
+            *(self.fetch_game(request) for request in distinct.values()), return_exceptions=True
+        )
+        fetched_by_key = dict(zip(distinct, results))
+        fetched = [fetched_by_key[key] for key in keys]
+
+        reserved: dict[tuple[str, ...], Optional[RenderTicket]] = {}
+        try:
+            for key, request in distinct.items():
+                result = fetched_by_key[key]
+                game = result[0] if isinstance(result, tuple) else None
+                reserved[key] = self.enqueue_render(message, request, game) if game is not None else None
+        except SchedulerBusyError as e:
+            for ticket in reserved.values():
+                if ticket is not None:
+                    self.scheduler.cancel(ticket)
+            await self.handle_scheduler_busy_error(message, e)
+            return
+        # Only the first of the duplicates starts the render, the others join it
+        tickets = [reserved.pop(key, None) for key in keys]
+
+        placeholder = None
+        try:
+            if self.placeholders:
+                placeholder = await message.channel.send(f"GIFing {len(batch)} games, I'll post them shortly")
+            await self.send_batch_results(message, batch, fetched, tickets)
+        finally:
+            if placeholder is not None:
+                await delete_message(placeholder)
+            for ticket in tickets:
+                if ticket is not None:
+                    self.release_unused_ticket(ticket)
+
+    async def send_batch_results(
+        self,
+        message: discord.Message,
+        batch: list[RenderRequest],
+        fetched: list[Union[tuple[Optional[Game], Optional[str]], BaseException]],
+        tickets: list[Optional[RenderTicket]],
+    ):
+        async with AsyncExitStack() as stack:
+            results = await asyncio.gather(
+                *(self.acquire_batch_gif(stack, r, f, t) for r, f, t in zip(batch, fetched, tickets)),
+                return_exceptions=True,
+            )
+
+            lines, files, uploads = [], [], []
+            for position, (request, result) in enumerate(zip(batch, results), start=1):
+                if isinstance(result, GIFTooLargeError):
+                    lines.append(f"{position}. {request.id_or_username} is too long to fit in this message")
+                    continue
+                if isinstance(result, ProcessError):
+                    logging.error("Processing: %s, failed with %s", request, Payload(result))
+                    lines.append(f"{position}. {request.id_or_username} {describe_process_error(result)}")
+                    continue
+                if isinstance(result, BaseException):
+                    raise result
+                game, gif, error = result
+                if error is not None or game is None or gif is None:
+                    logging.error("Processing: %s, failed with %s", request, Payload(error))
+                    lines.append(f"{position}. I could not find {request.id_or_username}")
+                    continue
+
+                with track_stage("embed"):
+                    lines.append(f"{position}. {make_game_title(game)}")
+                    files.append(open_gif_file(gif))
+                    uploads.append((request, game))
+
+            with track_stage("upload"):
+                sent = await message.channel.send("\n".join(lines), files=files or None)
+            # Attachments are returned in the order they were sent
+            for (request, game), attachment in zip(uploads, sent.attachments):
+                self.remember_upload(request, game, attachment.url)
+
+    async def acquire_batch_gif(
+        self,
+        stack: AsyncExitStack,
+        request: RenderRequest,
+        fetched: Union[tuple[Optional[Game], Optional[str]], BaseException],
+        ticket: Optional[RenderTicket],
+    ) -> tuple[Optional[Game], Optional[GIFOutput], Optional[str]]:
+        """Get the GIF for a game of a batch, valid until the stack exits"""
+        if isinstance(fetched, BaseException):
+            raise fetched
+        game, error = fetched
+        if error is not None or game is None:
+            return None, None, error
+        return await stack.enter_async_context(self.acquire_gif(request, ticket, game))
+
+    def admit(self, message: discord.Message, batch: list[RenderRequest]):
+        """Turn away requests over the rate limits, or low priority ones when the queue is backed up
+
+        Checked before anything is fetched or rendered, every game in a batch counts as a request.
+        """
+        if self.rate_limiter is not None:
+            try:
+                self.rate_limiter.acquire(
+                    message.author.id, message.channel.id, message.guild and message.guild.id, cost=len(batch)
+                )
+            except RateLimitedError:
+                REJECTED_REQUESTS.inc("rate_limited")
+                raise
+
+        depth = self.scheduler.queue_depth
+        if len(batch) > 1 and self.shed_queue_depth is not None and depth >= self.shed_queue_depth:
+            REJECTED_REQUESTS.inc("shed")
+            raise SchedulerBusyError(f"Shedding a batch of {len(batch)} games ({depth} waiting)")
+
+    def release_unused_ticket(self, ticket: RenderTicket):
+        """Give back a ticket never used, as the render was joined instead or abandoned before starting"""
+        if not ticket.entered:
+            self.scheduler.cancel(ticket)
+
+    def enqueue_render(
+        self, message: discord.Message, request: RenderRequest, game: Game
+    ) -> Optional[RenderTicket]:
+        """Reserve a render slot for the request, None if it can join a render already in flight"""
+        if request_key(request, self.gif_renderer) in self.renders:
+            return None
+        if self.get_cached_gif(request, game) is not None:
+            return None
+        return self.scheduler.enqueue(message.guild and message.guild.id, message.author.id)
+
+    def acquire_gif(
+        self, request: RenderRequest, ticket: Optional[RenderTicket], game: Game
+    ) -> AsyncContextManager[tuple[Optional[Game], GIFOutput, Optional[str]]]:
+        """Get the GIF for a request, from the cache or by joining or starting a render
+
+        The GIF is valid until the returned context manager exits.
+        """
+        cached = self.get_cached_gif(request, game)
+        if cached is not None:
+            return ready((Game.from_pgn(cached.pgn), cached.path, None))
+
+        key = request_key(request, self.gif_renderer)
+        progress = self.progress.get(key)
+        if progress is None:
+            progress = self.progress[key] = RenderProgress(game)
+
+        # Without a spool, c2g writes to the working directory
+        format = request.format or DEFAULT_FORMAT
+        output = self.spool.new(format) if self.spool is not None else Path(f"{uuid.uuid4()}.{format}")
+        job = functools.partial(self.scheduled_render, request, output, ticket, game, progress)
+        cleanup = functools.partial(unlink_render_output, output)
+        return self.renders.join(key, job, cleanup=cleanup)
+
+    async def send_gif(
+        self,
+        message: discord.Message,
+        request: RenderRequest,
+        game: Game,
+        gif: GIFOutput,
+        footer: Optional[str] = None,
+        placeholder: Optional[Placeholder] = None,
+    ):
+        """Reply to a message with the game's GIF embed, linking the GIF if it was uploaded before
+
+        A linked GIF is edited into the placeholder. Messages can't be edited to attach files, so
+        a GIF uploaded is sent in a new message, and the placeholder is left to be deleted.
+        """
+        uploaded = await self.get_uploaded_gif(request, game)
+        if uploaded is not None:
+            await self.send_uploaded_gif(message, game, uploaded.url, footer=footer, placeholder=placeholder)
+            return
+
+        with track_stage("embed"):
+            embed, gif_file = make_gif_embed(game, gif)
+            if footer is not None:
+                embed.set_footer(text=footer)
+
+        with track_stage("upload"):
+            sent = await message.channel.send(embed=embed, file=gif_file)
+        if sent.attachments:
+            self.remember_upload(request, game, sent.attachments[0].url)
+
+    async def send_uploaded_gif(
+        self,
+        message: discord.Message,
+        game: Game,
+        url: str,
+        footer: Optional[str] = None,
+        placeholder: Optional[Placeholder] = None,
+    ):
+        """Reply to a message with an embed of a GIF already uploaded to Discord, in the placeholder if any
+
+        Videos can't be shown in an embed, their link is sent along with it for Discord to play.
+        """
+        embedded = is_embedded(url)
+        with track_stage("embed"):
+            embed = make_game_embed(game, url if embedded else None)
+            if footer is not None:
+                embed.set_footer(text=footer)
+
+        content = None if embedded else url
+        with track_stage("upload"):
+            if placeholder is not None and await placeholder.replace(embed, content=content):
+                return
+            await message.channel.send(content, embed=embed)
+
+    async def get_uploaded_gif(
+        self, request: RenderRequest, game: Optional[Game] = None
+    ) -> Optional[UploadedGIF]:
+        """Look up the attachment a GIF for the request was uploaded as"""
+        if self.attachment_index is None:
+            return None
+
+        key = render_key(request, game, self.gif_renderer)
+        if key is None:
+            return None
+        return await self.attachment_index.get(key)
+
+    def remember_upload(self, request: RenderRequest, game: Game, url: str):
+        if self.attachment_index is None:
+            return
+
+        key = render_key(request, game, self.gif_renderer)
+        if key is not None:
+            self.attachment_index.put(key, url, game.pgn)
+
+    def get_cached_game(self, request: RenderRequest) -> Optional[Game]:
+        """Look up a player's game in the PGN cache, so its GIF can be looked up before queueing a render
+
+        Games requested by id don't need their PGN for that, None is returned for them.
+        """
+        if self.pgn_cache is None or request.search_type == "id":
+            return None
+
+        game_pgn = self.pgn_cache.get(request.id_or_username, request.search_type, request.game)
+        return Game.from_pgn(game_pgn) if game_pgn is not None else None
+
+    def get_cached_gif(self, request: RenderRequest, game: Optional[Game] = None) -> Optional[CachedGIF]:
+        """Look up a previously rendered GIF for the request"""
+        if self.gif_cache is None:
+            return None
+
+        key = render_key(request, game, self.gif_renderer)
+        if key is None:
+            return None
+        return self.gif_cache.get(key)
+
+    async def fetch_game(self, request: RenderRequest) -> tuple[Optional[Game], Optional[str]]:
+        """Fetch the game of a request, going through the PGN cache if there is one"""
+        with track_stage("fetch"):
+            game_pgn, error = await async_get_game_pgn(
+                request.id_or_username,
+                request.search_type,
+                cache=self.pgn_cache,
+                limits=self.fetch_limits,
+                fetcher=self.fetcher,
+                game=request.game,
+            )
+        if error is not None or game_pgn is None:
+            STAGE_ERRORS.inc("fetch")
+            return None, error
+        logging.debug("Fetched %s: %s", request.id_or_username, Payload(game_pgn))
+        return Game.from_pgn(game_pgn), None
+
+    async def resolve_game(self, message: discord.Message, request: RenderRequest) -> Optional[Game]:
+        """Fetch the game of a request before queueing its render, replying if it can't be fetched
+
+        Render slots are only held while rendering, never while waiting on the network.
+        """
+        try:
+            game, error = await self.fetch_game(request)
+        except ProcessError as e:
+            await self.handle_process_error(message, e)
+            return None
+        if error is not None or game is None:
+            await self.handle_subprocess_error(message, error)
+            return None
+        return game
+
+    async def render(
+        self,
+        request: RenderRequest,
+        output: GIFOutput,
+        game: Game,
+        progress: Optional[RenderProgress] = None,
+    ) -> tuple[Optional[Game], GIFOutput, Optional[str]]:
+        """Render a game, going through the GIF cache if there is one
+
+        Returns the game and its GIF, which is either output or a cached file.
+        """
+        cached = self.get_cached_gif(request, game)
+        if cached is not None:
+            return game, cached.path, None
+
+        if progress is not None:
+            progress.advance(RENDERING)
+        with track_stage("render"):
+            error = await self.render_within_budget(game, request, output)
+        if error is not None:
+            STAGE_ERRORS.inc("render")
+            return None, output, error
+        GIF_BYTES.observe(value=gif_size(output))
+
+        if self.gif_cache is not None:
+            key = render_key(request, game, self.gif_renderer)
+            if key is not None:
+                self.gif_cache.put(key, game.pgn, output)
+
+        return game, output, None
+
+    async def render_within_budget(
+        self, game: Game, request: RenderRequest, output: GIFOutput
+    ) -> Optional[str]:
+        """Render at the largest board predicted to fit the upload limit, shrinking it on overshoots
+
+        Raises GIFTooLargeError if even the smallest board can't fit.
+        """
+        limit = request.upload_limit
+        if limit is None or request.format == "png":
+            # A single position is always far under the limit
+            return await self.render_output(game, request, output)
+
+        board_size = self.size_budget.board_size(game.plies, limit)
+        while board_size is not None:
+            error = await self.render_output(game, request._replace(board_size=board_size), output)
+            if error is not None:
+                return error
+
+            size = gif_size(output)
+            if request.format in (None, DEFAULT_FORMAT):
+                # Transcoded GIFs are smaller, they would skew the predictions for GIFs
+                self.size_budget.observe(game.plies, board_size, size)
+            if self.size_budget.fits(size, limit):
+                return None
+
+            OVERSIZED_RENDERS.inc()
+            logging.info("GIF of %s bytes at %spx is over the %s bytes limit", size, board_size, limit)
+            board_size = self.size_budget.retry_size(board_size, size, limit)
+            if isinstance(output, RenderedGIF):
+                output.reset()
+
+        raise GIFTooLargeError(limit)
+
+    async def render_output(self, game: Game, request: RenderRequest, output: GIFOutput) -> Optional[str]:
+        """Render a game in the request's format
+
+        PNGs are rendered natively, webp and mp4 are transcoded from a GIF rendered into the spool.
+        """
+        if request.format == "png":
+            return await self.png_renderer.render(
+                game, request, output, flip=should_flip(game, request), timeout=self.render_limits.timeout
+            )
+        if request.format not in TRANSCODED_FORMATS:
+            return await self.render_gif(game, request, output)
+
+        gif = self.spool.new_path() if self.spool is not None else Path(f"{uuid.uuid4()}.gif")
+        try:
+            error = await self.render_gif(game, request, gif)
+            if error is not None:
+                return error
+            return await transcode(gif, output, request.format, limits=self.render_limits)
+        finally:
+            gif.unlink(missing_ok=True)
+
+    async def render_gif(self, game: Game, request: RenderRequest, output: GIFOutput) -> Optional[str]:
+        """Run c2g in this process or on a render worker, or render natively if there is a renderer"""
+        if self.render_queue is not None:
+            c2g_args = make_c2g_args(game, Path(C2G_STDOUT), request)
+            return await self.render_queue.render(c2g_args[1:], output, timeout=self.render_limits.timeout)
+        if self.renderer is not None:
+            return await self.renderer.render(
+                game, request, output, flip=should_flip(game, request), timeout=self.render_limits.timeout
+            )
+        return await async_render_gif(game, request, output, limits=self.render_limits)
+
+    async def scheduled_render(
+        self,
+        request: RenderRequest,
+        output: GIFOutput,
+        ticket: Optional[RenderTicket],
+        game: Game,
+        progress: Optional[RenderProgress] = None,
+    ) -> tuple[Optional[Game], GIFOutput, Optional[str]]:
+        """Wait for a render slot and render, removing the output if the render is abandoned"""
+        try:
+            if ticket is None:
+                return await self.render(request, output, game, progress)
+            async with ticket:
+                return await self.render(request, output, game, progress)
+        except BaseException:
+            unlink_gif(output)
+            raise
 
     async def handle_message_not_valid_error(self, message: discord.Message, error: str):
         """Handle errors related to potential wrongful invocations of the bot"""
-        logging.error("Not valid message: %s, failed with %s", message, error)
+        logging.error("Not valid message: %s, failed with %s", message, Payload(error))
         await message.channel.send(error)
 
     async def handle_subprocess_error(self, message: discord.Message, error: Optional[str]):
         """Handle errors related to c2g or cgf failing"""
-        logging.error("Processing: %s, failed with %s", message, error)
+        logging.error("Processing: %s, failed with %s", message, Payload(error))
         await message.channel.send("I could not find your chess game")
 
+    async def handle_process_error(self, message: discord.Message, error: ProcessError):
+        """Handle cgf or c2g timing out or being killed, usually for going over their limits"""
+        logging.error("Processing: %s, failed with %s", message, Payload(error))
+        await message.channel.send(f"Your game {describe_process_error(error)}, please try again later")
 
-@contextmanager
-def tmp_file_path(name):
-    """Return a file path that will be deleted after it's used (if it's used)"""
-    path = Path(name)
-    try:
-        yield path
-    finally:
-        path.unlink(missing_ok=True)
-
-
-def is_valid_message(
-    message: discord.Message, bot_user: discord.ClientUser
-) -> tuple[Optional[bool], Optional[str]]:
-    """Check if the message is valid to be processed by the bot"""
-    if message.author == bot_user:
-        # Ignore messages by a bot
-        return False, None
-
-    if not bot_user.mentioned_in(message):
-        # Ignore messages that do not mention the bot
-        return False, None
-
-    if message.mention_everyone is True:
-        # Ignore messages that mention everyone
-        return False, None
-
-    content = message.clean_content.strip().split(" ")
-    if len(content) == 2 and content[1] == "help":
-        # Help messages handled by help command
-        return False, None
-
-    if not any(part.startswith("id:") or part.startswith("player:") for part in content):
-        # All calls to the bot should contain "id:" or "player:"
-        # so this is probably a user error
-        return (
-            False,
-            'Messages must contain "id" or "player", request help for more information: @Chess2GIF help',
+    async def handle_gif_too_large_error(self, message: discord.Message, error: GIFTooLargeError):
+        """Handle games too long to fit in an upload"""
+        logging.warning("Rejecting: %s, %s", message, error)
+        limit = error.limit / (1024 * 1024)
+        await message.channel.send(f"Your game is too long for a GIF under my {limit:.0f}MB upload limit")
+
+    async def handle_rate_limited_error(self, message: discord.Message, error: RateLimitedError):
+        """Handle requests over a rate limit, replying only once in a while to users that keep trying"""
+        logging.warning("Rejecting: %s, %s", message, error)
+        if self.rate_limiter is not None and self.rate_limiter.should_warn(message.author.id):
+            await message.channel.send(f"Slow down! Try again in {math.ceil(error.retry_after)}s")
+
+    async def handle_scheduler_busy_error(self, message: discord.Message, error: SchedulerBusyError):
+        """Handle requests rejected because the render queue is full"""
+        logging.warning("Rejecting: %s, %s", message, error)
+        await message.channel.send(
+            f"I'm busy rendering {self.scheduler.queue_depth} other games, please try again in a minute"
         )
 
-    return True, None
 
+class Placeholder:
+    """A reply posted as soon as a request's game is fetched, edited every time its render advances
+
+    The placeholder is deleted on close, unless the final reply replaced it.
+    """
 
-def process_message(message: discord.Message) -> dict[str, str]:
-    """Handle messages sent to bot"""
-    logging.info("Processing message: %s", message)
-    content = message.clean_content.strip().split(" ")[1:]
-    args = {}
+    def __init__(
+        self, channel: discord.abc.Messageable, progress: RenderProgress, ticket: Optional[RenderTicket]
+    ):
+        self.progress = progress
+        self.ticket = ticket
+        self.replaced = False
+        self.shown = make_progress_embed(progress, ticket)
+        self.sent = asyncio.ensure_future(channel.send(embed=self.shown))
+        self.follower = asyncio.ensure_future(self.follow())
 
-    for arg in content:
-        splitted = arg.split(":")
-        key = splitted[0]
-        value = splitted[1]
+    async def follow(self):
+        """Edit the placeholder every time the render advances to something worth showing"""
+        try:
+            message = await self.sent
+        except discord.HTTPException:
+            return
+        while True:
+            await self.progress.changed()
+            embed = make_progress_embed(self.progress, self.ticket)
+            if embed.to_dict() == self.shown.to_dict():
+                continue
+            self.shown = embed
+            try:
+                await message.edit(embed=embed)
+            except discord.HTTPException as e:
+                logging.warning("Could not edit placeholder: %s", e)
+
+    async def message(self) -> Optional[discord.Message]:
+        """Stop following the render and return the placeholder, None if it could not be posted"""
+        self.follower.cancel()
+        try:
+            return await self.sent
+        except discord.HTTPException as e:
+            logging.warning("Could not post placeholder: %s", e)
+            return None
+
+    async def replace(self, embed: discord.Embed, content: Optional[str] = None) -> bool:
+        """Replace the placeholder with the final reply, returning whether it could be"""
+        message = await self.message()
+        if message is None:
+            return False
+        try:
+            await message.edit(content=content, embed=embed)
+        except discord.HTTPException as e:
+            logging.warning("Could not edit placeholder: %s", e)
+            return False
+        self.replaced = True
+        return True
 
-        if key == "id" or key == "player":
-            args["search_type"] = key
-            args["id_or_username"] = value
+    async def close(self):
+        message = await self.message()
+        if message is not None and not self.replaced:
+            await delete_message(message)
+
+
+async def delete_message(message: discord.Message):
+    try:
+        await message.delete()
+    except discord.HTTPException as e:
+        logging.warning("Could not delete %s: %s", message, e)
 
-        if key == "time":
-            args["time"] = value
 
-        if key == "disable":
-            args["disable"] = value.split(",")
+def describe_process_error(error: ProcessError) -> str:
+    verb = "fetch" if os.path.basename(error.executable) == "cgf" else "render"
+    if isinstance(error, ProcessTimeoutError):
+        return f"took too long to {verb}"
+    if isinstance(error, ProcessKilledError):
+        return f"used too much memory or CPU time to {verb}"
+    return f"could not {verb}"
 
-        if key == "dark" or key == "light":
-            args[key] = value
 
-    return args
+def upload_limit(message: discord.Message) -> int:
+    """Return the maximum size of the attachments in a message to the message's channel"""
+    if message.guild is None:
+        return DEFAULT_UPLOAD_LIMIT
+    return message.guild.filesize_limit
 
 
-def create_gif(args: dict[str, str], output: Path = Path("chess.gif")) -> tuple[Optional[str], Optional[str]]:
-    """Create a chess GIF for the given game ID or player username using c2g"""
-    id_or_username, search_type = args["id_or_username"], args["search_type"]
-    game_pgn, error = get_game_pgn(id_or_username, search_type)
+def unlink_render_output(output: GIFOutput, result: tuple[Optional[Game], GIFOutput, Optional[str]]):
+    """Remove a rendered GIF once every request waiting for it has been answered"""
+    unlink_gif(output)
+
+
+@asynccontextmanager
+async def ready(value: T) -> AsyncIterator[T]:
+    """An async context manager that just returns value"""
+    yield value
+
+
+def create_gif(
+    request: RenderRequest,
+    output: Path = Path("chess.gif"),
+    fetch_limits: ProcessLimits = NO_LIMITS,
+    render_limits: ProcessLimits = NO_LIMITS,
+    renderer: Optional[NativeRenderer] = None,
+) -> tuple[Optional[str], Optional[str]]:
+    """Create a chess GIF for the given game ID or player username using c2g, or a native renderer"""
+    id_or_username, search_type = request.id_or_username, request.search_type
+    game_pgn, error = get_game_pgn(id_or_username, search_type, limits=fetch_limits)
     if error is not None or game_pgn is None:
         return None, error
 
-    game = extract_game_headers(game_pgn, ["Black"])
+    if renderer is not None:
+        game = Game.from_pgn(game_pgn)
+        error = renderer.render_sync(game, request, output, flip=should_flip(game, request))
+        if error is not None:
+            return None, error
+        return game_pgn, None
 
-    c2g_args = concat_c2g_args(game_pgn, output, args)
-    if game.get("Black", "") == id_or_username:
-        # Flip the board if the username is playing as black
-        c2g_args.append("--flip")
+    c2g_args = make_c2g_args(Game.from_pgn(game_pgn), output, request)
 
     logging.info("Saving game to: %s", output)
-    logging.debug("Args: %s", c2g_args)
-    proc = subprocess.run(c2g_args, capture_output=True)
-    error = proc.stderr.decode("utf-8")
+    logging.debug("Args: %s", Payload(c2g_args[2:]))
+    _, error = run_process_sync(c2g_args, limits=render_limits)
     if error != "":
         return None, error
     return game_pgn, None
 
 
-def get_game_pgn(id_or_username: str, search_type: str) -> tuple[Optional[str], Optional[str]]:
-    """Runs cgf to get a PGN for a chess game"""
-    if search_type == "id":
-        proc = subprocess.run(["cgf", id_or_username, "--pgn"], capture_output=True)
-    elif search_type == "player":
-        proc = subprocess.run(["cgf", id_or_username, "--player", "--pgn"], capture_output=True)
+async def async_create_gif(
+    request: RenderRequest,
+    output: Path = Path("chess.gif"),
+    fetch_limits: ProcessLimits = NO_LIMITS,
+    render_limits: ProcessLimits = NO_LIMITS,
+    renderer: Optional[NativeRenderer] = None,
+) -> tuple[Optional[str], Optional[str]]:
+    """Like create_gif, but runs cgf and c2g, or the native renderer, without blocking the event loop"""
+    id_or_username, search_type = request.id_or_username, request.search_type
+    game_pgn, error = await async_get_game_pgn(id_or_username, search_type, limits=fetch_limits)
+    if error is not None or game_pgn is None:
+        return None, error
+
+    game = Game.from_pgn(game_pgn)
+    if renderer is not None:
+        error = await renderer.render(
+            game, request, output, flip=should_flip(game, request), timeout=render_limits.timeout
+        )
     else:
-        raise ValueError('search_type must be either "id" or "player"')
+        error = await async_render_gif(game, request, output, limits=render_limits)
+    if error is not None:
+        return None, error
+    return game_pgn, None
+
+
+async def async_render_gif(
+    game: Union[Game, str], request: RenderRequest, output: GIFOutput, limits: ProcessLimits = NO_LIMITS
+) -> Optional[str]:
+    """Run c2g on an already fetched game without blocking the event loop
+
+    The output is either a path for c2g to write to, or a buffer the GIF is streamed into.
+    Raises ProcessError if c2g is killed or times out.
+    """
+    if isinstance(output, RenderedGIF):
+        c2g_args = make_c2g_args(game, Path(C2G_STDOUT), request)
+        stdout_sink = output.write
+    else:
+        c2g_args = make_c2g_args(game, output, request)
+        stdout_sink = None
 
-    error = proc.stderr.decode("utf-8")
+    logging.info("Saving game to: %s", output.name)
+    logging.debug("Args: %s", loggable_c2g_args(c2g_args[1:]))
+    try:
+        _, error = await run_process(c2g_args, stdout_sink=stdout_sink, limits=limits)
+    finally:
+        if isinstance(output, RenderedGIF):
+            output.finish()
+    if error != "":
+        return error
+    return None
+
+
+def make_c2g_args(game: Union[Game, str], output: Path, request: RenderRequest) -> list[str]:
+    """Build the full c2g command line, flipping the board if the requested player is black"""
+    game = as_game(game)
+    c2g_args = concat_c2g_args(game.pgn, output, request)
+    if should_flip(game, request):
+        c2g_args.append("--flip")
+
+    return c2g_args
+
+
+def should_flip(game: Union[Game, str], request: RenderRequest) -> bool:
+    """Flip the board if the username is playing as black"""
+    return as_game(game).get("Black", "") == request.id_or_username
+
+
+def normalized_c2g_options(request: RenderRequest, renderer: str = C2G_RENDERER) -> list[str]:
+    """Return the c2g options for a request in a canonical order, along with the renderer's name"""
+    if request.format == "png":
+        # A single position is not animated
+        request = request._replace(time=None)
+    options = concat_c2g_args("", Path(), request)[4:]
+    if request.upload_limit is not None and request.format != "png":
+        # The limit decides the board size, but only once the game is fetched
+        options.append(f"--upload-limit={request.upload_limit}")
+    if request.format not in (None, DEFAULT_FORMAT):
+        # GIFs keep the options they had before there were other formats, and their cache entries
+        options.append(f"--format={request.format}")
+    if request.ply is not None:
+        options.append(f"--ply={request.ply}")
+    if renderer != C2G_RENDERER and request.format != "png":
+        # PNGs are always rendered natively, c2g keeps the keys it had before there was another renderer
+        options.append(f"--renderer={renderer}")
+    # The order features are disabled in does not change the output
+    options.sort()
+    return options
+
+
+def request_key(request: RenderRequest, renderer: str = C2G_RENDERER) -> tuple[str, ...]:
+    """Return a key identifying requests that would produce the exact same GIF"""
+    # Usernames are kept as typed, as flipping the board compares them with the PGN as-is
+    key = (request.search_type, request.id_or_username, *normalized_c2g_options(request, renderer))
+    if request.game != 1:
+        key += (f"--game={request.game}",)
+    return key
+
+
+def render_key(
+    request: RenderRequest, game: Optional[Union[Game, str]] = None, renderer: str = C2G_RENDERER
+) -> Optional[str]:
+    """Return the GIF cache key for a request
+
+    Games requested by id never change, so their key only needs the id and can be computed
+    before fetching anything. Any other request needs the fetched PGN, None is returned without it.
+    """
+    options = normalized_c2g_options(request, renderer)
+
+    if request.search_type == "id":
+        return make_cache_key(f"id:{request.id_or_username}", options, flip=False)
+
+    if game is None:
+        return None
+
+    game = as_game(game)
+    return make_cache_key(f"pgn:{game.pgn.strip()}", options, flip=should_flip(game, request))
+
+
+def get_game_pgn(
+    id_or_username: str,
+    search_type: str,
+    cache: Optional[PGNCache] = None,
+    limits: ProcessLimits = NO_LIMITS,
+) -> tuple[Optional[str], Optional[str]]:
+    """Runs cgf to get a PGN for a chess game, raising ProcessError if it is killed or times out"""
+    if cache is not None:
+        game_pgn = cache.get(id_or_username, search_type)
+        if game_pgn is not None:
+            return game_pgn, None
+
+    stdout, error = run_process_sync(make_cgf_args(id_or_username, search_type), limits=limits)
     if error != "":
         return None, error
 
-    return proc.stdout.decode("utf-8"), None
+    game_pgn = stdout.decode("utf-8")
+    if cache is not None:
+        cache.put(id_or_username, search_type, game_pgn)
+    return game_pgn, None
 
 
-def concat_c2g_args(game_pgn: str, output: Path, args: dict[str, str]) -> list[str]:
+async def async_get_game_pgn(
+    id_or_username: str,
+    search_type: str,
+    cache: Optional[PGNCache] = None,
+    limits: ProcessLimits = NO_LIMITS,
+    fetcher: Optional[GameFetcher] = None,
+    game: int = 1,
+) -> tuple[Optional[str], Optional[str]]:
+    """Like get_game_pgn, but runs cgf without blocking the event loop
+
+    With a fetcher, the game is fetched over HTTP in-process, and cgf is only run for the lookups
+    the fetcher can't do. game picks one of a player's latest games, only the fetcher can fetch
+    other games than the latest.
+    """
+    if cache is not None:
+        game_pgn = cache.get(id_or_username, search_type, game)
+        if game_pgn is not None:
+            return game_pgn, None
+
+    fetched: Optional[tuple[Optional[str], Optional[str]]] = None
+    if fetcher is not None:
+        try:
+            fetched = await fetcher.fetch(id_or_username, search_type, game)
+        except FetchError as e:
+            if game != 1:
+                return None, f"I could not fetch {id_or_username}'s latest games, please try again later"
+            logging.info("Fetching with cgf: %s", e)
+
+    if fetched is not None:
+        fetched_pgn, error = fetched
+        if error is not None or fetched_pgn is None:
+            return None, error
+        game_pgn = fetched_pgn
+    elif game != 1:
+        # cgf can only fetch a player's latest game
+        return None, ONLY_LATEST_GAME_ERROR
+    else:
+        stdout, error = await run_process(make_cgf_args(id_or_username, search_type), limits=limits)
+        if error != "":
+            return None, error
+        game_pgn = stdout.decode("utf-8")
+
+    if cache is not None:
+        cache.put(id_or_username, search_type, game_pgn, game)
+    return game_pgn, None
+
+
+def make_cgf_args(id_or_username: str, search_type: str) -> list[str]:
+    if search_type == "id":
+        return ["cgf", id_or_username, "--pgn"]
+    elif search_type == "player":
+        return ["cgf", id_or_username, "--player", "--pgn"]
+    else:
+        raise ValueError('search_type must be either "id" or "player"')
+
+
+def concat_c2g_args(game_pgn: str, output: Path, request: RenderRequest) -> list[str]:
     c2g_args = ["c2g", game_pgn, "-o", str(output)]
 
-    delay = None
-    if "time" in args.keys():
-        time = args["time"]
-        if time != "real":
-            delay = "--delay=" + str(time)
-        else:
-            delay = "--delay=real"
-        c2g_args.append(delay)
-
-    if "disable" in args.keys():
-        for feat in args["disable"]:
-            c2g_args.append("--no-" + feat)
-
-    if "light" in args.keys() or "dark" in args.keys():
-        for color in ("dark", "light"):
-            rgb = args.get(color)
-            if rgb is None:
-                continue
-            c2g_args.append(f"--{color}=" + rgb + ",1")
+    if request.time is not None:
+        c2g_args.append(f"--delay={request.time}")
+
+    for feature in request.disable:
+        c2g_args.append("--no-" + feature)
+
+    for color, rgb in (("dark", request.dark), ("light", request.light)):
+        if rgb is not None:
+            c2g_args.append(f"--{color}={rgb},1")
+
+    if request.board_size is not None and request.board_size != DEFAULT_BOARD_SIZE:
+        # c2g already renders boards of the default size
+        c2g_args.append(f"--size={request.board_size}")
 
     return c2g_args
 
 
-def make_gif_embed(pgn: str, gif_file_path: Path) -> tuple[discord.Embed, discord.File]:
-    """Create a discord.Embed with a Chess GIF File"""
+def make_gif_embed(pgn: Union[Game, str], gif_file_path: GIFOutput) -> tuple[discord.Embed, discord.File]:
+    """Create a discord.Embed with a Chess GIF File, or PNG, WebP or MP4 file
+
+    Images are shown in the embed, videos are only attached to the message.
+    """
+    gif_file = open_gif_file(gif_file_path)
+    image_url = f"attachment://{gif_file_path.name}" if is_embedded(gif_file_path.name) else None
+    embed = make_game_embed(pgn, image_url)
+    return embed, gif_file
+
+
+def is_embedded(name: str) -> bool:
+    """Check a file name or URL is of a format Discord shows inside an embed"""
+    path = name.partition("?")[0]
+    return path.rpartition(".")[2].lower() in EMBEDDED_FORMATS
+
+
+def make_game_embed(pgn: Union[Game, str], image_url: Optional[str]) -> discord.Embed:
+    """Create a discord.Embed describing a game, showing the image at image_url if there is one"""
     inline_headers = [
         "Date",
         "Result",
@@ -199,14 +1093,8 @@ def make_gif_embed(pgn: str, gif_file_path: Path) -> tuple[discord.Embed, discor
     ]
     headers = ["White", "Black", "WhiteElo", "BlackElo", "Link"]
     game = extract_game_headers(pgn, headers + inline_headers)
-    gif_file = discord.File(gif_file_path)
 
-    title = "{white} ({white_rating}) ♔ vs {black} ({black_rating}) ♚".format(
-        white=game.get("White", "Anonymous"),
-        white_rating=game.get("WhiteElo", "N/A"),
-        black=game.get("Black", "Anonymous"),
-        black_rating=game.get("BlackElo", "N/A"),
-    )
+    title = make_game_title(game)
     logging.info("Creating embed: %s", title)
 
     embed = discord.Embed(title=title, color=discord.Color.green())
@@ -221,39 +1109,82 @@ def make_gif_embed(pgn: str, gif_file_path: Path) -> tuple[discord.Embed, discor
         if value is not None:
             embed.add_field(name=header, value=game[header], inline=True)
 
-    embed.set_image(url=f"attachment://{gif_file_path.name}")
+    if image_url is not None:
+        embed.set_image(url=image_url)
 
-    return embed, gif_file
+    return embed
+
+
+def make_progress_embed(progress: RenderProgress, ticket: Optional[RenderTicket] = None) -> discord.Embed:
+    """Create the placeholder embed for a request, describing its game and how far its render is"""
+    embed = make_game_embed(progress.game, None)
+    if progress.stage == QUEUED and ticket is not None and ticket.queued:
+        embed.description = f"Queued behind {ticket.scheduler.ahead(ticket)} other request(s)"
+    else:
+        embed.description = "Rendering the GIF..."
+    return embed
+
+
+def make_game_title(game: Union[Game, dict[str, str]]) -> str:
+    return "{white} ({white_rating}) ♔ vs {black} ({black_rating}) ♚".format(
+        white=game.get("White", "Anonymous"),
+        white_rating=game.get("WhiteElo", "N/A"),
+        black=game.get("Black", "Anonymous"),
+        black_rating=game.get("BlackElo", "N/A"),
+    )
 
 
-def extract_game_headers(pgn: str, headers: list[str]) -> dict[str, str]:
-    """Extract headers from a PGN string"""
-    logging.debug("Processing PGN: %s", pgn)
+def extract_game_headers(pgn: Union[Game, str], headers: list[str]) -> dict[str, str]:
+    """Extract headers from a PGN string or an already parsed game"""
+    game = as_game(pgn)
     result = {}
 
     for header in headers:
-        logging.debug("Finding header: %s", PGN_HEADER_PATTERN.format(header=header))
-        match = re.search(PGN_HEADER_PATTERN.format(header=header), pgn, flags=re.IGNORECASE)
-        if match is not None:
-            logging.debug("Header found: %s", match)
-            result[header] = match.group()
+        value = game.get(header)
+        if value is not None:
+            result[header] = value
 
     return result
 
 
-bot = commands.Bot(
-    command_prefix=commands.when_mentioned,
-    description="Turn your chess games into GIFs!",
-    help=commands.DefaultHelpCommand(),
-)
-
+def make_bot(
+    shard_count: Optional[int] = None, shard_ids: Optional[list[int]] = None, mentions: bool = True
+) -> commands.Bot:
+    """Create the bot, sharded if a shard count is given
 
-@bot.event
-async def on_ready():
-    logging.info("Connected as %s", bot.user)
-    await bot.change_presence(
-        activity=discord.Activity(name="@Chess2GIF help", type=discord.ActivityType.listening)
+    Without mentions, the bot is only used through /gif and never receives the messages sent
+    in its servers.
+    """
+    intents = discord.Intents.default()
+    intents.messages = mentions
+    options = dict(
+        command_prefix=commands.when_mentioned,
+        description="Turn your chess games into GIFs!",
+        help=commands.DefaultHelpCommand(),
+        intents=intents,
     )
+    if shard_count is None:
+        new_bot = commands.Bot(**options)
+    else:
+        new_bot = commands.AutoShardedBot(shard_count=shard_count, shard_ids=shard_ids, **options)
+    # on_ready runs again on every reconnect, commands only need registering once
+    registered = False
+
+    @new_bot.event
+    async def on_ready():
+        nonlocal registered
+        logging.info("Connected as %s with shards %s", new_bot.user, shard_ids or "all")
+        await new_bot.change_presence(
+            activity=discord.Activity(
+                name="@Chess2GIF help" if mentions else "/gif", type=discord.ActivityType.listening
+            )
+        )
+        if not registered and (shard_ids is None or 0 in shard_ids):
+            # Commands are global, registering them from one process is enough
+            registered = await register_commands(new_bot)
+
+    new_bot.add_cog(Chess2GIF(new_bot, mentions=mentions))
+    return new_bot
 
 
-bot.add_cog(Chess2GIF(bot))
+bot = make_bot()
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from typing import Optional, Sequence
+
+# Discord's attachment limit for servers without boosts, and for direct messages
+DEFAULT_UPLOAD_LIMIT = 8 * 1024 * 1024
+# Room left in the upload for the embed and the multipart encoding
+UPLOAD_OVERHEAD = 64 * 1024
+# Board sizes in pixels, largest first
+DEFAULT_BOARD_SIZE = 640
+BOARD_SIZES = (DEFAULT_BOARD_SIZE, 512, 400, 320, 256)
+# Starting guesses for the size model, refined by every render
+INITIAL_BASE_BYTES_PER_PIXEL = 0.1
+INITIAL_BYTES_PER_PLY_PIXEL = 0.05
+# Games predicted to be this many times over the limit at the smallest board size are not rendered
+UNDELIVERABLE_RATIO = 2.0
+
+
+class GIFTooLargeError(Exception):
+    """Raised when a game can't be rendered into a GIF small enough to upload"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"GIF would not fit in {limit} bytes")
+        self.limit = limit
+
+
+class SizeBudget:
+    """Chooses the board size of a render so its GIF fits in an upload limit
+
+    A GIF's size is predicted from the number of pixels in the board, as the cost of the first
+    frame plus the cost of every ply. The cost per ply is learnt from the renders observed.
+    """
+
+    def __init__(
+        self,
+        board_sizes: Sequence[int] = BOARD_SIZES,
+        base_bytes_per_pixel: float = INITIAL_BASE_BYTES_PER_PIXEL,
+        bytes_per_ply_pixel: float = INITIAL_BYTES_PER_PLY_PIXEL,
+        smoothing: float = 0.2,
+    ):
+        self.board_sizes = sorted(board_sizes, reverse=True)
+        self.base_bytes_per_pixel = base_bytes_per_pixel
+        self.bytes_per_ply_pixel = bytes_per_ply_pixel
+        self.smoothing = smoothing
+
+    def predict(self, plies: int, board_size: int) -> float:
+        """Predict the size in bytes of a GIF"""
+        return board_size ** 2 * (self.base_bytes_per_pixel + plies * self.bytes_per_ply_pixel)
+
+    def observe(self, plies: int, board_size: int, size: int):
+        """Learn from the actual size of a rendered GIF"""
+        if plies == 0:
+            return
+        pixels = board_size ** 2
+        bytes_per_ply_pixel = max(size / pixels - self.base_bytes_per_pixel, 0.0) / plies
+        self.bytes_per_ply_pixel += self.smoothing * (bytes_per_ply_pixel - self.bytes_per_ply_pixel)
+
+    def fits(self, size: int, limit: int) -> bool:
+        return size <= limit - UPLOAD_OVERHEAD
+
+    def board_size(self, plies: int, limit: int) -> Optional[int]:
+        """Return the largest board size predicted to fit, None if the game is clearly too long"""
+        budget = limit - UPLOAD_OVERHEAD
+        for board_size in self.board_sizes:
+            if self.predict(plies, board_size) <= budget:
+                return board_size
+
+        smallest = self.board_sizes[-1]
+        if self.predict(plies, smallest) <= budget * UNDELIVERABLE_RATIO:
+            # The prediction may be off, worth a try
+            return smallest
+        return None
+
+    def retry_size(self, board_size: int, size: int, limit: int) -> Optional[int]:
+        """Return a smaller board size for a GIF that overshot, None if none of them would fit
+
+        The GIF just rendered is a better predictor than the model, as size grows with the pixels.
+        """
+        budget = limit - UPLOAD_OVERHEAD
+        for smaller in self.board_sizes:
+            if smaller < board_size and size * (smaller / board_size) ** 2 <= budget:
+                return smaller
+        return None
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+from pathlib import Path
+import shutil
+import time
+from typing import NamedTuple, Optional, Sequence
+import uuid
+
+from .metrics import PGN_CACHE_LOOKUPS
+from .request import FORMATS
+from .spool import GIFOutput
+
+DEFAULT_GIF_CACHE_SIZE = 512 * 1024 * 1024
+DEFAULT_PGN_CACHE_ENTRIES = 1024
+DEFAULT_PGN_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_PLAYER_PGN_TTL = 60.0
+# Temporary files younger than this may belong to another process sharing the cache directory
+STALE_TMP_AGE = 3600.0
+
+
+class CachedGIF(NamedTuple):
+    pgn: str
+    path: Path
+
+
+def make_cache_key(identity: str, options: Sequence[str], flip: bool) -> str:
+    """Hash a game identity and its normalized render options into a cache key"""
+    digest = hashlib.sha256()
+    digest.update(identity.encode("utf-8"))
+    for option in options:
+        digest.update(b"\0")
+        digest.update(option.encode("utf-8"))
+    digest.update(b"\0flip" if flip else b"\0")
+    return digest.hexdigest()
+
+
+class GIFCache:
+    """A content-addressed on-disk cache of rendered GIFs
+
+    Each entry is stored as a {key}.gif file, or a file of whichever format it was rendered in,
+    next to the {key}.pgn it was rendered from, so hits can be embedded without fetching or
+    rendering anything. Entries are evicted in least
+    recently used order once the cache grows past max_bytes. Recency is kept in file
+    modification times, so the cache survives restarts.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = DEFAULT_GIF_CACHE_SIZE):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._formats: dict[str, str] = {}
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        entries = []
+        for format in FORMATS:
+            for gif_path in self.directory.glob(f"*.{format}"):
+                pgn_path = gif_path.with_suffix(".pgn")
+                try:
+                    stat = gif_path.stat()
+                    size = stat.st_size + pgn_path.stat().st_size
+                except FileNotFoundError:
+                    gif_path.unlink(missing_ok=True)
+                    continue
+                entries.append((stat.st_mtime, gif_path.stem, format, size))
+
+        for _, key, format, size in sorted(entries):
+            self._entries[key] = size
+            self._formats[key] = format
+            self.total_bytes += size
+
+        # Leftovers from interrupted writes
+        now = time.time()
+        for tmp_path in self.directory.glob("*.tmp"):
+            try:
+                if now - tmp_path.stat().st_mtime > STALE_TMP_AGE:
+                    tmp_path.unlink()
+            except FileNotFoundError:
+                pass
+
+        logging.info("Loaded %s cached GIFs (%s bytes) from %s", len(self), self.total_bytes, self.directory)
+        self._evict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[CachedGIF]:
+        """Return the cached GIF for key, marking it as recently used"""
+        if key not in self._entries:
+            return None
+
+        gif_path, pgn_path = self._paths(key)
+        try:
+            pgn = pgn_path.read_text()
+            os.utime(gif_path)
+        except FileNotFoundError:
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return CachedGIF(pgn, gif_path)
+
+    def put(self, key: str, pgn: str, gif: GIFOutput) -> CachedGIF:
+        """Copy a rendered GIF, from a file or an in-memory buffer, into the cache
+
+        The entry keeps the format of the GIF's name, like a png for a name ending in .png.
+        """
+        if key in self._entries:
+            self._remove(key)
+        format = Path(gif.name).suffix.lstrip(".") or "gif"
+        self._formats[key] = format
+        cached_gif_path, cached_pgn_path = self._paths(key)
+
+        tmp_name = uuid.uuid4().hex
+        tmp_gif_path = self.directory / f"{tmp_name}.{format}.tmp"
+        tmp_pgn_path = self.directory / f"{tmp_name}.pgn.tmp"
+        if isinstance(gif, Path):
+            shutil.copyfile(gif, tmp_gif_path)
+        else:
+            with gif.open() as source, open(tmp_gif_path, "wb") as destination:
+                shutil.copyfileobj(source, destination)
+        tmp_pgn_path.write_text(pgn)
+        # The PGN goes in first as the GIF marks a complete entry when loading
+        os.replace(tmp_pgn_path, cached_pgn_path)
+        os.replace(tmp_gif_path, cached_gif_path)
+
+        size = cached_gif_path.stat().st_size + cached_pgn_path.stat().st_size
+        self._entries[key] = size
+        self.total_bytes += size
+        self._evict()
+
+        return CachedGIF(pgn, cached_gif_path)
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        format = self._formats.get(key, "gif")
+        return self.directory / f"{key}.{format}", self.directory / f"{key}.pgn"
+
+    def _remove(self, key: str):
+        self.total_bytes -= self._entries.pop(key)
+        for path in self._paths(key):
+            path.unlink(missing_ok=True)
+        self._formats.pop(key, None)
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            logging.debug("Evicting cached GIF: %s", key)
+            self._remove(key)
+
+
+class PGNCache:
+    """A two-tier cache of fetched PGNs: an in-memory LRU backed by an optional on-disk store
+
+    Games fetched by id never change and never expire. Player lookups resolve to the player's
+    latest game, so they are only kept for player_ttl seconds. The on-disk store is evicted in least
+    recently used order once it grows past max_disk_bytes. File modification times are when a PGN
+    was fetched, so across restarts entries are evicted oldest fetched first.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        max_entries: int = DEFAULT_PGN_CACHE_ENTRIES,
+        player_ttl: float = DEFAULT_PLAYER_PGN_TTL,
+        max_disk_bytes: int = DEFAULT_PGN_CACHE_SIZE,
+    ):
+        self.directory = Path(directory) if directory is not None else None
+        self.max_entries = max_entries
+        self.player_ttl = player_ttl
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_bytes = 0
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._disk_entries: OrderedDict[str, int] = OrderedDict()
+
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._load()
+
+    def _load(self):
+        assert self.directory is not None
+        entries = []
+        for path in self.directory.glob("*.pgn"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_entries[key] = size
+            self.disk_bytes += size
+        self._evict_from_disk()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(id_or_username: str, search_type: str, game: int = 1) -> str:
+        if search_type == "player":
+            # Usernames are case insensitive in both lichess and chess.com
+            id_or_username = id_or_username.lower()
+        lookup = f"{search_type}:{id_or_username}"
+        if game != 1:
+            # One of a player's latest games other than the latest
+            lookup += f"#{game}"
+        return hashlib.sha256(lookup.encode("utf-8")).hexdigest()
+
+    def is_fresh(self, search_type: str, stored_at: float) -> bool:
+        if search_type == "id":
+            return True
+        return time.time() - stored_at < self.player_ttl
+
+    def get(self, id_or_username: str, search_type: str, game: int = 1) -> Optional[str]:
+        """Return the cached PGN for a game id or player, or None if missing or expired"""
+        key = self.key(id_or_username, search_type, game)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            pgn, stored_at = entry
+            if self.is_fresh(search_type, stored_at):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                PGN_CACHE_LOOKUPS.inc("memory")
+                return pgn
+            del self._entries[key]
+
+        disk_pgn = self._get_from_disk(key, search_type)
+        if disk_pgn is not None:
+            self.hits += 1
+            self.disk_hits += 1
+            PGN_CACHE_LOOKUPS.inc("disk")
+            return disk_pgn
+
+        self.misses += 1
+        PGN_CACHE_LOOKUPS.inc("miss")
+        return None
+
+    def _get_from_disk(self, key: str, search_type: str) -> Optional[str]:
+        if self.directory is None:
+            return None
+
+        path = self.directory / f"{key}.pgn"
+        try:
+            stored_at = path.stat().st_mtime
+            if not self.is_fresh(search_type, stored_at):
+                self._remove_from_disk(key)
+                return None
+            pgn = path.read_text()
+        except FileNotFoundError:
+            self._remove_from_disk(key)
+            return None
+
+        if key in self._disk_entries:
+            self._disk_entries.move_to_end(key)
+        self._put_in_memory(key, pgn, stored_at)
+        return pgn
+
+    def put(self, id_or_username: str, search_type: str, pgn: str, game: int = 1):
+        """Store a freshly fetched PGN in both tiers"""
+        key = self.key(id_or_username, search_type, game)
+        self._put_in_memory(key, pgn, time.time())
+
+        if self.directory is not None:
+            tmp_path = self.directory / f"{uuid.uuid4().hex}.pgn.tmp"
+            tmp_path.write_text(pgn)
+            path = self.directory / f"{key}.pgn"
+            os.replace(tmp_path, path)
+
+            self.disk_bytes -= self._disk_entries.pop(key, 0)
+            self._disk_entries[key] = path.stat().st_size
+            self.disk_bytes += self._disk_entries[key]
+            self._evict_from_disk()
+
+    def _remove_from_disk(self, key: str):
+        assert self.directory is not None
+        self.disk_bytes -= self._disk_entries.pop(key, 0)
+        (self.directory / f"{key}.pgn").unlink(missing_ok=True)
+
+    def _evict_from_disk(self):
+        while self.disk_bytes > self.max_disk_bytes and self._disk_entries:
+            key = next(iter(self._disk_entries))
+            logging.debug("Evicting cached PGN: %s", key)
+            self._remove_from_disk(key)
+
+    def _put_in_memory(self, key: str, pgn: str, stored_at: float):
+        self._entries[key] = (pgn, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
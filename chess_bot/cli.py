@@ -1,17 +1,236 @@
 import argparse
+import asyncio
 import typing
 import logging
 import os
+from pathlib import Path
+import sys
 
-from .bot import bot
+from . import bot as bot_module
+from .attachments import DEFAULT_ATTACHMENT_INDEX_ENTRIES, AttachmentIndex
+from .bot import DEFAULT_FORMAT, make_bot
+from .cache import (
+    DEFAULT_GIF_CACHE_SIZE,
+    DEFAULT_PGN_CACHE_ENTRIES,
+    DEFAULT_PGN_CACHE_SIZE,
+    DEFAULT_PLAYER_PGN_TTL,
+    GIFCache,
+    PGNCache,
+)
+from .fetch import GameFetcher
+from .logs import DEFAULT_PAYLOAD_SAMPLE_RATE, setup_logging
+from .metrics import DEFAULT_METRICS_HOST, start_metrics_server
+from .prefetch import DEFAULT_PREFETCH_INTERVAL, DEFAULT_PREFETCH_RENDERS, Prefetcher
+from .process import (
+    DEFAULT_CPU_LIMIT,
+    DEFAULT_FETCH_TIMEOUT,
+    DEFAULT_MEMORY_LIMIT,
+    DEFAULT_NICENESS,
+    DEFAULT_RENDER_TIMEOUT,
+    ProcessLimits,
+)
+from .ratelimit import (
+    DEFAULT_CHANNEL_RATE_LIMIT,
+    DEFAULT_GUILD_RATE_LIMIT,
+    DEFAULT_USER_RATE_LIMIT,
+    RateLimiter,
+    parse_rate_limit,
+)
+from .render import NativeRenderer
+from .request import FORMATS
+from .scheduler import DEFAULT_MAX_QUEUE_SIZE, RenderScheduler
+from .spool import DEFAULT_SPOOL_DIR, DEFAULT_SPOOL_THRESHOLD, GIFSpool
+from .supervisor import (
+    Supervisor,
+    child_environment,
+    fetch_recommended_shard_count,
+    parse_shard_ids,
+    plan_shards,
+    shard_directory,
+    shard_share,
+    strip_options,
+)
+from .traffic import TrafficRecorder
+from .worker import RenderQueue, parse_transport, run_worker
+
+# Options the supervisor sets differently for every child process
+SUPERVISOR_OPTIONS = {"--processes", "--shard-count", "--shard-ids", "--metrics-port", "--spool-dir"}
 
 
 def run(args):
+    if len(args) > 0 and args[0] == "worker":
+        run_render_worker(args[1:])
+        return
+
     parsed = parse_cli_args(args)
-    logging.basicConfig(level=logging.DEBUG if parsed.debug is True else logging.INFO)
+    configure_logging(parsed)
+
+    if parsed.processes is not None:
+        if parsed.render_queue is not None:
+            raise SystemExit("--render-queue can't be used with --processes, each needs its own queue")
+        asyncio.run(supervise(parsed, args))
+        return
+
+    if parsed.shard_ids is not None and parsed.shard_count is None:
+        raise SystemExit("--shard-ids requires --shard-count")
+
+    gif_cache_bytes = parsed.gif_cache_size * 1024 * 1024
+    pgn_cache_bytes = parsed.pgn_cache_size * 1024 * 1024
+    if parsed.shard_count is not None or not parsed.mentions:
+        bot = make_bot(shard_count=parsed.shard_count, shard_ids=parsed.shard_ids, mentions=parsed.mentions)
+        if parsed.shard_ids is not None:
+            # Sibling processes share the spool and cache directories, keep each one's files apart.
+            # Caches are not shared, each process keeps its share of their size and evicts on its own
+            parsed.spool_dir = shard_directory(parsed.spool_dir, parsed.shard_ids)
+            if parsed.gif_cache_dir is not None:
+                parsed.gif_cache_dir = shard_directory(parsed.gif_cache_dir, parsed.shard_ids)
+                gif_cache_bytes = shard_share(gif_cache_bytes, parsed.shard_ids, parsed.shard_count)
+            if parsed.pgn_cache_dir is not None:
+                parsed.pgn_cache_dir = shard_directory(parsed.pgn_cache_dir, parsed.shard_ids)
+                pgn_cache_bytes = shard_share(pgn_cache_bytes, parsed.shard_ids, parsed.shard_count)
+    else:
+        bot = bot_module.bot
+
+    cog = bot.get_cog("Chess2GIF")
+    cog.scheduler = RenderScheduler(max_concurrency=parsed.max_renders, max_queue_size=parsed.max_queue_size)
+    if parsed.gif_cache_dir is not None:
+        cog.gif_cache = GIFCache(parsed.gif_cache_dir, max_bytes=gif_cache_bytes)
+    cog.spool = GIFSpool(parsed.spool_dir, threshold=parsed.spool_threshold * 1024 * 1024)
+    cog.pgn_cache = PGNCache(
+        parsed.pgn_cache_dir,
+        max_entries=parsed.pgn_cache_entries,
+        player_ttl=parsed.player_pgn_ttl,
+        max_disk_bytes=pgn_cache_bytes,
+    )
+    if parsed.attachment_index_entries > 0:
+        cog.attachment_index = AttachmentIndex(max_entries=parsed.attachment_index_entries)
+    cog.placeholders = parsed.placeholders
+    cog.fetch_limits = process_limits(parsed, parsed.fetch_timeout)
+    if parsed.fetcher == "http":
+        cog.fetcher = GameFetcher(timeout=parsed.fetch_timeout or None)
+    cog.render_limits = process_limits(parsed, parsed.render_timeout)
+    if parsed.renderer == "native":
+        cog.renderer = NativeRenderer(processes=parsed.render_processes)
+    cog.default_format = parsed.default_format
+    cog.rate_limiter = RateLimiter(
+        user=parsed.user_rate_limit, channel=parsed.channel_rate_limit, guild=parsed.guild_rate_limit
+    )
+    cog.shed_queue_depth = (
+        parsed.shed_queue_depth if parsed.shed_queue_depth is not None else parsed.max_queue_size // 2
+    )
+
+    if parsed.render_queue is not None:
+        cog.render_queue = RenderQueue(parsed.render_queue)
+        bot.loop.run_until_complete(cog.render_queue.start())
+
+    if parsed.watch_players:
+        prefetcher = Prefetcher(
+            cog, parsed.watch_players, interval=parsed.watch_interval, max_renders=parsed.prefetch_renders
+        )
+        bot.loop.create_task(prefetcher.run())
+
+    if parsed.metrics_port is not None:
+        bot.loop.create_task(start_metrics_server(parsed.metrics_port, host=parsed.metrics_host))
+
+    if parsed.record_traffic is not None:
+        # Every shard appends to the same trace, timing its requests from when the trace was started
+        bot.add_cog(TrafficRecorder(bot, parsed.record_traffic))
+
     bot.run(parsed.token)
 
 
+def run_render_worker(args: typing.Sequence[str]):
+    parsed = parse_worker_cli_args(args)
+    configure_logging(parsed)
+    try:
+        limits = process_limits(parsed, parsed.render_timeout)
+        asyncio.run(run_worker(parsed.connect, concurrency=parsed.concurrency, limits=limits))
+    except KeyboardInterrupt:
+        pass
+
+
+async def supervise(parsed: argparse.Namespace, args: typing.Sequence[str]):
+    """Run the bot in several processes, each one owning a subset of the shards"""
+    shard_count = parsed.shard_count
+    if shard_count is None:
+        shard_count = await fetch_recommended_shard_count(parsed.token)
+        logging.info("Discord recommends %s shards", shard_count)
+
+    plan = plan_shards(shard_count, parsed.processes)
+    child_args = [arg for arg in strip_options(args, SUPERVISOR_OPTIONS) if arg != parsed.token]
+
+    def command(index: int, shard_ids: typing.Sequence[int]) -> list[str]:
+        command = [sys.executable, "-m", "chess_bot", *child_args]
+        command += ["--shard-count", str(shard_count), "--shard-ids", ",".join(map(str, shard_ids))]
+        command += ["--spool-dir", str(parsed.spool_dir)]
+        if parsed.metrics_port is not None:
+            command += ["--metrics-port", str(parsed.metrics_port + index)]
+        return command
+
+    supervisor = Supervisor(plan, command, env=child_environment(parsed.token))
+    await supervisor.run()
+
+
+def process_limits(parsed: argparse.Namespace, timeout: float) -> ProcessLimits:
+    return ProcessLimits(
+        timeout=timeout or None,
+        memory=parsed.process_memory_limit * 1024 * 1024 or None,
+        cpu=parsed.process_cpu_limit or None,
+        niceness=parsed.process_niceness,
+    )
+
+
+def configure_logging(parsed: argparse.Namespace):
+    setup_logging(
+        logging.DEBUG if parsed.debug is True else logging.INFO,
+        json_output=parsed.log_format == "json",
+        payload_sample_rate=parsed.log_payload_sample_rate,
+    )
+
+
+def add_logging_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--debug", help="enable debug logging", default=False, action="store_true")
+    parser.add_argument(
+        "--log-format",
+        help="write logs as JSON lines, or as text for reading in a terminal",
+        choices=("json", "text"),
+        default="json",
+    )
+    parser.add_argument(
+        "--log-payload-sample-rate",
+        help="fraction of requests whose PGNs, arguments and other payloads are logged at the debug level",
+        type=float,
+        default=DEFAULT_PAYLOAD_SAMPLE_RATE,
+    )
+
+
+def add_process_limit_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--render-timeout",
+        help="seconds c2g has to render a game before it is killed, 0 for no timeout",
+        type=float,
+        default=DEFAULT_RENDER_TIMEOUT,
+    )
+    parser.add_argument(
+        "--process-memory-limit",
+        help="maximum address space of cgf and c2g in MiB, 0 for no limit",
+        type=int,
+        default=DEFAULT_MEMORY_LIMIT // (1024 * 1024),
+    )
+    parser.add_argument(
+        "--process-cpu-limit",
+        help="maximum seconds of CPU time cgf and c2g can use, 0 for no limit",
+        type=int,
+        default=DEFAULT_CPU_LIMIT,
+    )
+    parser.add_argument(
+        "--process-niceness",
+        help="niceness cgf and c2g run with, so the bot stays responsive while rendering",
+        type=int,
+        default=DEFAULT_NICENESS,
+    )
+
+
 def parse_cli_args(args: typing.Sequence):
     parser = argparse.ArgumentParser(description="GIFs your chess games")
     parser.add_argument(
@@ -20,7 +239,232 @@ def parse_cli_args(args: typing.Sequence):
         env_var="DISCORD_BOT_TOKEN",
         action=EnvDefault,
     )
-    parser.add_argument("--debug", help="enable debug logging", default=False, action="store_true")
+    add_logging_arguments(parser)
+    parser.add_argument(
+        "--shard-count",
+        help="total number of shards, the bot runs unsharded if not set",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--shard-ids",
+        help="comma separated shard ids this process runs, all of them if not set",
+        type=parse_shard_ids,
+        default=None,
+    )
+    parser.add_argument(
+        "--processes",
+        help=(
+            "run as a supervisor of this many bot processes, splitting the shards between them. "
+            "Uses the shard count recommended by Discord unless --shard-count is set"
+        ),
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-port",
+        help="serve metrics in the Prometheus format at /metrics on this port, disabled if not set",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-host",
+        help="address the metrics endpoint listens on",
+        default=DEFAULT_METRICS_HOST,
+    )
+    parser.add_argument(
+        "--max-renders",
+        help="maximum number of games rendered at the same time, defaults to the number of cores",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--max-queue-size",
+        help="maximum number of requests waiting to be rendered before new ones are rejected",
+        type=int,
+        default=DEFAULT_MAX_QUEUE_SIZE,
+    )
+    parser.add_argument(
+        "--shed-queue-depth",
+        help=(
+            "number of waiting renders past which requests for several games are turned away, "
+            "defaults to half of --max-queue-size"
+        ),
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--user-rate-limit",
+        help="requests a user can make in a number of seconds, like 5/60",
+        type=parse_rate_limit,
+        default=DEFAULT_USER_RATE_LIMIT,
+    )
+    parser.add_argument(
+        "--channel-rate-limit",
+        help="requests that can be made in a channel in a number of seconds",
+        type=parse_rate_limit,
+        default=DEFAULT_CHANNEL_RATE_LIMIT,
+    )
+    parser.add_argument(
+        "--guild-rate-limit",
+        help="requests that can be made in a server in a number of seconds",
+        type=parse_rate_limit,
+        default=DEFAULT_GUILD_RATE_LIMIT,
+    )
+    parser.add_argument(
+        "--renderer",
+        help="render GIFs with c2g, or natively in a pool of processes, unless they go to render workers",
+        choices=["c2g", "native"],
+        default="c2g",
+    )
+    parser.add_argument(
+        "--render-processes",
+        help="processes rendering natively, defaults to the number of cores, 1 renders in a thread",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--default-format",
+        help="format of requests that don't choose one, webp and mp4 are a GIF render plus a transcode",
+        choices=FORMATS,
+        default=DEFAULT_FORMAT,
+    )
+    parser.add_argument(
+        "--fetcher",
+        help="fetch games over a pooled HTTP session falling back to cgf, or only with cgf",
+        choices=["http", "cgf"],
+        default="http",
+    )
+    parser.add_argument(
+        "--fetch-timeout",
+        help="seconds a game has to be fetched in before giving up, 0 for no timeout",
+        type=float,
+        default=DEFAULT_FETCH_TIMEOUT,
+    )
+    add_process_limit_arguments(parser)
+    parser.add_argument(
+        "--render-queue",
+        help=(
+            "hand renders to workers started with `chess-bot worker` that connect to this address, "
+            "like unix:/run/chess-bot.sock or tcp:0.0.0.0:8765. Renders run in this process if not set"
+        ),
+        type=parse_transport,
+        default=None,
+    )
+    parser.add_argument(
+        "--spool-dir",
+        help="directory GIFs too large to keep in memory are written to, ideally a tmpfs",
+        type=Path,
+        default=DEFAULT_SPOOL_DIR,
+    )
+    parser.add_argument(
+        "--spool-threshold",
+        help="size in MiB above which a GIF is written to the spool directory instead of kept in memory",
+        type=int,
+        default=DEFAULT_SPOOL_THRESHOLD // (1024 * 1024),
+    )
+    parser.add_argument(
+        "--gif-cache-dir",
+        help="directory to cache rendered GIFs in, caching is disabled if not set",
+        type=Path,
+        default=None,
+    )
+    parser.add_argument(
+        "--gif-cache-size",
+        help="maximum size of the GIF cache in MiB",
+        type=int,
+        default=DEFAULT_GIF_CACHE_SIZE // (1024 * 1024),
+    )
+    parser.add_argument(
+        "--pgn-cache-dir",
+        help="directory to keep fetched PGNs in across restarts, only kept in memory if not set",
+        type=Path,
+        default=None,
+    )
+    parser.add_argument(
+        "--pgn-cache-size",
+        help="maximum size of the PGNs kept in --pgn-cache-dir in MiB",
+        type=int,
+        default=DEFAULT_PGN_CACHE_SIZE // (1024 * 1024),
+    )
+    parser.add_argument(
+        "--pgn-cache-entries",
+        help="maximum number of fetched PGNs kept in memory",
+        type=int,
+        default=DEFAULT_PGN_CACHE_ENTRIES,
+    )
+    parser.add_argument(
+        "--player-pgn-ttl",
+        help="seconds a player's latest game is cached for before it is fetched again",
+        type=float,
+        default=DEFAULT_PLAYER_PGN_TTL,
+    )
+    parser.add_argument(
+        "--no-mentions",
+        help="only answer /gif commands, without receiving every message to find the ones mentioning the bot",
+        dest="mentions",
+        default=True,
+        action="store_false",
+    )
+    parser.add_argument(
+        "--no-placeholders",
+        help="only reply once the GIF is ready, instead of posting a placeholder showing its progress",
+        dest="placeholders",
+        default=True,
+        action="store_false",
+    )
+    parser.add_argument(
+        "--attachment-index-entries",
+        help="number of uploaded GIFs remembered to link them instead of uploading them again, 0 to disable",
+        type=int,
+        default=DEFAULT_ATTACHMENT_INDEX_ENTRIES,
+    )
+    parser.add_argument(
+        "--watch-players",
+        help="comma separated players whose latest game is fetched and rendered ahead of requests",
+        type=lambda value: [player for player in value.split(",") if player],
+        default=[],
+    )
+    parser.add_argument(
+        "--watch-interval",
+        help="seconds between checks for new games of watched players",
+        type=float,
+        default=DEFAULT_PREFETCH_INTERVAL,
+    )
+    parser.add_argument(
+        "--prefetch-renders",
+        help="maximum number of watched players' games rendered at the same time",
+        type=int,
+        default=DEFAULT_PREFETCH_RENDERS,
+    )
+
+    parser.add_argument(
+        "--record-traffic",
+        help="append the requests mentioning the bot, anonymized, to this file for replaying in load tests",
+        type=Path,
+        default=None,
+    )
+
+    parsed = parser.parse_args(args)
+    return parsed
+
+
+def parse_worker_cli_args(args: typing.Sequence):
+    parser = argparse.ArgumentParser(prog="chess-bot worker", description="Renders GIFs for a chess bot")
+    parser.add_argument(
+        "--connect",
+        help="address of the bot's render queue, like unix:/run/chess-bot.sock or tcp:bot-host:8765",
+        type=parse_transport,
+        required=True,
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="maximum number of games rendered at the same time, defaults to the number of cores",
+        type=int,
+        default=None,
+    )
+    add_process_limit_arguments(parser)
+    add_logging_arguments(parser)
 
     parsed = parser.parse_args(args)
     return parsed
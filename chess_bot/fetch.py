@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+import json
+import re
+from typing import Any, Callable, NamedTuple, Optional
+from urllib.parse import quote
+
+import aiohttp
+
+from .singleflight import SingleFlight
+
+LICHESS_URL = "https://lichess.org"
+CHESS_COM_URL = "https://api.chess.com"
+USER_AGENT = "chess2gif-bot (https://github.com/tomasfarias/chess2gif-bot)"
+PGN_CONTENT_TYPE = "application/x-chess-pgn"
+DEFAULT_MAX_CONNECTIONS = 32
+DEFAULT_HTTP_TIMEOUT = 10.0
+# Responses kept to revalidate with a conditional request instead of downloading them again
+DEFAULT_VALIDATED_RESPONSES = 1024
+# lichess game URLs may end in 4 more characters for the side the board is shown from
+LICHESS_GAME_ID_LENGTH = 8
+
+NOT_FOUND_ERROR = "Game not found"
+# Games in a PGN export are separated by a blank line before the next game's tags
+PGN_SEPARATOR = re.compile(r"\n\s*\n(?=\[)")
+
+
+class FetchError(Exception):
+    """Raised when a site can't be reached or can't serve a lookup, another backend may still do it"""
+
+
+class ValidatedResponse(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body: bytes
+
+
+class LazySession:
+    """An HTTP session created on first use, as it has to be created inside the running event loop
+
+    A closed session is replaced by a new one.
+    """
+
+    def __init__(self, create: Callable[[], aiohttp.ClientSession]):
+        self.create = create
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def get(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = self.create()
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class GameFetcher:
+    """Fetches PGNs from lichess and chess.com through a pooled keep-alive HTTP session
+
+    Identical lookups in flight at the same time share one request. Responses carrying an ETag or
+    a Last-Modified header are revalidated with a conditional request, which the chess.com API
+    answers with an empty 304 while a player's games are unchanged.
+
+    chess.com has no public API to fetch a game by id, FetchError is raised for those so they can
+    be fetched with cgf instead.
+    """
+
+    def __init__(
+        self,
+        lichess_url: str = LICHESS_URL,
+        chess_com_url: str = CHESS_COM_URL,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        timeout: Optional[float] = DEFAULT_HTTP_TIMEOUT,
+        max_validated_responses: int = DEFAULT_VALIDATED_RESPONSES,
+    ):
+        self.lichess_url = lichess_url.rstrip("/")
+        self.chess_com_url = chess_com_url.rstrip("/")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_validated_responses = max_validated_responses
+        self.requests = 0
+        self.revalidated = 0
+        self._session = LazySession(self.create_session)
+        self._validated: OrderedDict[str, ValidatedResponse] = OrderedDict()
+        self._lookups = SingleFlight()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self._session.get()
+
+    def create_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"User-Agent": USER_AGENT},
+        )
+
+    async def close(self):
+        await self._session.close()
+
+    async def fetch(
+        self, id_or_username: str, search_type: str, game: int = 1
+    ) -> tuple[Optional[str], Optional[str]]:
+        """Fetch the PGN of a game by id, or of one of a player's latest games, 1 being the latest
+
+        Returns the PGN, or an error for games and players that don't exist. Raises FetchError if
+        the lookup couldn't be done.
+        """
+        if search_type == "id":
+            job = lambda: self.fetch_game(id_or_username)  # noqa: E731
+        elif search_type == "player":
+            job = lambda: self.fetch_latest_game(id_or_username, game)  # noqa: E731
+        else:
+            raise ValueError('search_type must be either "id" or "player"')
+
+        async with self._lookups.join((search_type, id_or_username.lower(), game), job) as result:
+            return result
+
+    async def fetch_game(self, game_id: str) -> tuple[Optional[str], Optional[str]]:
+        if game_id.isdecimal():
+            raise FetchError(f"chess.com games can't be fetched by id: {game_id}")
+
+        game_id = game_id[:LICHESS_GAME_ID_LENGTH]
+        url = f"{self.lichess_url}/game/export/{quote(game_id, safe='')}"
+        body = await self.get(url, accept=PGN_CONTENT_TYPE)
+        if body is None:
+            return None, NOT_FOUND_ERROR
+        return decode_pgn(url, body), None
+
+    async def fetch_latest_game(self, username: str, game: int = 1) -> tuple[Optional[str], Optional[str]]:
+        """Fetch one of a player's latest games, from chess.com or else from lichess"""
+        chess_com, lichess = await asyncio.gather(
+            self.fetch_latest_chess_com_game(username, game),
+            self.fetch_latest_lichess_game(username, game),
+            return_exceptions=True,
+        )
+        for result in (chess_com, lichess):
+            if isinstance(result, BaseException):
+                continue
+            if result is not None:
+                return result, None
+
+        errors = [result for result in (chess_com, lichess) if isinstance(result, BaseException)]
+        if errors:
+            # Maybe the player is on the site that could not be reached
+            raise FetchError(f"latest game of {username} could not be fetched") from errors[0]
+        if game > 1:
+            return None, f"{username} has played fewer than {game} games"
+        return None, f"No games found for {username}"
+
+    async def fetch_latest_chess_com_game(self, username: str, game: int = 1) -> Optional[str]:
+        base = f"{self.chess_com_url}/pub/player/{quote(username.lower(), safe='')}"
+        archives = await self.get_json(f"{base}/games/archives")
+        if not archives or not archives.get("archives"):
+            return None
+
+        # Archives are monthly, the last one has the latest games, and earlier ones are only
+        # fetched for games older than the ones of the months after them
+        for url in reversed(archives["archives"]):
+            month = await self.get_json(url)
+            games = month.get("games") if month else None
+            games = sorted(games or [], key=lambda entry: entry.get("end_time", 0), reverse=True)
+            if game <= len(games):
+                return games[game - 1].get("pgn")
+            game -= len(games)
+        return None
+
+    async def fetch_latest_lichess_game(self, username: str, game: int = 1) -> Optional[str]:
+        url = f"{self.lichess_url}/api/games/user/{quote(username, safe='')}"
+        body = await self.get(url, params={"max": str(game)}, accept=PGN_CONTENT_TYPE)
+        if not body or not body.strip():
+            return None
+        # Exported latest first
+        games = PGN_SEPARATOR.split(decode_pgn(url, body))
+        if game > len(games):
+            return None
+        return games[game - 1].rstrip("\n") + "\n"
+
+    async def get_json(self, url: str) -> Optional[Any]:
+        body = await self.get(url, accept="application/json")
+        if body is None:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError as e:
+            raise FetchError(f"{url} returned invalid JSON") from e
+
+    async def get(
+        self, url: str, params: Optional[dict[str, str]] = None, accept: str = "*/*"
+    ) -> Optional[bytes]:
+        """GET a URL, revalidating a previous response if there is one. Returns None on a 404"""
+        key = url if params is None else f"{url}?{sorted(params.items())}"
+        headers = {"Accept": accept}
+        validated = self._validated.get(key)
+        if validated is not None:
+            if validated.etag is not None:
+                headers["If-None-Match"] = validated.etag
+            if validated.last_modified is not None:
+                headers["If-Modified-Since"] = validated.last_modified
+
+        self.requests += 1
+        try:
+            async with self.session.get(url, params=params, headers=headers) as response:
+                if response.status == 304 and validated is not None:
+                    self.revalidated += 1
+                    self._validated.move_to_end(key)
+                    return validated.body
+                if response.status == 404:
+                    return None
+                if response.status != 200:
+                    raise FetchError(f"{url} returned {response.status}")
+                body = await response.read()
+                self.remember(key, response, body)
+                return body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise FetchError(f"{url} could not be fetched: {e!r}") from e
+
+    def remember(self, key: str, response: aiohttp.ClientResponse, body: bytes):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag is None and last_modified is None:
+            return
+        self._validated[key] = ValidatedResponse(etag, last_modified, body)
+        self._validated.move_to_end(key)
+        while len(self._validated) > self.max_validated_responses:
+            self._validated.popitem(last=False)
+
+
+def decode_pgn(url: str, body: bytes) -> str:
+    try:
+        return body.decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise FetchError(f"{url} returned a PGN that is not UTF-8") from e
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import struct
+from typing import Optional, Sequence
+
+MAX_CODE_SIZE = 12
+# Frames draw over the previous ones, leaving the pixels around them as they are
+DISPOSE_NOT = 1
+
+
+def lzw_compress(pixels: bytes, min_code_size: int) -> bytes:
+    """Compress palette indices with GIF's variable length LZW, returning the packed codes"""
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+    code_size = min_code_size + 1
+    next_code = end_code + 1
+    # The code size grows once the next code doesn't fit anymore
+    grow_at = 1 << code_size
+    table: dict[int, int] = {}
+    lookup = table.get
+
+    output = bytearray()
+    buffer = clear_code
+    bits = code_size
+
+    prefix = pixels[0] if pixels else -1
+    for index in pixels[1:]:
+        key = prefix << 8 | index
+        code = lookup(key)
+        if code is not None:
+            prefix = code
+            continue
+
+        buffer |= prefix << bits
+        bits += code_size
+        if bits >= 16:
+            output += (buffer & 0xFFFF).to_bytes(2, "little")
+            buffer >>= 16
+            bits -= 16
+
+        if next_code < 1 << MAX_CODE_SIZE:
+            table[key] = next_code
+            next_code += 1
+            if next_code > grow_at:
+                code_size += 1
+                grow_at <<= 1
+        else:
+            # The table is full, start a new one
+            buffer |= clear_code << bits
+            bits += code_size
+            table.clear()
+            code_size = min_code_size + 1
+            grow_at = 1 << code_size
+            next_code = end_code + 1
+        prefix = index
+
+    if prefix >= 0:
+        buffer |= prefix << bits
+        bits += code_size
+        if next_code == grow_at and code_size < MAX_CODE_SIZE:
+            # The decoder grows its codes after adding the entry for this last code
+            code_size += 1
+    buffer |= end_code << bits
+    bits += code_size
+    while bits > 0:
+        output.append(buffer & 0xFF)
+        buffer >>= 8
+        bits -= 8
+    return bytes(output)
+
+
+def sub_blocks(data: bytes) -> bytes:
+    """Split data into the length prefixed blocks of up to 255 bytes GIF stores it in"""
+    blocks = bytearray()
+    for start in range(0, len(data), 255):
+        end = start + 255
+        chunk = data[start:end]
+        blocks.append(len(chunk))
+        blocks += chunk
+    blocks.append(0)
+    return bytes(blocks)
+
+
+def color_bits(colors: int) -> int:
+    """Return the bits per color of a color table, its size is a power of two of at least 4 colors"""
+    return max(2, (colors - 1).bit_length())
+
+
+def encode_image(pixels: bytes, bits: int) -> bytes:
+    """Encode the pixels of a frame, the same pixels can be reused by any GIF with as many colors"""
+    return bytes([bits]) + sub_blocks(lzw_compress(pixels, bits))
+
+
+class GIFWriter:
+    """Writes a looping GIF frame by frame, every frame a rectangle drawn over the previous ones"""
+
+    def __init__(self, width: int, height: int, palette: Sequence[tuple[int, int, int]]):
+        self.color_bits = color_bits(len(palette))
+        colors = bytearray()
+        for rgb in palette:
+            colors += bytes(rgb)
+        colors += b"\0" * (3 * (1 << self.color_bits) - len(colors))
+
+        self.data = bytearray(b"GIF89a")
+        # A global color table, with as many bits of color resolution as the table has
+        packed = 0x80 | (self.color_bits - 1) << 4 | (self.color_bits - 1)
+        self.data += struct.pack("<HHBBB", width, height, packed, 0, 0)
+        self.data += colors
+        # Loop forever
+        self.data += b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00"
+
+    def add_frame(
+        self,
+        pixels: bytes,
+        left: int,
+        top: int,
+        width: int,
+        height: int,
+        delay: int,
+        transparent: Optional[int] = None,
+    ):
+        """Add a frame shown for delay milliseconds, pixels left transparent show the previous frames"""
+        image = encode_image(pixels, self.color_bits)
+        self.add_encoded_frame(image, left, top, width, height, delay, transparent)
+
+    def add_encoded_frame(
+        self,
+        image: bytes,
+        left: int,
+        top: int,
+        width: int,
+        height: int,
+        delay: int,
+        transparent: Optional[int] = None,
+    ):
+        """Like add_frame, for pixels already encoded with encode_image"""
+        flags = DISPOSE_NOT << 2 | (transparent is not None)
+        # Delays are stored in hundredths of a second
+        centiseconds = min(max(round(delay / 10), 0), 0xFFFF)
+        self.data += struct.pack("<BBBBHBB", 0x21, 0xF9, 4, flags, centiseconds, transparent or 0, 0)
+        self.data += struct.pack("<BHHHHB", 0x2C, left, top, width, height, 0)
+        self.data += image
+
+    def finish(self) -> bytes:
+        self.data.append(0x3B)
+        return bytes(self.data)
@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, NamedTuple, Optional, Sequence
+
+import discord
+from discord.http import Route
+
+from .request import FORMATS, MAX_BATCH_SIZE
+
+# discord.py only knows the API versions from before application commands
+API_BASE = "https://discord.com/api/v10"
+INTERACTION_CREATE = "INTERACTION_CREATE"
+APPLICATION_COMMAND = 2
+# Interaction callback types
+CHANNEL_MESSAGE_WITH_SOURCE = 4
+DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE = 5
+# Only the user who ran the command sees the response
+EPHEMERAL = 1 << 6
+# Application command option types
+STRING_OPTION = 3
+INTEGER_OPTION = 4
+# The deferred response, the message every interaction starts with
+ORIGINAL = "@original"
+
+GIF_COMMAND_NAME = "gif"
+GIF_COMMAND = {
+    "name": GIF_COMMAND_NAME,
+    "type": 1,
+    "description": "Turn a chess game into a GIF",
+    "options": [
+        {
+            "type": STRING_OPTION,
+            "name": "id",
+            "description": "ID of a chess.com or lichess.org game, several comma separated",
+        },
+        {
+            "type": STRING_OPTION,
+            "name": "player",
+            "description": "Player whose latest game to GIF, several comma separated",
+        },
+        {
+            "type": INTEGER_OPTION,
+            "name": "last",
+            "description": "Number of the player's latest games to GIF",
+            "min_value": 1,
+            "max_value": MAX_BATCH_SIZE,
+        },
+        {
+            "type": STRING_OPTION,
+            "name": "time",
+            "description": '"real" to replay the game in real time, or milliseconds between moves',
+        },
+        {
+            "type": STRING_OPTION,
+            "name": "disable",
+            "description": "Features to leave out, comma separated, like coordinates,player-bars",
+        },
+        {
+            "type": STRING_OPTION,
+            "name": "light",
+            "description": "Color of the light squares, like 255,255,255",
+        },
+        {
+            "type": STRING_OPTION,
+            "name": "dark",
+            "description": "Color of the dark squares, like 0,0,0",
+        },
+        {
+            "type": STRING_OPTION,
+            "name": "format",
+            "description": "Send the game as an animation, or the final position as a png",
+            "choices": [{"name": format, "value": format} for format in FORMATS],
+        },
+        {
+            "type": INTEGER_OPTION,
+            "name": "ply",
+            "description": "Send the position after this many half moves as a png",
+            "min_value": 0,
+        },
+    ],
+}
+
+
+class InteractionRoute(Route):
+    """A route of the current API, rate limited per interaction as its token is in the path"""
+
+    BASE = API_BASE
+
+    def __init__(self, method: str, path: str, token: str = "", **parameters: Any):
+        super().__init__(method, path, **parameters)
+        self.token = token
+
+    @property
+    def bucket(self) -> str:
+        return f"{self.path}:{self.token}"
+
+
+class InteractionAttachment(NamedTuple):
+    filename: str
+    url: str
+
+
+class Interaction:
+    """A /gif command, answered by the cog like a message mentioning the bot
+
+    It has the id, author, guild and channel a message would have. Replies sent to its channel go
+    to the interaction's webhook, so they keep working after the 3 seconds Discord gives commands
+    to be acknowledged in.
+    """
+
+    def __init__(self, bot, payload: dict):
+        self.http = bot.http
+        self.id = int(payload["id"])
+        self.token = payload["token"]
+        self.application_id = payload["application_id"]
+        self.type = payload["type"]
+        self.data = payload.get("data") or {}
+        # Commands in a guild come from a member, commands in a DM from a user
+        user = (payload.get("member") or {}).get("user") or payload.get("user") or {}
+        self.author = discord.Object(id=int(user.get("id", 0)))
+        guild_id = payload.get("guild_id")
+        self.guild = bot.get_guild(int(guild_id)) if guild_id is not None else None
+        self.channel = InteractionChannel(self, int(payload.get("channel_id", 0)))
+
+    def __repr__(self) -> str:
+        return f"<Interaction id={self.id} command={self.data.get('name')} options={self.options}>"
+
+    def is_command(self, name: str) -> bool:
+        return self.type == APPLICATION_COMMAND and self.data.get("name") == name
+
+    @property
+    def options(self) -> dict[str, object]:
+        return {option["name"]: option["value"] for option in self.data.get("options", [])}
+
+    async def respond(self, content: str, ephemeral: bool = False):
+        """Respond right away, only for replies that need no render"""
+        await self.callback(
+            CHANNEL_MESSAGE_WITH_SOURCE, {"content": content, "flags": EPHEMERAL if ephemeral else 0}
+        )
+        # The response is the original message, replies after it are followups
+        self.channel.responded = True
+
+    async def defer(self):
+        """Acknowledge the command, showing the bot is thinking until the original message is sent"""
+        await self.callback(DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE)
+
+    async def callback(self, kind: int, data: Optional[dict] = None):
+        route = InteractionRoute(
+            "POST",
+            "/interactions/{interaction_id}/{interaction_token}/callback",
+            token=self.token,
+            interaction_id=self.id,
+            interaction_token=self.token,
+        )
+        payload: dict[str, Any] = {"type": kind}
+        if data is not None:
+            payload["data"] = data
+        await self.http.request(route, json=payload)
+
+    def webhook_route(self, method: str, message_id: Optional[str] = None) -> InteractionRoute:
+        path = "/webhooks/{application_id}/{interaction_token}"
+        if message_id == ORIGINAL:
+            # Kept out of the parameters, they are quoted
+            path += f"/messages/{ORIGINAL}"
+        elif message_id is not None:
+            path += "/messages/{message_id}"
+        return InteractionRoute(
+            method,
+            path,
+            token=self.token,
+            application_id=self.application_id,
+            interaction_token=self.token,
+            message_id=message_id,
+        )
+
+
+class InteractionChannel:
+    """Where replies to an interaction go: the first edits the deferred response, the others follow it"""
+
+    def __init__(self, interaction: Interaction, id: int):
+        self.interaction = interaction
+        self.id = id
+        self.responded = False
+
+    async def send(
+        self,
+        content: Optional[str] = None,
+        *,
+        embed: Optional[discord.Embed] = None,
+        file: Optional[discord.File] = None,
+        files: Optional[Sequence[discord.File]] = None,
+    ) -> InteractionMessage:
+        files = list(files or ([file] if file is not None else []))
+        if not self.responded:
+            self.responded = True
+            route = self.interaction.webhook_route("PATCH", ORIGINAL)
+            data = await send_webhook_message(self.interaction, route, content, embed, files)
+            message = InteractionMessage(self.interaction, ORIGINAL)
+        else:
+            # Waiting for the followup to be posted returns it, along with its attachments
+            route = self.interaction.webhook_route("POST")
+            data = await send_webhook_message(self.interaction, route, content, embed, files, wait=True)
+            message = InteractionMessage(self.interaction, data["id"])
+        message.attachments = [
+            InteractionAttachment(attachment["filename"], attachment["url"])
+            for attachment in data.get("attachments", [])
+        ]
+        return message
+
+
+class InteractionMessage:
+    """A reply to an interaction, edited and deleted through the interaction's webhook"""
+
+    def __init__(self, interaction: Interaction, id: str):
+        self.interaction = interaction
+        self.id = id
+        self.attachments: list[InteractionAttachment] = []
+
+    def __repr__(self) -> str:
+        return f"<InteractionMessage id={self.id} interaction={self.interaction.id}>"
+
+    async def edit(self, content: Optional[str] = None, embed: Optional[discord.Embed] = None):
+        route = self.interaction.webhook_route("PATCH", self.id)
+        await send_webhook_message(self.interaction, route, content, embed, [])
+
+    async def delete(self):
+        await self.interaction.http.request(self.interaction.webhook_route("DELETE", self.id))
+
+
+async def send_webhook_message(
+    interaction: Interaction,
+    route: InteractionRoute,
+    content: Optional[str],
+    embed: Optional[discord.Embed],
+    files: Sequence[discord.File],
+    wait: bool = False,
+) -> dict:
+    """Send or edit a message through an interaction's webhook, uploading files with it if any"""
+    payload: dict[str, Any] = {"content": content, "embeds": [embed.to_dict()] if embed is not None else []}
+    params = {"wait": "true"} if wait else None
+    if not files:
+        return await interaction.http.request(route, json=payload, params=params)
+
+    # Edits keep the attachments listed, new files are listed by their position in the form
+    payload["attachments"] = [{"id": index, "filename": file.filename} for index, file in enumerate(files)]
+    form: list[dict[str, Any]] = [{"name": "payload_json", "value": discord.utils.to_json(payload)}]
+    for index, file in enumerate(files):
+        form.append(
+            {
+                "name": f"files[{index}]",
+                "value": file.fp,
+                "filename": file.filename,
+                "content_type": "application/octet-stream",
+            }
+        )
+    try:
+        return await interaction.http.request(route, form=form, files=files, params=params)
+    finally:
+        for file in files:
+            file.close()
+
+
+async def register_commands(bot) -> bool:
+    """Replace the bot's global application commands with /gif, returning whether they were"""
+    try:
+        application = await bot.application_info()
+        route = InteractionRoute(
+            "PUT", "/applications/{application_id}/commands", application_id=application.id
+        )
+        await bot.http.request(route, json=[GIF_COMMAND])
+    except discord.HTTPException as e:
+        # Usually a bot invited without the applications.commands scope
+        logging.warning("Could not register application commands: %s", e)
+        return False
+    logging.info("Registered the /%s command", GIF_COMMAND_NAME)
+    return True
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import atexit
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Any, Iterator, Optional
+import zlib
+
+DEFAULT_PAYLOAD_LIMIT = 1000
+# Requests whose payloads are logged at the debug level
+DEFAULT_PAYLOAD_SAMPLE_RATE = 0.1
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+# Set for the task answering a request, and copied into every task it starts
+REQUEST_ID: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+@contextmanager
+def correlate(request_id: Optional[str]) -> Iterator[None]:
+    """Tag everything logged in this context, and tasks started from it, with a request id"""
+    token = REQUEST_ID.set(request_id)
+    try:
+        yield
+    finally:
+        REQUEST_ID.reset(token)
+
+
+class Payload:
+    """A large value to log, like a PGN, a message or an argument list
+
+    It is only turned into text when the record is written, truncated to limit characters.
+    Debug records with payloads are only kept for a sample of the requests.
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: int = DEFAULT_PAYLOAD_LIMIT):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        if len(text) <= self.limit:
+            return text
+        end = self.limit
+        return f"{text[:end]}... ({len(text) - end} more characters)"
+
+    __repr__ = __str__
+
+
+class RequestIdFilter(logging.Filter):
+    """Tags records with the id of the request being answered, in the thread logging them"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = REQUEST_ID.get()
+        return True
+
+
+class PayloadSampler(logging.Filter):
+    """Drops debug records with payloads, except for a sample of the requests
+
+    Requests are sampled by their id, so a sampled request keeps all of its payloads.
+    """
+
+    def __init__(self, rate: float = DEFAULT_PAYLOAD_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+        self._unrequested = 0.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or not has_payload(record):
+            return True
+        return self.sampled(getattr(record, "request_id", None))
+
+    def sampled(self, request_id: Optional[str]) -> bool:
+        if self.rate >= 1.0:
+            return True
+        if request_id is None:
+            # Every 1 / rate records logged outside of a request
+            self._unrequested += self.rate
+            if self._unrequested < 1.0:
+                return False
+            self._unrequested -= 1.0
+            return True
+        return zlib.crc32(request_id.encode("utf-8")) / 2 ** 32 < self.rate
+
+
+def has_payload(record: logging.LogRecord) -> bool:
+    args = record.args
+    if isinstance(args, tuple):
+        return any(isinstance(arg, Payload) for arg in args)
+    return False
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are, leaving their formatting to the thread writing them"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LogListener(logging.handlers.QueueListener):
+    """Writes queued records in its own thread, and can be stopped more than once"""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    json_output: bool = True,
+    payload_sample_rate: float = DEFAULT_PAYLOAD_SAMPLE_RATE,
+) -> LogListener:
+    """Send every record through a queue to a thread writing them to stderr
+
+    Logging from the event loop only creates the record and queues it, any formatting and
+    writing happens in the listener's thread. The listener is stopped, flushing the queue, at exit.
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter() if json_output else logging.Formatter(TEXT_FORMAT))
+
+    records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(PayloadSampler(payload_sample_rate))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # discord.py logs every gateway event in full at the debug level
+    logging.getLogger("discord").setLevel(max(level, logging.INFO))
+
+    listener = LogListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import logging
+import math
+import time
+from typing import Callable, Iterator, Optional, Sequence, TypeVar
+
+from aiohttp import web
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = tuple(float(1024 * 2 ** i) for i in range(0, 15, 2))
+
+LabelValues = tuple[str, ...]
+M = TypeVar("M", bound="Metric")
+
+
+def format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """The exposition lines of every sample of the metric"""
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def get(self, *label_values: str) -> float:
+        return self.values.get(label_values, 0.0)
+
+    def samples(self) -> Iterator[str]:
+        for label_values, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.labels, label_values)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.functions: dict[LabelValues, Callable[[], float]] = {}
+
+    def dec(self, *label_values: str, amount: float = 1.0):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values: str, value: float):
+        self.values[label_values] = value
+
+    def set_function(self, *label_values: str, function: Callable[[], float]):
+        """Read the gauge value from function every time it is scraped"""
+        self.functions[label_values] = function
+
+    def samples(self) -> Iterator[str]:
+        for label_values, function in self.functions.items():
+            self.values[label_values] = function()
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts: dict[LabelValues, list[int]] = {}
+        self.sums: dict[LabelValues, float] = {}
+
+    def observe(self, *label_values: str, value: float):
+        counts = self.counts.setdefault(label_values, [0] * len(self.buckets))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        self.sums[label_values] = self.sums.get(label_values, 0.0) + value
+
+    def count(self, *label_values: str) -> int:
+        return sum(self.counts.get(label_values, ()))
+
+    def samples(self) -> Iterator[str]:
+        for label_values, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(self.labels, label_values, f'le="{format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {format_value(self.sums[label_values])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        return "\n".join(metric.expose() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = Histogram(
+    "chess_bot_stage_seconds", "Time spent in each stage of handling a request", labels=("stage",)
+)
+STAGE_ERRORS = Counter("chess_bot_stage_errors_total", "Errors by stage", labels=("stage",))
+IN_FLIGHT = Gauge("chess_bot_in_flight", "Requests currently in each stage", labels=("stage",))
+GIF_BYTES = Histogram("chess_bot_gif_bytes", "Size of rendered GIFs", buckets=SIZE_BUCKETS)
+RENDER_QUEUE = Gauge("chess_bot_render_queue", "Renders waiting for and holding a slot", labels=("state",))
+OVERSIZED_RENDERS = Counter(
+    "chess_bot_oversized_renders_total", "Renders over the upload limit, retried with a smaller board"
+)
+REJECTED_REQUESTS = Counter(
+    "chess_bot_rejected_requests_total", "Requests turned away before any work", labels=("reason",)
+)
+PGN_CACHE_LOOKUPS = Counter(
+    "chess_bot_pgn_cache_lookups_total", "PGN cache lookups by the tier answering them", labels=("tier",)
+)
+for metric in (
+    STAGE_SECONDS,
+    STAGE_ERRORS,
+    IN_FLIGHT,
+    GIF_BYTES,
+    RENDER_QUEUE,
+    OVERSIZED_RENDERS,
+    REJECTED_REQUESTS,
+    PGN_CACHE_LOOKUPS,
+):
+    REGISTRY.register(metric)
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """Time a stage of handling a request, counting it as in flight and as an error if it raises"""
+    IN_FLIGHT.inc(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(stage, value=time.perf_counter() - start)
+        IN_FLIGHT.dec(stage)
+
+
+async def start_metrics_server(
+    port: int, host: str = DEFAULT_METRICS_HOST, registry: Optional[Registry] = None
+) -> web.AppRunner:
+    """Serve metrics over HTTP at /metrics"""
+    registry = registry if registry is not None else REGISTRY
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.expose(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from functools import cached_property
+import io
+import re
+from types import MappingProxyType
+from typing import Mapping, Optional, Union
+
+TAG_PAIR_PATTERN = re.compile(r'\[\s*([A-Za-z0-9_]+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+ESCAPE_PATTERN = re.compile(r"\\(.)")
+COMMENT_PATTERN = re.compile(r"\{[^}]*\}|;[^\n]*")
+VARIATION_PATTERN = re.compile(r"\([^()]*\)")
+# Move numbers, annotation glyphs and results, everything in the movetext that is not a move
+NOT_A_MOVE_PATTERN = re.compile(r"\d+\.(?:\.\.)?|\$\d+|1-0|0-1|1/2-1/2|\*")
+CLOCK_PATTERN = re.compile(r"\[%clk\s+(\d+):(\d+):(\d+(?:\.\d+)?)\]")
+# Stands in for a clock comment in the movetext, so it is dropped along with its variation
+CLOCK_TOKEN = "%clk="
+
+
+def parse_headers(pgn: str) -> dict[str, str]:
+    """Parse the tag pair section of a PGN in a single pass
+
+    Parsing stops at the first line that is not a tag pair, so the movetext is never scanned.
+    """
+    headers: dict[str, str] = {}
+
+    # StringIO yields lines lazily, so the movetext is never split either
+    for line in io.StringIO(pgn):
+        line = line.strip()
+        if not line:
+            if headers:
+                # The blank line between tag pairs and movetext
+                break
+            continue
+
+        if not line.startswith("["):
+            break
+
+        for match in TAG_PAIR_PATTERN.finditer(line):
+            name, value = match.groups()
+            headers[name] = ESCAPE_PATTERN.sub(r"\1", value)
+
+    return headers
+
+
+def main_line_tokens(pgn: str, keep_clocks: bool = False) -> list[str]:
+    """Split the main line of a PGN into its moves, along with their clocks if keep_clocks is set"""
+    movetext = "\n".join(line for line in pgn.splitlines() if not line.lstrip().startswith("["))
+    movetext = COMMENT_PATTERN.sub(clock_token if keep_clocks else " ", movetext)
+    while True:
+        # Innermost variations first, they can be nested
+        movetext, removed = VARIATION_PATTERN.subn(" ", movetext)
+        if removed == 0:
+            break
+    return NOT_A_MOVE_PATTERN.sub(" ", movetext).split()
+
+
+def clock_token(comment: re.Match) -> str:
+    clock = CLOCK_PATTERN.search(comment.group(0))
+    if clock is None:
+        return " "
+    hours, minutes, seconds = clock.groups()
+    # In whole milliseconds, as the movetext is stripped of anything looking like a move number
+    milliseconds = round((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000)
+    return f" {CLOCK_TOKEN}{milliseconds} "
+
+
+def count_plies(pgn: str) -> int:
+    """Count the half moves in the main line of a PGN"""
+    return len(main_line_tokens(pgn))
+
+
+def parse_moves(pgn: str) -> list[tuple[str, Optional[float]]]:
+    """Parse the main line of a PGN into its moves in SAN, with the seconds left on the clock after each"""
+    moves: list[tuple[str, Optional[float]]] = []
+    for token in main_line_tokens(pgn, keep_clocks=True):
+        san, is_clock, milliseconds = token.partition(CLOCK_TOKEN)
+        if is_clock:
+            if moves:
+                moves[-1] = (moves[-1][0], int(milliseconds) / 1000)
+            continue
+        moves.append((token, None))
+    return moves
+
+
+@dataclass(frozen=True)
+class Game:
+    """A fetched game: its PGN along with its already parsed headers"""
+
+    pgn: str
+    headers: Mapping[str, str] = field(compare=False, repr=False)
+    _lower_headers: Mapping[str, str] = field(compare=False, repr=False)
+
+    @classmethod
+    def from_pgn(cls, pgn: str) -> Game:
+        headers = parse_headers(pgn)
+        return cls(
+            pgn=pgn,
+            headers=MappingProxyType(headers),
+            _lower_headers=MappingProxyType({name.lower(): value for name, value in headers.items()}),
+        )
+
+    def get(self, header: str, default: Optional[str] = None) -> Optional[str]:
+        """Return the value of a header, header names are case insensitive"""
+        return self._lower_headers.get(header.lower(), default)
+
+    @cached_property
+    def plies(self) -> int:
+        """Number of half moves played, only counted if needed"""
+        return count_plies(self.pgn)
+
+
+def as_game(game: Union[Game, str]) -> Game:
+    """Parse a PGN into a Game, unless it was already parsed"""
+    if isinstance(game, Game):
+        return game
+    return Game.from_pgn(game)
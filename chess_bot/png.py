@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import struct
+from typing import Sequence
+import zlib
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Indexed color, every pixel a byte indexing the palette
+COLOR_TYPE_PALETTE = 3
+# Rows are stored unfiltered, palette images barely compress better when filtered
+FILTER_NONE = b"\0"
+
+
+def chunk(kind: bytes, data: bytes) -> bytes:
+    """Wrap data in a PNG chunk: its length, kind, the data and a checksum of the kind and data"""
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png(pixels: bytes, width: int, height: int, palette: Sequence[tuple[int, int, int]]) -> bytes:
+    """Encode palette indices, row by row from the top left, into an 8 bit indexed PNG"""
+    colors = bytearray()
+    for rgb in palette:
+        colors += bytes(rgb)
+
+    rows = bytearray()
+    for start in range(0, width * height, width):
+        end = start + width
+        rows += FILTER_NONE
+        rows += pixels[start:end]
+
+    return b"".join(
+        [
+            SIGNATURE,
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, COLOR_TYPE_PALETTE, 0, 0, 0)),
+            chunk(b"PLTE", bytes(colors)),
+            # The default level, the highest takes several times longer for a few percent less
+            chunk(b"IDAT", zlib.compress(bytes(rows))),
+            chunk(b"IEND", b""),
+        ]
+    )
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Sequence
+
+from .bot import Chess2GIF, async_get_game_pgn, request_key
+from .budget import DEFAULT_UPLOAD_LIMIT
+from .logs import correlate
+from .metrics import track_stage
+from .pgn import Game
+from .process import ProcessError
+from .request import RenderRequest
+from .scheduler import RenderScheduler
+
+# Well within the default player PGN TTL, so watched players' PGNs never expire between polls
+DEFAULT_PREFETCH_INTERVAL = 30.0
+DEFAULT_PREFETCH_RENDERS = 1
+# How often a prefetch waiting for interactive renders to drain checks again
+IDLE_CHECK_INTERVAL = 1.0
+# Prefetch renders are queued as if they came from their own guild
+PREFETCH_GUILD = "prefetch"
+
+
+class Prefetcher:
+    """Keeps the latest game of every player in a watchlist fetched and rendered ahead of requests
+
+    Renders hold a slot of a separate scheduler, so prefetching has its own CPU budget, and only
+    start once no interactive request is waiting for a render slot. The PGN is refreshed on every
+    poll, so requests for a watched player never wait for cgf, and GIFs are warmed in the GIF cache.
+    """
+
+    def __init__(
+        self,
+        cog: Chess2GIF,
+        players: Sequence[str],
+        interval: float = DEFAULT_PREFETCH_INTERVAL,
+        max_renders: int = DEFAULT_PREFETCH_RENDERS,
+        idle_check_interval: float = IDLE_CHECK_INTERVAL,
+    ):
+        self.cog = cog
+        self.players = list(players)
+        if cog.pgn_cache is not None and interval >= cog.pgn_cache.player_ttl / 2:
+            # Polls take a while too, a PGN refreshed only as it expires would be missed by requests
+            logging.warning(
+                "Watching players every %gs, half the player PGN TTL, instead of every %gs",
+                cog.pgn_cache.player_ttl / 2,
+                interval,
+            )
+            interval = cog.pgn_cache.player_ttl / 2
+        self.interval = interval
+        self.idle_check_interval = idle_check_interval
+        self.scheduler = RenderScheduler(max_concurrency=max_renders, max_queue_size=max(len(players), 1))
+        self.latest: dict[str, str] = {}
+
+    async def run(self):
+        if self.cog.gif_cache is None:
+            logging.warning("No GIF cache to prefetch into, only PGNs of watched players are prefetched")
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                logging.exception("Prefetching failed")
+            await asyncio.sleep(self.interval)
+
+    async def poll(self):
+        """Fetch the latest game of every watched player, rendering the new ones"""
+        await asyncio.gather(*(self.prefetch(player) for player in self.players))
+
+    async def prefetch(self, player: str):
+        with correlate(f"prefetch:{player}"), track_stage("prefetch"):
+            # Always fetched, the cached PGN is what is being refreshed
+            try:
+                pgn, error = await async_get_game_pgn(
+                    player, "player", limits=self.cog.fetch_limits, fetcher=self.cog.fetcher
+                )
+            except ProcessError as e:
+                pgn, error = None, str(e)
+            if error is not None or pgn is None:
+                logging.warning("Prefetching %s failed with %s", player, error)
+                return
+
+            if self.cog.pgn_cache is not None:
+                self.cog.pgn_cache.put(player, "player", pgn)
+            if self.latest.get(player) != pgn:
+                logging.info("Prefetched a new game for %s", player)
+                self.latest[player] = pgn
+
+            # Requests from servers without boosts are the most common
+            request = RenderRequest(
+                search_type="player",
+                id_or_username=player,
+                upload_limit=DEFAULT_UPLOAD_LIMIT,
+                format=self.cog.default_format,
+            )
+            game = Game.from_pgn(pgn)
+            if self.cog.gif_cache is None or self.cog.get_cached_gif(request, game) is not None:
+                return
+
+            async with self.scheduler.enqueue(PREFETCH_GUILD, player):
+                await self.wait_for_idle()
+                if request_key(request, self.cog.gif_renderer) in self.cog.renders:
+                    # Someone asked for it in the meantime
+                    return
+                try:
+                    async with self.cog.acquire_gif(request, None, game) as (_, _, error):
+                        if error is not None:
+                            logging.warning("Pre-rendering %s failed with %s", player, error)
+                except ProcessError as e:
+                    logging.warning("Pre-rendering %s failed with %s", player, e)
+
+    async def wait_for_idle(self):
+        """Wait until no interactive request is waiting for a render slot"""
+        while self.cog.scheduler.queue_depth > 0:
+            await asyncio.sleep(self.idle_check_interval)
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import resource
+import signal
+import subprocess
+from typing import Callable, NamedTuple, Optional, Sequence
+
+STREAM_CHUNK_SIZE = 64 * 1024
+DEFAULT_FETCH_TIMEOUT = 30.0
+DEFAULT_RENDER_TIMEOUT = 120.0
+DEFAULT_MEMORY_LIMIT = 2 * 1024 * 1024 * 1024
+DEFAULT_CPU_LIMIT = 120
+DEFAULT_NICENESS = 10
+
+
+class ProcessError(Exception):
+    """Raised when a process is stopped before it could finish"""
+
+    def __init__(self, executable: str, message: str):
+        super().__init__(f"{executable} {message}")
+        self.executable = executable
+
+
+class ProcessTimeoutError(ProcessError):
+    """Raised when a process runs past its timeout, and is killed"""
+
+    def __init__(self, executable: str, timeout: float):
+        super().__init__(executable, f"timed out after {timeout:g}s")
+        self.timeout = timeout
+
+
+class ProcessKilledError(ProcessError):
+    """Raised when a process is killed by a signal, like the ones sent over its CPU or memory limits"""
+
+    def __init__(self, executable: str, signal_number: int):
+        try:
+            name = signal.Signals(signal_number).name
+        except ValueError:
+            name = str(signal_number)
+        super().__init__(executable, f"was killed by {name}")
+        self.signal_number = signal_number
+
+
+class ProcessLimits(NamedTuple):
+    """Limits for a process: seconds to finish, bytes of address space, seconds of CPU and niceness"""
+
+    timeout: Optional[float] = None
+    memory: Optional[int] = None
+    cpu: Optional[int] = None
+    niceness: int = 0
+
+    def apply(self, pid: int):
+        """Apply the limits to a process that was just started
+
+        Limits are set from the parent with prlimit rather than in a preexec_fn, which is unsafe
+        to run in a process with threads.
+        """
+        try:
+            if self.memory is not None:
+                resource.prlimit(pid, resource.RLIMIT_AS, (self.memory, self.memory))
+            if self.cpu is not None:
+                # SIGXCPU at the soft limit, SIGKILL a second later if it is ignored
+                resource.prlimit(pid, resource.RLIMIT_CPU, (self.cpu, self.cpu + 1))
+            if self.niceness != 0:
+                niceness = os.getpriority(os.PRIO_PROCESS, 0) + self.niceness
+                os.setpriority(os.PRIO_PROCESS, pid, niceness)
+        except ProcessLookupError:
+            # Already exited
+            pass
+
+
+NO_LIMITS = ProcessLimits()
+
+
+async def run_process(
+    args: Sequence[str],
+    stdout_sink: Optional[Callable[[bytes], None]] = None,
+    limits: ProcessLimits = NO_LIMITS,
+) -> tuple[bytes, str]:
+    """Run an executable without blocking the event loop
+
+    stdout and stderr are streamed concurrently so a chatty process can never fill up a pipe
+    and deadlock. Returns the collected stdout bytes and the decoded stderr. If a stdout_sink
+    is given, stdout chunks are handed to it as they arrive instead of being collected.
+
+    The process is killed if it runs past the timeout, raising ProcessTimeoutError, or if the
+    call is cancelled. ProcessKilledError is raised if it is killed by any other signal.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    logging.debug("Started %s with pid %s", args[0], proc.pid)
+
+    assert proc.stdout is not None and proc.stderr is not None
+    try:
+        limits.apply(proc.pid)
+        stdout, stderr = await asyncio.wait_for(
+            asyncio.gather(read_stream(proc.stdout, stdout_sink), read_stream(proc.stderr)), limits.timeout
+        )
+        await proc.wait()
+    except asyncio.TimeoutError:
+        await kill(proc)
+        raise ProcessTimeoutError(args[0], limits.timeout or 0.0) from None
+    except BaseException:
+        await kill(proc)
+        raise
+    logging.debug("%s (pid %s) exited with %s", args[0], proc.pid, proc.returncode)
+
+    if proc.returncode is not None and proc.returncode < 0:
+        raise ProcessKilledError(args[0], -proc.returncode)
+    return stdout, stderr.decode("utf-8")
+
+
+def run_process_sync(args: Sequence[str], limits: ProcessLimits = NO_LIMITS) -> tuple[bytes, str]:
+    """Like run_process, but blocking"""
+    with subprocess.Popen(
+        args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    ) as proc:
+        try:
+            limits.apply(proc.pid)
+            stdout, stderr = proc.communicate(timeout=limits.timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            raise ProcessTimeoutError(args[0], limits.timeout or 0.0) from None
+        except BaseException:
+            proc.kill()
+            raise
+
+    if proc.returncode < 0:
+        raise ProcessKilledError(args[0], -proc.returncode)
+    return stdout, stderr.decode("utf-8")
+
+
+async def kill(proc: asyncio.subprocess.Process):
+    """Kill a process, if it is still running, and reap it"""
+    if proc.returncode is None:
+        logging.info("Killing pid %s", proc.pid)
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+    await proc.wait()
+
+
+async def read_stream(stream: asyncio.StreamReader, sink: Optional[Callable[[bytes], None]] = None) -> bytes:
+    """Read a stream in chunks until EOF, collecting them unless they are handed to a sink"""
+    chunks = []
+    while True:
+        chunk = await stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        if sink is not None:
+            sink(chunk)
+        else:
+            chunks.append(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import asyncio
+
+from .pgn import Game
+
+QUEUED = "queued"
+RENDERING = "rendering"
+
+
+class RenderProgress:
+    """The stage a render is at, followed by every request waiting for it"""
+
+    def __init__(self, game: Game):
+        self.stage = QUEUED
+        self.game = game
+        self._changed = asyncio.Event()
+
+    def advance(self, stage: str):
+        self.stage = stage
+        # Wake up everyone waiting for this change, later waiters wait for the next one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def changed(self):
+        """Wait for the render to advance to another stage"""
+        await self._changed.wait()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import time
+from typing import Callable, Hashable, NamedTuple, Optional
+
+# Requests allowed per period, as a burst refilled at a steady rate
+DEFAULT_USER_RATE_LIMIT = "5/60"
+DEFAULT_CHANNEL_RATE_LIMIT = "20/60"
+DEFAULT_GUILD_RATE_LIMIT = "60/60"
+# Users being rate limited are told to slow down at most this often
+DEFAULT_WARNING_INTERVAL = 60.0
+
+
+class RateLimitedError(Exception):
+    """Raised when a request is over the rate limit of its user, channel or guild"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class RateLimit(NamedTuple):
+    """Allow a burst of requests, refilled at burst / period requests per second"""
+
+    burst: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.burst / self.period
+
+
+def parse_rate_limit(value: str) -> RateLimit:
+    """Parse a rate limit like 5/60, five requests every sixty seconds"""
+    burst, _, period = value.partition("/")
+    limit = RateLimit(int(burst), float(period or 1))
+    if limit.burst < 1 or limit.period <= 0:
+        raise ValueError(f"rate limits must allow at least one request over a positive period: {value}")
+    return limit
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class Buckets:
+    """Token buckets for any number of keys sharing a rate limit
+
+    A bucket left idle long enough to refill completely is the same as a new one, so it is
+    forgotten. Buckets are kept in the order they were last used and only the oldest are looked at,
+    which keeps memory proportional to the keys seen in the last period.
+    """
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self._buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def tokens(self, key: Hashable, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return float(self.limit.burst)
+        return min(self.limit.burst, bucket.tokens + (now - bucket.updated_at) * self.limit.rate)
+
+    def retry_after(self, key: Hashable, cost: int, now: float) -> float:
+        """Seconds until the bucket holds cost tokens, 0 if it already does
+
+        A cost over the burst only needs a full bucket, otherwise it could never be paid.
+        """
+        missing = min(cost, self.limit.burst) - self.tokens(key, now)
+        return max(missing, 0.0) / self.limit.rate
+
+    def take(self, key: Hashable, cost: int, now: float):
+        tokens = self.tokens(key, now) - min(cost, self.limit.burst)
+        self._buckets.pop(key, None)
+        self._buckets[key] = TokenBucket(tokens, now)
+        self.expire(now)
+
+    def expire(self, now: float):
+        """Forget the buckets that refilled completely"""
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket.tokens + (now - bucket.updated_at) * self.limit.rate < self.limit.burst:
+                return
+            del self._buckets[key]
+
+
+class RateLimiter:
+    """Limit requests per user, channel and guild, all of which must have room for a request"""
+
+    def __init__(
+        self,
+        user: RateLimit = parse_rate_limit(DEFAULT_USER_RATE_LIMIT),
+        channel: RateLimit = parse_rate_limit(DEFAULT_CHANNEL_RATE_LIMIT),
+        guild: RateLimit = parse_rate_limit(DEFAULT_GUILD_RATE_LIMIT),
+        warning_interval: float = DEFAULT_WARNING_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.users = Buckets(user)
+        self.channels = Buckets(channel)
+        self.guilds = Buckets(guild)
+        self.warnings = Buckets(RateLimit(1, warning_interval))
+        self.clock = clock
+
+    def acquire(self, user_id: Hashable, channel_id: Hashable, guild_id: Optional[Hashable], cost: int = 1):
+        """Take cost tokens from every bucket of a request, raising RateLimitedError if one is short
+
+        Nothing is taken unless every level has room, so a rejected request costs nothing.
+        """
+        now = self.clock()
+        levels = [(self.users, user_id), (self.channels, channel_id)]
+        if guild_id is not None:
+            # Direct messages only count against the user and the channel
+            levels.append((self.guilds, guild_id))
+
+        retry_after = max(buckets.retry_after(key, cost, now) for buckets, key in levels)
+        if retry_after > 0:
+            raise RateLimitedError(retry_after)
+
+        for buckets, key in levels:
+            buckets.take(key, cost, now)
+
+    def should_warn(self, user_id: Hashable) -> bool:
+        """Whether a rate limited user should be told, at most once every warning interval"""
+        now = self.clock()
+        if self.warnings.retry_after(user_id, 1, now) > 0:
+            return False
+        self.warnings.take(user_id, 1, now)
+        return True
@@ -0,0 +1,500 @@
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+import concurrent.futures
+import functools
+import math
+import multiprocessing
+import os
+from typing import Callable, NamedTuple, Optional, Sequence, Union
+
+from .budget import DEFAULT_BOARD_SIZE
+from .gif import GIFWriter, color_bits, encode_image
+from .pgn import Game, as_game, parse_moves
+from .png import encode_png
+from .process import ProcessTimeoutError
+from .replay import Board, ReplayError, changed_squares, replay
+from .request import RenderRequest
+from .spool import GIFOutput, RenderedGIF
+
+RGB = tuple[int, int, int]
+
+# The colors c2g draws boards with
+DEFAULT_LIGHT: RGB = (240, 217, 181)
+DEFAULT_DARK: RGB = (181, 136, 99)
+WHITE_PIECE: RGB = (255, 255, 255)
+BLACK_PIECE: RGB = (48, 48, 48)
+OUTLINE: RGB = (0, 0, 0)
+DEFAULT_DELAY = 1000
+# The final position is held a while before the GIF loops
+LAST_FRAME_DELAY = 5000
+
+# Palette indices
+LIGHT_INDEX, DARK_INDEX, WHITE_INDEX, BLACK_INDEX, OUTLINE_INDEX, TRANSPARENT_INDEX = range(6)
+PALETTE_BITS = color_bits(TRANSPARENT_INDEX + 1)
+# Encoded frames kept by every atlas, most games share their opening moves
+DEFAULT_FRAME_CACHE_SIZE = 4096
+
+# Pieces are drawn from shapes in a unit square: circles (cx, cy, r), rects (x0, y0, x1, y1) and polygons
+Shape = tuple[str, tuple[float, ...]]
+BASE: Shape = ("rect", (0.26, 0.72, 0.74, 0.84))
+PIECE_SHAPES: dict[str, list[Shape]] = {
+    "P": [
+        ("circle", (0.5, 0.33, 0.12)),
+        ("polygon", (0.42, 0.42, 0.58, 0.42, 0.66, 0.72, 0.34, 0.72)),
+        BASE,
+    ],
+    "N": [
+        (
+            "polygon",
+            (0.32, 0.72, 0.70, 0.72, 0.70, 0.52, 0.64, 0.34, 0.54, 0.22, 0.48, 0.14, 0.44, 0.22,
+             0.32, 0.30, 0.22, 0.46, 0.26, 0.54, 0.36, 0.52, 0.46, 0.46, 0.34, 0.62),
+        ),
+        BASE,
+    ],
+    "B": [
+        ("circle", (0.5, 0.18, 0.06)),
+        ("polygon", (0.5, 0.23, 0.63, 0.40, 0.60, 0.56, 0.40, 0.56, 0.37, 0.40)),
+        ("rect", (0.37, 0.56, 0.63, 0.62)),
+        ("polygon", (0.42, 0.62, 0.58, 0.62, 0.64, 0.72, 0.36, 0.72)),
+        BASE,
+    ],
+    "R": [
+        ("rect", (0.28, 0.18, 0.38, 0.32)),
+        ("rect", (0.45, 0.18, 0.55, 0.32)),
+        ("rect", (0.62, 0.18, 0.72, 0.32)),
+        ("rect", (0.28, 0.30, 0.72, 0.40)),
+        ("polygon", (0.34, 0.40, 0.66, 0.40, 0.69, 0.72, 0.31, 0.72)),
+        BASE,
+    ],
+    "Q": [
+        ("circle", (0.22, 0.27, 0.05)),
+        ("circle", (0.36, 0.21, 0.05)),
+        ("circle", (0.5, 0.18, 0.05)),
+        ("circle", (0.64, 0.21, 0.05)),
+        ("circle", (0.78, 0.27, 0.05)),
+        (
+            "polygon",
+            (0.22, 0.30, 0.36, 0.50, 0.36, 0.24, 0.50, 0.48, 0.64, 0.24, 0.64, 0.50, 0.78, 0.30,
+             0.68, 0.72, 0.32, 0.72),
+        ),
+        BASE,
+    ],
+    "K": [
+        ("rect", (0.46, 0.10, 0.54, 0.32)),
+        ("rect", (0.39, 0.16, 0.61, 0.23)),
+        ("polygon", (0.28, 0.40, 0.44, 0.32, 0.56, 0.32, 0.72, 0.40, 0.66, 0.72, 0.34, 0.72)),
+        BASE,
+    ],
+}
+
+# Coordinates are drawn in a 3x5 pixel font, scaled with the board
+GLYPHS = {
+    "1": (".#.", "##.", ".#.", ".#.", "###"),
+    "2": ("##.", "..#", ".#.", "#..", "###"),
+    "3": ("##.", "..#", ".#.", "..#", "##."),
+    "4": ("#.#", "#.#", "###", "..#", "..#"),
+    "5": ("###", "#..", "##.", "..#", "##."),
+    "6": (".##", "#..", "###", "#.#", "###"),
+    "7": ("###", "..#", ".#.", ".#.", ".#."),
+    "8": ("###", "#.#", "###", "#.#", "###"),
+    "a": ("...", "##.", ".##", "#.#", "###"),
+    "b": ("#..", "#..", "##.", "#.#", "##."),
+    "c": ("...", ".##", "#..", "#..", ".##"),
+    "d": ("..#", "..#", ".##", "#.#", ".##"),
+    "e": ("...", ".#.", "###", "#..", ".##"),
+    "f": (".##", "#..", "##.", "#..", "#.."),
+    "g": (".##", "#.#", ".##", "..#", "##."),
+    "h": ("#..", "#..", "##.", "#.#", "#.#"),
+}
+
+
+class RenderOptions(NamedTuple):
+    """Everything a render needs, sent as is to the process rendering it"""
+
+    pgn: str
+    board_size: int = DEFAULT_BOARD_SIZE
+    delay: Optional[int] = None
+    light: RGB = DEFAULT_LIGHT
+    dark: RGB = DEFAULT_DARK
+    coordinates: bool = True
+    flip: bool = False
+    ply: Optional[int] = None
+
+
+def parse_rgb(value: Optional[str], default: RGB) -> RGB:
+    if value is None:
+        return default
+    red, green, blue = (int(channel) for channel in value.split(","))
+    return red, green, blue
+
+
+def render_options(game: Union[Game, str], request: RenderRequest, flip: bool = False) -> RenderOptions:
+    """Translate the options c2g would be run with into render options
+
+    Real time delays are given as None. Of the features that can be disabled, only coordinates are
+    drawn, player bars and clocks are never drawn.
+    """
+    delay = None if request.time == "real" else int(request.time or DEFAULT_DELAY)
+    return RenderOptions(
+        pgn=as_game(game).pgn,
+        board_size=request.board_size or DEFAULT_BOARD_SIZE,
+        delay=delay,
+        light=parse_rgb(request.light, DEFAULT_LIGHT),
+        dark=parse_rgb(request.dark, DEFAULT_DARK),
+        coordinates="coordinates" not in request.disable,
+        flip=flip,
+        ply=request.ply,
+    )
+
+
+def rasterize(shapes: Sequence[Shape], size: int) -> bytearray:
+    """Fill shapes into a size by size mask, a pixel is filled if its center is inside a shape"""
+    mask = bytearray(size * size)
+    for row in range(size):
+        y = (row + 0.5) / size
+        for kind, values in shapes:
+            for start, end in shape_spans(kind, values, y):
+                first = max(math.ceil(start * size - 0.5), 0)
+                last = min(math.floor(end * size - 0.5), size - 1)
+                if first <= last:
+                    start = row * size + first
+                    end = start + last - first + 1
+                    mask[start:end] = b"\x01" * (last - first + 1)
+    return mask
+
+
+def shape_spans(kind: str, values: tuple[float, ...], y: float) -> list[tuple[float, float]]:
+    """Return the horizontal spans of a shape crossing the line at height y"""
+    if kind == "rect":
+        x0, y0, x1, y1 = values
+        return [(x0, x1)] if y0 <= y < y1 else []
+    if kind == "circle":
+        cx, cy, r = values
+        if abs(y - cy) >= r:
+            return []
+        half = math.sqrt(r * r - (y - cy) ** 2)
+        return [(cx - half, cx + half)]
+
+    points = list(zip(values[::2], values[1::2]))
+    crossings = []
+    for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+        if (y0 <= y < y1) or (y1 <= y < y0):
+            crossings.append(x0 + (y - y0) * (x1 - x0) / (y1 - y0))
+    crossings.sort()
+    return list(zip(crossings[::2], crossings[1::2]))
+
+
+def dilate(mask: bytearray, size: int, times: int) -> bytearray:
+    for _ in range(times):
+        grown = bytearray(mask)
+        for index, filled in enumerate(mask):
+            if not filled:
+                continue
+            row, col = divmod(index, size)
+            first, last = max(col - 1, 0), min(col + 1, size - 1)
+            for neighbor_row in range(max(row - 1, 0), min(row + 2, size)):
+                start = neighbor_row * size + first
+                end = start + last - first + 1
+                grown[start:end] = b"\x01" * (last - first + 1)
+        mask = grown
+    return mask
+
+
+class Frame(NamedTuple):
+    image: bytes
+    left: int
+    top: int
+    width: int
+    height: int
+
+
+class Sprite(NamedTuple):
+    fill: list[int]
+    outline: list[int]
+
+
+def make_sprite(shapes: Sequence[Shape], size: int) -> Sprite:
+    mask = rasterize(shapes, size)
+    outlined = dilate(mask, size, max(size // 40, 1))
+    return Sprite(
+        fill=[index for index, filled in enumerate(mask) if filled],
+        outline=[index for index, filled in enumerate(outlined) if filled and not mask[index]],
+    )
+
+
+class SpriteAtlas:
+    """Square tiles of a board, with or without a piece, rasterized once and reused by every frame
+
+    Frames are drawn in palette indices, so they are encoded once for any board colors and kept
+    for the next game playing the same move from the same squares.
+    """
+
+    def __init__(
+        self,
+        square_size: int,
+        coordinates: bool,
+        flip: bool,
+        frame_cache_size: int = DEFAULT_FRAME_CACHE_SIZE,
+    ):
+        self.square_size = square_size
+        self.coordinates = coordinates
+        self.flip = flip
+        self.frame_cache_size = frame_cache_size
+        self.sprites = {kind: make_sprite(shapes, square_size) for kind, shapes in PIECE_SHAPES.items()}
+        self._tiles: dict[tuple[str, int, str, str], bytes] = {}
+        self._frames: OrderedDict[tuple[tuple[int, str], ...], Frame] = OrderedDict()
+        for piece in ("", *PIECE_SHAPES, *(kind.lower() for kind in PIECE_SHAPES)):
+            for color in (LIGHT_INDEX, DARK_INDEX):
+                self.tile_for(piece, color, "", "")
+
+    def screen_position(self, square: int) -> tuple[int, int]:
+        """Return the column and row a square is drawn at, counting from the top left"""
+        file, rank = square % 8, square // 8
+        if self.flip:
+            return 7 - file, rank
+        return file, 7 - rank
+
+    def frame(self, board: Board, squares: Sequence[int]) -> Frame:
+        """Return the encoded frame drawing squares of a board"""
+        key = tuple((square, board[square]) for square in squares)
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+            return frame
+
+        pixels, left, top, width, height = draw_squares(self, board, squares)
+        frame = self._frames[key] = Frame(encode_image(pixels, PALETTE_BITS), left, top, width, height)
+        while len(self._frames) > self.frame_cache_size:
+            self._frames.popitem(last=False)
+        return frame
+
+    def tile(self, square: int, piece: str) -> bytes:
+        file, rank = square % 8, square // 8
+        color = LIGHT_INDEX if (file + rank) % 2 else DARK_INDEX
+        rank_label = file_label = ""
+        if self.coordinates:
+            column, row = self.screen_position(square)
+            rank_label = str(rank + 1) if column == 0 else ""
+            file_label = "abcdefgh"[file] if row == 7 else ""
+        return self.tile_for(piece, color, rank_label, file_label)
+
+    def tile_for(self, piece: str, color: int, rank_label: str, file_label: str) -> bytes:
+        key = (piece, color, rank_label, file_label)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            return tile
+
+        size = self.square_size
+        pixels = bytearray([color]) * (size * size)
+        if piece:
+            sprite = self.sprites[piece.upper()]
+            fill = WHITE_INDEX if piece.isupper() else BLACK_INDEX
+            for index in sprite.outline:
+                pixels[index] = OUTLINE_INDEX
+            for index in sprite.fill:
+                pixels[index] = fill
+
+        label_color = DARK_INDEX if color == LIGHT_INDEX else LIGHT_INDEX
+        scale = max(size // 24, 1)
+        if rank_label:
+            draw_label(pixels, size, rank_label, scale, scale, scale, label_color)
+        if file_label:
+            left, top = size - 4 * scale, size - 6 * scale
+            draw_label(pixels, size, file_label, left, top, scale, label_color)
+
+        tile = self._tiles[key] = bytes(pixels)
+        return tile
+
+
+def draw_label(pixels: bytearray, size: int, label: str, left: int, top: int, scale: int, color: int):
+    for glyph_row, line in enumerate(GLYPHS[label]):
+        for glyph_column, dot in enumerate(line):
+            if dot != "#":
+                continue
+            for y in range(top + glyph_row * scale, top + (glyph_row + 1) * scale):
+                start = y * size + left + glyph_column * scale
+                end = start + scale
+                pixels[start:end] = bytes([color]) * scale
+
+
+@functools.lru_cache(maxsize=32)
+def get_atlas(square_size: int, coordinates: bool, flip: bool) -> SpriteAtlas:
+    """Return the atlas for a board, built on first use in every process"""
+    return SpriteAtlas(square_size, coordinates, flip)
+
+
+def frame_delays(pgn: str, moves: Sequence[tuple[str, Optional[float]]], delay: Optional[int]) -> list[int]:
+    """Return how long to show the position before every move, and the final one, in milliseconds
+
+    Real time delays are the time spent thinking on the next move, from the clocks in the PGN.
+    """
+    if delay is not None:
+        delays = [delay] * len(moves)
+    else:
+        increment = time_increment(pgn)
+        clocks: list[Optional[float]] = [None, None]
+        delays = []
+        for ply, (_, clock) in enumerate(moves):
+            previous = clocks[ply % 2]
+            if clock is None or previous is None:
+                delays.append(DEFAULT_DELAY)
+            else:
+                delays.append(max(round((previous - clock + increment) * 1000), 0))
+            clocks[ply % 2] = clock
+    return [*delays, max(delay or 0, LAST_FRAME_DELAY)]
+
+
+def time_increment(pgn: str) -> float:
+    """Return the seconds added to the clock after every move, from a time control like 180+2"""
+    time_control = Game.from_pgn(pgn).get("TimeControl", "")
+    _, _, increment = (time_control or "").partition("+")
+    try:
+        return float(increment)
+    except ValueError:
+        return 0.0
+
+
+def palette(options: RenderOptions) -> list[RGB]:
+    # The transparent color is never shown
+    return [options.light, options.dark, WHITE_PIECE, BLACK_PIECE, OUTLINE, OUTLINE]
+
+
+def draw_squares(
+    atlas: SpriteAtlas, board: Board, squares: Sequence[int]
+) -> tuple[bytes, int, int, int, int]:
+    """Draw squares of a board in the smallest rectangle around them, leaving the rest transparent
+
+    Returns the pixels, along with the left and top offsets, width and height of the rectangle.
+    """
+    size = atlas.square_size
+    positions = [atlas.screen_position(square) for square in squares]
+    first_column = min(column for column, _ in positions)
+    first_row = min(row for _, row in positions)
+    columns = max(column for column, _ in positions) - first_column + 1
+    rows = max(row for _, row in positions) - first_row + 1
+
+    width = columns * size
+    pixels = bytearray([TRANSPARENT_INDEX]) * (width * rows * size)
+    for square, (column, row) in zip(squares, positions):
+        tile = atlas.tile(square, board[square])
+        left = (column - first_column) * size
+        top = (row - first_row) * size
+        for y in range(size):
+            start = (top + y) * width + left
+            row, next_row = y * size, (y + 1) * size
+            end = start + size
+            pixels[start:end] = tile[row:next_row]
+    return bytes(pixels), first_column * size, first_row * size, width, rows * size
+
+
+def render_gif(options: RenderOptions) -> bytes:
+    """Render a game into a GIF, raising ReplayError if its moves can't be played
+
+    The first frame is the whole board, every other frame only covers the squares the move changed.
+    """
+    game = Game.from_pgn(options.pgn)
+    moves = parse_moves(options.pgn)
+    boards = replay([san for san, _ in moves], game.get("FEN"))
+    delays = frame_delays(options.pgn, moves, options.delay)
+
+    atlas = get_atlas(options.board_size // 8, options.coordinates, options.flip)
+    size = atlas.square_size * 8
+    writer = GIFWriter(size, size, palette(options))
+
+    writer.add_encoded_frame(*atlas.frame(boards[0], range(64)), delays[0])
+    for previous, board, delay in zip(boards, boards[1:], delays[1:]):
+        frame = atlas.frame(board, changed_squares(previous, board))
+        writer.add_encoded_frame(*frame, delay, transparent=TRANSPARENT_INDEX)
+    return writer.finish()
+
+
+def render_png(options: RenderOptions) -> bytes:
+    """Render a single position of a game into a PNG, the final one unless options.ply picks another
+
+    Moves past the chosen ply are never played, a ply past the end of the game shows the final position.
+    """
+    game = Game.from_pgn(options.pgn)
+    moves = [san for san, _ in parse_moves(options.pgn)]
+    board = replay(moves[: options.ply] if options.ply is not None else moves, game.get("FEN"))[-1]
+
+    atlas = get_atlas(options.board_size // 8, options.coordinates, options.flip)
+    pixels, _, _, width, height = draw_squares(atlas, board, range(64))
+    # The transparent color is never drawn on a full board
+    return encode_png(pixels, width, height, palette(options)[:TRANSPARENT_INDEX])
+
+
+def render_function(request: RenderRequest) -> Callable[[RenderOptions], bytes]:
+    return render_png if request.format == "png" else render_gif
+
+
+def write_gif(data: bytes, output: GIFOutput):
+    if isinstance(output, RenderedGIF):
+        output.write(data)
+        output.finish()
+    else:
+        output.write_bytes(data)
+
+
+class NativeRenderer:
+    """Renders GIFs without c2g, or PNGs of a single position, in a pool of processes on hosts with more
+    than one core
+
+    Renders can't be killed like c2g can, a render past its timeout is abandoned and left to finish.
+    """
+
+    name = "renderer"
+
+    def __init__(self, processes: Optional[int] = None):
+        self.processes = processes if processes is not None else os.cpu_count() or 1
+        self._pool: Optional[concurrent.futures.Executor] = None
+
+    @property
+    def pool(self) -> concurrent.futures.Executor:
+        if self._pool is None:
+            if self.processes > 1:
+                # Forking a process running the event loop and Discord's threads is not safe
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._pool = concurrent.futures.ThreadPoolExecutor(1)
+        return self._pool
+
+    async def render(
+        self,
+        game: Game,
+        request: RenderRequest,
+        output: GIFOutput,
+        flip: bool = False,
+        timeout: Optional[float] = None,
+    ) -> Optional[str]:
+        """Render a game into output in the request's format, returning an error if a move can't be played"""
+        loop = asyncio.get_running_loop()
+        options = render_options(game, request, flip)
+        future = loop.run_in_executor(self.pool, render_function(request), options)
+        try:
+            data = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise ProcessTimeoutError(self.name, timeout or 0.0) from None
+        except ReplayError as e:
+            return str(e)
+        write_gif(data, output)
+        return None
+
+    def render_sync(
+        self, game: Game, request: RenderRequest, output: GIFOutput, flip: bool = False
+    ) -> Optional[str]:
+        """Like render, but blocking and in this process"""
+        try:
+            data = render_function(request)(render_options(game, request, flip))
+        except ReplayError as e:
+            return str(e)
+        write_gif(data, output)
+        return None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
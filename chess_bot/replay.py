@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import re
+from typing import Optional, Sequence
+
+# Squares are numbered from a1 to h8, rank by rank, pieces are FEN letters, uppercase for white
+Board = list[str]
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+CASTLING_PATTERN = re.compile(r"^[O0]-[O0](-[O0])?$")
+# The trailing marks of a move that don't change it: checks, mates and annotations
+SAN_SUFFIXES = "+#!?"
+
+KNIGHT_STEPS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+KING_STEPS = ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))
+ROOK_DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (-1, 1), (-1, -1), (1, -1))
+
+
+class ReplayError(Exception):
+    """Raised when a move can't be played, the PGN is broken or not standard chess"""
+
+
+def square(name: str) -> int:
+    return (int(name[1]) - 1) * 8 + "abcdefgh".index(name[0])
+
+
+def is_white(piece: str) -> bool:
+    return piece.isupper()
+
+
+def parse_fen(fen: str) -> tuple[Board, bool]:
+    """Parse the placement and side to move of a FEN"""
+    fields = fen.split()
+    ranks = fields[0].split("/")
+    if len(ranks) != 8:
+        raise ReplayError(f"Invalid FEN: {fen}")
+
+    board: Board = [""] * 64
+    for rank, row in zip(range(7, -1, -1), ranks):
+        file = 0
+        for char in row:
+            if char.isdigit():
+                file += int(char)
+            elif file < 8:
+                board[rank * 8 + file] = char
+                file += 1
+            else:
+                raise ReplayError(f"Invalid FEN: {fen}")
+    return board, len(fields) < 2 or fields[1] == "w"
+
+
+def reaches(board: Board, origin: int, target: int, steps: Sequence[tuple[int, int]], slides: bool) -> bool:
+    """Check a piece moving along steps can go from origin to target on this board"""
+    file, rank = origin % 8, origin // 8
+    for file_step, rank_step in steps:
+        to_file, to_rank = file + file_step, rank + rank_step
+        while 0 <= to_file < 8 and 0 <= to_rank < 8:
+            to = to_rank * 8 + to_file
+            if to == target:
+                return True
+            if not slides or board[to]:
+                break
+            to_file, to_rank = to_file + file_step, to_rank + rank_step
+    return False
+
+
+def can_move(board: Board, origin: int, target: int) -> bool:
+    """Check the piece on origin moves, or captures, like it would to reach target, pawns aside"""
+    kind = board[origin].upper()
+    if kind == "N":
+        return reaches(board, origin, target, KNIGHT_STEPS, slides=False)
+    if kind == "K":
+        return reaches(board, origin, target, KING_STEPS, slides=False)
+    if kind == "R":
+        return reaches(board, origin, target, ROOK_DIRECTIONS, slides=True)
+    if kind == "B":
+        return reaches(board, origin, target, BISHOP_DIRECTIONS, slides=True)
+    if kind == "Q":
+        return reaches(board, origin, target, ROOK_DIRECTIONS + BISHOP_DIRECTIONS, slides=True)
+    return False
+
+
+def is_attacked(board: Board, target: int, by_white: bool) -> bool:
+    for origin, piece in enumerate(board):
+        if not piece or is_white(piece) != by_white:
+            continue
+        if piece.upper() == "P":
+            direction = 1 if by_white else -1
+            if target // 8 - origin // 8 == direction and abs(target % 8 - origin % 8) == 1:
+                return True
+        elif can_move(board, origin, target):
+            return True
+    return False
+
+
+def leaves_king_in_check(board: Board, origin: int, target: int, white: bool) -> bool:
+    after = board.copy()
+    after[target], after[origin] = after[origin], ""
+    king = "K" if white else "k"
+    return king in after and is_attacked(after, after.index(king), by_white=not white)
+
+
+def play(board: Board, san: str, white: bool) -> Board:
+    """Play a move in SAN, returning the board after it"""
+    move = san.rstrip(SAN_SUFFIXES)
+    after = board.copy()
+    back_rank = 0 if white else 56
+
+    if CASTLING_PATTERN.match(move):
+        king, rook = ("K", "R") if white else ("k", "r")
+        if move.count("-") == 2:
+            king_from, king_to, rook_from, rook_to = 4, 2, 0, 3
+        else:
+            king_from, king_to, rook_from, rook_to = 4, 6, 7, 5
+        between = range(min(king_from, rook_from) + 1, max(king_from, rook_from))
+        in_place = board[back_rank + king_from] == king and board[back_rank + rook_from] == rook
+        if not in_place or any(board[back_rank + file] for file in between):
+            raise ReplayError(f"Can't castle: {san}")
+        after[back_rank + king_from] = after[back_rank + rook_from] = ""
+        after[back_rank + king_to], after[back_rank + rook_to] = king, rook
+        return after
+
+    match = SAN_PATTERN.match(move)
+    if match is None:
+        raise ReplayError(f"Not a move: {san}")
+    kind, from_file, from_rank, target_name, promotion = match.groups()
+    target = square(target_name)
+    if board[target] and is_white(board[target]) == white:
+        raise ReplayError(f"Can't capture own piece: {san}")
+
+    if kind is None:
+        origin = pawn_origin(board, target, from_file, white, san)
+        if from_file is not None and not board[target]:
+            # En passant, the captured pawn is beside the capturing one
+            after[target - 8 if white else target + 8] = ""
+        after[target], after[origin] = board[origin], ""
+        if promotion is not None:
+            after[target] = promotion if white else promotion.lower()
+        return after
+
+    piece = kind if white else kind.lower()
+    candidates = []
+    for origin, occupant in enumerate(board):
+        if occupant != piece:
+            continue
+        if from_file is not None and origin % 8 != "abcdefgh".index(from_file):
+            continue
+        if from_rank is not None and origin // 8 != int(from_rank) - 1:
+            continue
+        if can_move(board, origin, target):
+            candidates.append(origin)
+    if len(candidates) > 1:
+        # SAN only disambiguates between legal moves, the others are pinned
+        candidates = [
+            origin for origin in candidates if not leaves_king_in_check(board, origin, target, white)
+        ]
+    if len(candidates) != 1:
+        raise ReplayError(f"Can't play {san}")
+    after[target], after[candidates[0]] = piece, ""
+    return after
+
+
+def pawn_origin(board: Board, target: int, from_file: Optional[str], white: bool, san: str) -> int:
+    pawn, direction = ("P", 8) if white else ("p", -8)
+    if from_file is not None:
+        origin = (target // 8) * 8 - direction + "abcdefgh".index(from_file)
+        if 0 <= origin < 64 and board[origin] == pawn and abs(origin % 8 - target % 8) == 1:
+            return origin
+    elif not board[target]:
+        origin = target - direction
+        if 0 <= origin < 64 and board[origin] == pawn:
+            return origin
+        # Double steps from the starting rank
+        origin -= direction
+        start_rank = 1 if white else 6
+        if origin // 8 == start_rank and board[origin] == pawn and not board[origin + direction]:
+            return origin
+    raise ReplayError(f"Can't play {san}")
+
+
+def replay(moves: Sequence[str], fen: Optional[str] = None) -> list[Board]:
+    """Play moves in SAN from the starting position, or a FEN, returning the board before and after each"""
+    board, white = parse_fen(fen or START_FEN)
+    boards = [board]
+    for san in moves:
+        board = play(board, san, white)
+        boards.append(board)
+        white = not white
+    return boards
+
+
+def changed_squares(before: Board, after: Board) -> list[int]:
+    return [index for index in range(64) if before[index] != after[index]]
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+from typing import Iterable, Mapping, NamedTuple, Optional
+
+import discord
+
+# Discord allows up to 10 attachments per message
+MAX_BATCH_SIZE = 10
+SEARCH_TYPES = ("id", "player")
+# What a game can be rendered as: an animation of every move, or a still of a single position
+FORMATS = ("gif", "png", "webp", "mp4")
+MISSING_SEARCH_ERROR = (
+    'Messages must contain "id" or "player", request help for more information: @Chess2GIF help'
+)
+MISSING_SEARCH_OPTION_ERROR = "Pick a game to GIF with the id or player option, like /gif player:hikaru"
+
+
+class RenderRequest(NamedTuple):
+    """A validated request to GIF a game, or several games if id_or_username is comma separated
+
+    upload_limit is the size in bytes the GIF has to fit in, and board_size the board size chosen
+    for it. Neither comes from the message. A format of None is rendered in the bot's default
+    format, and ply is the position a png shows, the final one if None. last is how many of a
+    player's latest games are asked for, and game which of them a request in a batch is for,
+    1 being the latest.
+    """
+
+    search_type: str
+    id_or_username: str
+    time: Optional[str] = None
+    disable: tuple[str, ...] = ()
+    light: Optional[str] = None
+    dark: Optional[str] = None
+    last: int = 1
+    upload_limit: Optional[int] = None
+    board_size: Optional[int] = None
+    format: Optional[str] = None
+    ply: Optional[int] = None
+    game: int = 1
+
+
+def mentions_user(content: str, user_id: int) -> bool:
+    """Check for a raw mention, like <@123> or <@!123>, without resolving any mention"""
+    return f"<@{user_id}>" in content or f"<@!{user_id}>" in content
+
+
+def parse_message(
+    message: discord.Message, bot_user: discord.ClientUser
+) -> tuple[Optional[RenderRequest], Optional[str]]:
+    """Parse a message sent to the bot, returning None for messages that should be ignored
+
+    Most messages in a guild are not for the bot, so they are turned away by looking at the raw
+    content and author id only. Resolving mentions with clean_content is never needed.
+    """
+    if message.author.id == bot_user.id:
+        # Ignore messages by the bot itself
+        return None, None
+
+    if message.mention_everyone is True:
+        # Ignore messages that mention everyone
+        return None, None
+
+    if not mentions_user(message.content, bot_user.id):
+        # Ignore messages that do not mention the bot
+        return None, None
+
+    return parse_request(message.content.split())
+
+
+def parse_options(options: Mapping[str, object]) -> tuple[Optional[RenderRequest], Optional[str]]:
+    """Parse the options of a /gif command into a request, validated like the options of a message"""
+    request, error = parse_request(f"{name}:{value}" for name, value in options.items())
+    if request is None and error in (None, MISSING_SEARCH_ERROR):
+        return None, MISSING_SEARCH_OPTION_ERROR
+    return request, error
+
+
+def parse_request(tokens: Iterable[str]) -> tuple[Optional[RenderRequest], Optional[str]]:
+    """Parse key:value tokens, like id:123 or time:real, into a request
+
+    Tokens without a colon, like the mention itself, are skipped. Returns None and no error for
+    requests for help, which are answered by the help command.
+    """
+    fields: dict[str, str] = {}
+    words = []
+    for token in tokens:
+        key, separator, value = token.partition(":")
+        if not separator:
+            if not token.startswith("<@"):
+                words.append(token)
+            continue
+        fields[key] = value
+
+    if words == ["help"] and not fields:
+        return None, None
+
+    search_type = next((key for key in reversed(fields) if key in SEARCH_TYPES), None)
+    if search_type is None:
+        # All calls to the bot should contain "id:" or "player:" so this is probably a user error
+        return None, MISSING_SEARCH_ERROR
+
+    time = fields.get("time")
+    if time is not None and time != "real" and not time.isdecimal():
+        return None, 'time must be "real" or a delay in milliseconds, like time:1000'
+
+    for color in ("light", "dark"):
+        if color in fields and not is_rgb(fields[color]):
+            return None, f"{color} must be a color like {color}:255,255,255"
+
+    last = fields.get("last", "1")
+    if not last.isdecimal() or int(last) < 1:
+        return None, "last must be a number of games, like last:1"
+
+    format = fields.get("format")
+    if format is not None and format not in FORMATS:
+        return None, f"format must be one of {', '.join(FORMATS)}, like format:png"
+
+    ply = fields.get("ply")
+    if ply is not None:
+        if not ply.isdecimal():
+            return None, "ply must be a number of half moves, like ply:20"
+        if format not in (None, "png"):
+            return None, f"ply picks the position of a png, it can't be used with format:{format}"
+        # A single position is all a png can show, and all it needs to render
+        format = "png"
+
+    return (
+        RenderRequest(
+            search_type=search_type,
+            id_or_username=fields[search_type],
+            time=time,
+            disable=tuple(feature for feature in fields.get("disable", "").split(",") if feature),
+            light=fields.get("light"),
+            dark=fields.get("dark"),
+            last=int(last),
+            format=format,
+            ply=int(ply) if ply is not None else None,
+        ),
+        None,
+    )
+
+
+def is_rgb(value: str) -> bool:
+    channels = value.split(",")
+    return len(channels) == 3 and all(channel.isdecimal() and int(channel) <= 255 for channel in channels)
+
+
+def split_batch(request: RenderRequest) -> tuple[list[RenderRequest], Optional[str]]:
+    """Split a request for several games, like id:a,b,c or player:hikaru last:5, into one request per game"""
+    ids_or_usernames = [value for value in request.id_or_username.split(",") if value != ""]
+
+    if request.last != 1 and request.search_type != "player":
+        return [], '"last" is the number of a player\'s latest games to GIF, like player:hikaru last:5'
+
+    if len(ids_or_usernames) == 0:
+        return [], f'Missing a value for "{request.search_type}"'
+
+    if len(ids_or_usernames) * request.last > MAX_BATCH_SIZE:
+        return [], f"I can only GIF up to {MAX_BATCH_SIZE} games at once"
+
+    batch = [
+        request._replace(id_or_username=value, last=1, game=game)
+        for value in ids_or_usernames
+        for game in range(1, request.last + 1)
+    ]
+    return batch, None
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict, deque
+import logging
+import os
+import time
+from typing import Hashable, Optional
+
+DEFAULT_MAX_QUEUE_SIZE = 50
+
+
+class SchedulerBusyError(Exception):
+    """Raised when the render queue is full and new work is rejected"""
+
+
+class RenderTicket:
+    """A place in the render queue, use it as an async context manager to hold a render slot"""
+
+    def __init__(self, scheduler: RenderScheduler, guild_id: Hashable, user_id: Hashable, queued: bool):
+        self.scheduler = scheduler
+        self.guild_id = guild_id
+        self.user_id = user_id
+        # Whether the ticket had to wait in the queue instead of starting right away
+        self.queued = queued
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        # Whether the ticket was used to wait for a slot, only then it's released on exit
+        self.entered = False
+        self.released = False
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def wait_time(self) -> float:
+        """Seconds spent waiting for a render slot"""
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+    async def __aenter__(self) -> RenderTicket:
+        self.entered = True
+        try:
+            await self.granted
+        except asyncio.CancelledError:
+            self.scheduler.cancel(self)
+            raise
+        self.started_at = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def release(self):
+        """Free the ticket's render slot, once"""
+        if not self.released:
+            self.released = True
+            self.scheduler.release()
+
+
+class RenderScheduler:
+    """Limit the number of concurrent renders and share the slots fairly
+
+    Queued work is dispatched round-robin across guilds and, within each guild, round-robin
+    across users, so a single busy guild or user cannot starve everyone else.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE):
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self.max_queue_size = max_queue_size
+        self.running = 0
+        self.queue_depth = 0
+        self._guilds: OrderedDict[Hashable, OrderedDict[Hashable, deque[RenderTicket]]] = OrderedDict()
+
+    def enqueue(self, guild_id: Hashable, user_id: Hashable) -> RenderTicket:
+        """Reserve a place in the queue, raising SchedulerBusyError if it is full"""
+        if self.running < self.max_concurrency and self.queue_depth == 0:
+            ticket = RenderTicket(self, guild_id, user_id, queued=False)
+            self.running += 1
+            ticket.granted.set_result(None)
+            return ticket
+
+        if self.queue_depth >= self.max_queue_size:
+            raise SchedulerBusyError(f"Render queue is full ({self.queue_depth} waiting)")
+
+        self.queue_depth += 1
+        ticket = RenderTicket(self, guild_id, user_id, queued=True)
+        users = self._guilds.setdefault(guild_id, OrderedDict())
+        users.setdefault(user_id, deque()).append(ticket)
+        logging.debug("Queued render for guild %s user %s, %s waiting", guild_id, user_id, self.queue_depth)
+        return ticket
+
+    def release(self):
+        """Free a render slot and hand it over to the next ticket in line"""
+        self.running -= 1
+        self._dispatch()
+
+    def cancel(self, ticket: RenderTicket):
+        """Remove a ticket that stopped waiting, or give back its slot if it was already granted"""
+        if ticket.granted.done() and not ticket.granted.cancelled():
+            ticket.release()
+            return
+
+        users = self._guilds.get(ticket.guild_id)
+        if users is None or ticket.user_id not in users:
+            return
+        tickets = users[ticket.user_id]
+        try:
+            tickets.remove(ticket)
+        except ValueError:
+            return
+        # Anything still waiting on the ticket stops waiting
+        ticket.granted.cancel()
+        self.queue_depth -= 1
+        if not tickets:
+            del users[ticket.user_id]
+        if not users:
+            del self._guilds[ticket.guild_id]
+
+    def ahead(self, ticket: RenderTicket) -> int:
+        """Count the queued tickets that will get a slot before ticket, as the queue is now
+
+        Tickets queued later by other guilds or users can get ahead, so this is only good until the
+        queue changes.
+        """
+        guilds = deque(deque(deque(tickets) for tickets in users.values()) for users in self._guilds.values())
+        ahead = 0
+        # Walk the queue in the order _dispatch hands out slots
+        while guilds:
+            users = guilds.popleft()
+            tickets = users.popleft()
+            if tickets.popleft() is ticket:
+                return ahead
+            ahead += 1
+            if tickets:
+                users.append(tickets)
+            if users:
+                guilds.append(users)
+        return 0
+
+    def _dispatch(self):
+        while self.running < self.max_concurrency and self._guilds:
+            ticket = self._next_ticket()
+            self.queue_depth -= 1
+            if ticket.granted.done():
+                # Cancelled while waiting
+                continue
+            self.running += 1
+            ticket.granted.set_result(None)
+
+    def _next_ticket(self) -> RenderTicket:
+        guild_id, users = self._guilds.popitem(last=False)
+        user_id, tickets = users.popitem(last=False)
+        ticket = tickets.popleft()
+
+        if tickets:
+            users[user_id] = tickets
+        if users:
+            self._guilds[guild_id] = users
+
+        return ticket
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, Optional
+
+
+class _Call:
+    def __init__(self, task: asyncio.Future, cleanup: Optional[Callable[[Any], None]]):
+        self.task = task
+        self.cleanup = cleanup
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single in-flight job
+
+    The first caller for a key starts the job, every other caller arriving while it runs waits
+    for the same result. The result stays valid until the last caller is done with it, at which
+    point cleanup is called with it, so shared resources (like a rendered file) outlive every user.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, _Call] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    @asynccontextmanager
+    async def join(
+        self,
+        key: Hashable,
+        func: Callable[[], Awaitable[Any]],
+        cleanup: Optional[Callable[[Any], None]] = None,
+    ) -> AsyncIterator[Any]:
+        """Run func, or wait for the in-flight call for key, and hold on to its result"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(func()), cleanup)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            logging.debug("Joining in-flight call: %s", key)
+
+        call.waiters += 1
+        try:
+            # Shielded, as one caller giving up must not cancel the job for everyone else
+            yield await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0:
+                self._release(key, call)
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _release(self, key: Hashable, call: _Call):
+        if not call.task.done():
+            # Nobody is waiting for the result anymore
+            call.task.cancel()
+            self._forget(key, call)
+            return
+
+        if call.cleanup is not None and not call.task.cancelled() and call.task.exception() is None:
+            call.cleanup(call.task.result())
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import io
+import logging
+from pathlib import Path
+import tempfile
+from typing import BinaryIO, Optional, Union
+import uuid
+
+import discord
+
+DEFAULT_SPOOL_DIR = Path(tempfile.gettempdir()) / "chess-bot"
+DEFAULT_SPOOL_THRESHOLD = 8 * 1024 * 1024
+SPOOL_FILE_PREFIX = "render-"
+
+
+class RenderedGIF:
+    """A GIF streamed out of c2g, kept in memory unless it grows past the spool threshold"""
+
+    def __init__(self, name: str, spool_dir: Path, threshold: int = DEFAULT_SPOOL_THRESHOLD):
+        self.name = name
+        self.spool_dir = spool_dir
+        self.threshold = threshold
+        self.size = 0
+        self.path: Optional[Path] = None
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._file: Optional[BinaryIO] = None
+
+    @property
+    def spilled(self) -> bool:
+        """Whether the GIF was written to the spool directory instead of kept in memory"""
+        return self.path is not None
+
+    def write(self, chunk: bytes):
+        if self._buffer is not None and self.size + len(chunk) > self.threshold:
+            self._spill()
+
+        if self._file is not None:
+            self._file.write(chunk)
+        elif self._buffer is not None:
+            self._buffer.write(chunk)
+        self.size += len(chunk)
+
+    def _spill(self):
+        self.path = self.spool_dir / f"{SPOOL_FILE_PREFIX}{self.name}"
+        logging.debug("Spilling %s to %s", self.name, self.path)
+        self._file = open(self.path, "wb")
+        self._file.write(self._buffer.getbuffer())
+        self._buffer = None
+
+    def finish(self):
+        """Flush the GIF once c2g is done writing it"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def open(self) -> BinaryIO:
+        """Return a new reader over the GIF, every reader can be consumed independently"""
+        if self.path is not None:
+            return open(self.path, "rb")
+        assert self._buffer is not None
+        return io.BytesIO(self._buffer.getvalue())
+
+    def to_file(self) -> discord.File:
+        if self.path is not None:
+            # Passing the path lets discord.File close the file it opens
+            return discord.File(str(self.path), filename=self.name)
+        return discord.File(self.open(), filename=self.name)
+
+    def unlink(self):
+        self.finish()
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+        self._buffer = None
+
+    def reset(self):
+        """Discard everything written so far, to write the GIF again from the start"""
+        self.unlink()
+        self.path = None
+        self.size = 0
+        self._buffer = io.BytesIO()
+
+
+class GIFSpool:
+    """Creates in-memory GIF buffers that spill to a spool directory (ideally a tmpfs) when large"""
+
+    def __init__(self, directory: Path = DEFAULT_SPOOL_DIR, threshold: int = DEFAULT_SPOOL_THRESHOLD):
+        self.directory = Path(directory)
+        self.threshold = threshold
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.remove_orphans()
+
+    def remove_orphans(self):
+        """Remove GIFs spilled by a previous process that did not get to clean them up"""
+        for path in self.directory.glob(f"{SPOOL_FILE_PREFIX}*"):
+            logging.info("Removing orphaned spool file: %s", path)
+            path.unlink(missing_ok=True)
+
+    def new(self, format: str = "gif") -> RenderedGIF:
+        return RenderedGIF(f"{uuid.uuid4()}.{format}", self.directory, self.threshold)
+
+    def new_path(self, format: str = "gif") -> Path:
+        """Return a path in the spool directory for a file written directly, removed if orphaned too"""
+        return self.directory / f"{SPOOL_FILE_PREFIX}{uuid.uuid4()}.{format}"
+
+
+# Where a render is written to: a file path or an in-memory buffer
+GIFOutput = Union[Path, RenderedGIF]
+
+
+def open_gif_file(gif: GIFOutput) -> discord.File:
+    if isinstance(gif, RenderedGIF):
+        return gif.to_file()
+    return discord.File(gif)
+
+
+def gif_size(gif: GIFOutput) -> int:
+    if isinstance(gif, RenderedGIF):
+        return gif.size
+    return gif.stat().st_size
+
+
+def unlink_gif(gif: GIFOutput):
+    if isinstance(gif, RenderedGIF):
+        gif.unlink()
+    else:
+        gif.unlink(missing_ok=True)
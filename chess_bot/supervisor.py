@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from pathlib import Path
+import signal
+from typing import AbstractSet, Callable, Mapping, Optional, Sequence
+
+import aiohttp
+
+DISCORD_GATEWAY_BOT_URL = "https://discord.com/api/v8/gateway/bot"
+DEFAULT_RESTART_DELAY = 5.0
+MAX_RESTART_DELAY = 300.0
+
+
+def plan_shards(shard_count: int, processes: int) -> list[list[int]]:
+    """Split shard ids as evenly as possible between processes"""
+    processes = max(1, min(processes, shard_count))
+    return [list(range(index, shard_count, processes)) for index in range(processes)]
+
+
+def shard_directory(directory: Path, shard_ids: Sequence[int]) -> Path:
+    """The subdirectory a process running some of the shards keeps its files in, apart from its siblings"""
+    return directory / "shards-{}".format("-".join(map(str, shard_ids)))
+
+
+def shard_share(size: int, shard_ids: Sequence[int], shard_count: int) -> int:
+    """The part of a size limit for a process running some of the shards, so siblings stay within it"""
+    return size * len(shard_ids) // max(shard_count, 1)
+
+
+def parse_shard_ids(value: str) -> list[int]:
+    """Parse a comma separated list of shard ids, like 0,1,2"""
+    return [int(shard_id) for shard_id in value.split(",") if shard_id != ""]
+
+
+def strip_options(
+    args: Sequence[str], options: AbstractSet[str], flags: AbstractSet[str] = frozenset()
+) -> list[str]:
+    """Remove options (and their values) and flags from command line arguments"""
+    stripped = []
+    skip_next = False
+    for arg in args:
+        if skip_next:
+            skip_next = False
+            continue
+        name = arg.split("=", 1)[0]
+        if name in flags:
+            continue
+        if name in options:
+            skip_next = "=" not in arg
+            continue
+        stripped.append(arg)
+    return stripped
+
+
+async def fetch_recommended_shard_count(token: str) -> int:
+    """Ask Discord how many shards the bot should run with"""
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(DISCORD_GATEWAY_BOT_URL, headers=headers) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return int(data["shards"])
+
+
+class Supervisor:
+    """Run one bot process per group of shards, restarting them independently
+
+    A process that exits is restarted with exponential backoff while the others keep running, so
+    sending SIGTERM to a single child gracefully restarts just its shards. SIGHUP restarts every
+    child, one at a time. SIGTERM or SIGINT to the supervisor stops everything.
+    """
+
+    def __init__(
+        self,
+        plan: Sequence[Sequence[int]],
+        command: Callable[[int, Sequence[int]], list[str]],
+        env: Optional[Mapping[str, str]] = None,
+        restart_delay: float = DEFAULT_RESTART_DELAY,
+    ):
+        self.plan = plan
+        self.command = command
+        self.env = dict(env) if env is not None else None
+        self.restart_delay = restart_delay
+        self.processes: dict[int, asyncio.subprocess.Process] = {}
+        self.restarts: dict[int, int] = {index: 0 for index in range(len(plan))}
+        self._stopping = asyncio.Event()
+        self._requested: set[int] = set()
+        self._spawned: dict[int, asyncio.Event] = {}
+
+    async def spawn(self, index: int) -> asyncio.subprocess.Process:
+        args = self.command(index, self.plan[index])
+        process = await asyncio.create_subprocess_exec(*args, env=self.env)
+        self.processes[index] = process
+        self._spawned.setdefault(index, asyncio.Event()).set()
+        logging.info("Started shards %s in process %s", list(self.plan[index]), process.pid)
+        return process
+
+    async def watch(self, index: int):
+        """Keep the process for a group of shards running until the supervisor stops"""
+        delay = self.restart_delay
+        loop = asyncio.get_running_loop()
+
+        while not self._stopping.is_set():
+            process = await self.spawn(index)
+            started_at = loop.time()
+            returncode = await process.wait()
+            if self._stopping.is_set():
+                break
+
+            if index in self._requested:
+                self._requested.discard(index)
+                continue
+
+            if loop.time() - started_at > MAX_RESTART_DELAY:
+                # The process was healthy for a while, this is not a crash loop
+                delay = self.restart_delay
+
+            self.restarts[index] += 1
+            logging.warning(
+                "Process for shards %s exited with %s, restarting in %ss",
+                list(self.plan[index]),
+                returncode,
+                delay,
+            )
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    async def restart(self, index: int):
+        """Gracefully stop the process for a group of shards and wait for its replacement"""
+        process = self.processes.get(index)
+        if process is None:
+            return
+
+        spawned = self._spawned[index] = asyncio.Event()
+        self._requested.add(index)
+        await self.terminate(process)
+        await spawned.wait()
+
+    async def rolling_restart(self):
+        """Restart every process, one at a time, so only a group of shards is down at once"""
+        for index in range(len(self.plan)):
+            await self.restart(index)
+
+    async def terminate(self, process: asyncio.subprocess.Process, timeout: float = 30.0):
+        if process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Process %s did not stop in %ss, killing it", process.pid, timeout)
+            process.kill()
+            await process.wait()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.rolling_restart()))
+
+        watchers = [asyncio.ensure_future(self.watch(index)) for index in range(len(self.plan))]
+
+        await self._stopping.wait()
+        logging.info("Stopping all shards")
+        await asyncio.gather(*(self.terminate(process) for process in list(self.processes.values())))
+        await asyncio.gather(*watchers)
+
+
+def child_environment(token: str) -> dict[str, str]:
+    """Pass the token to children through the environment, keeping it out of process listings"""
+    return {**os.environ, "DISCORD_BOT_TOKEN": token}
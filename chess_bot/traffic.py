@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import time
+from typing import IO, Iterable, NamedTuple, Optional
+
+import discord
+from discord.ext import commands
+
+from .request import RenderRequest, parse_message
+
+# Hashes are short, collisions only merge two users or games in a replay
+ANONYMIZED_DIGEST_SIZE = 6
+
+
+class TraceEvent(NamedTuple):
+    """A request made by mentioning the bot, without anything identifying who made it or for what
+
+    at is the seconds since the trace was started. Authors, channels, servers, game ids and players
+    are hashed with a salt kept only while recording, so repeated ones still repeat in a replay.
+    """
+
+    at: float
+    author: str
+    channel: str
+    guild: Optional[str]
+    search_type: str
+    targets: tuple[str, ...]
+    options: tuple[str, ...] = ()
+
+    def to_content(self) -> str:
+        """The message content asking for the same request, without the mention"""
+        return " ".join([f"{self.search_type}:{','.join(self.targets)}", *self.options])
+
+
+def request_options(request: RenderRequest) -> list[str]:
+    """The options of a request as message tokens, other than the game searched for"""
+    options = []
+    if request.time is not None:
+        options.append(f"time:{request.time}")
+    if request.disable:
+        options.append(f"disable:{','.join(request.disable)}")
+    for name in ("light", "dark", "format"):
+        value = getattr(request, name)
+        if value is not None:
+            options.append(f"{name}:{value}")
+    if request.last != 1:
+        options.append(f"last:{request.last}")
+    if request.ply is not None:
+        options.append(f"ply:{request.ply}")
+    return options
+
+
+def anonymize(value: object, salt: bytes) -> str:
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=ANONYMIZED_DIGEST_SIZE, key=salt)
+    return digest.hexdigest()
+
+
+def read_trace(path: Path) -> list[TraceEvent]:
+    """Read a trace written by TrafficRecorder, ordered by the time requests were made"""
+    events = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if "origin" in data:
+                continue
+            data["targets"] = tuple(data["targets"])
+            data["options"] = tuple(data.get("options", ()))
+            events.append(TraceEvent(**data))
+    return sorted(events, key=lambda event: event.at)
+
+
+def write_trace(path: Path, events: Iterable[TraceEvent]):
+    with open(path, "w") as f:
+        f.writelines(format_event(event) for event in events)
+
+
+def format_event(event: TraceEvent) -> str:
+    return json.dumps(event._asdict()) + "\n"
+
+
+class TrafficRecorder(commands.Cog):
+    """Records the requests mentioning the bot, and when they were made, as an anonymized trace
+
+    Each request is written as a JSON line, for replaying the same traffic against a build in a
+    load test. Messages are only parsed, recording answers nothing and fetches nothing.
+
+    The first line of a trace is the wall clock time it was started at. Recorders appending to
+    it, after a restart or from another shard, time their requests from it too, so the trace
+    keeps a single timeline.
+    """
+
+    def __init__(self, bot, path: Path, salt: Optional[bytes] = None):
+        self.bot = bot
+        self.path = path
+        # Random for every recording, so hashes can't be matched across traces
+        self.salt = salt if salt is not None else os.urandom(16)
+        self.origin: Optional[float] = None
+        self.recorded = 0
+        self._file: Optional[IO[str]] = None
+
+    def cog_unload(self):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        request, error = parse_message(message, self.bot.user)
+        if request is None or error is not None:
+            return
+        self.record(message, request)
+
+    def record(self, message: discord.Message, request: RenderRequest):
+        if self._file is None:
+            self.open()
+        assert self._file is not None and self.origin is not None
+        event = TraceEvent(
+            at=round(time.time() - self.origin, 3),
+            author=anonymize(message.author.id, self.salt),
+            channel=anonymize(message.channel.id, self.salt),
+            guild=anonymize(message.guild.id, self.salt) if message.guild is not None else None,
+            search_type=request.search_type,
+            targets=tuple(anonymize(target, self.salt) for target in request.id_or_username.split(",")),
+            options=tuple(request_options(request)),
+        )
+        self._file.write(format_event(event))
+        self.recorded += 1
+
+    def open(self):
+        # Line buffered, a trace is only a few lines a second and stays readable after a crash
+        self._file = open(self.path, "a+", buffering=1)
+        # Locked, so shards starting together agree on which of them starts the trace
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            self._file.seek(0)
+            first = self._file.readline()
+            if first.strip():
+                # Traces written otherwise have no origin, their requests are timed from now
+                self.origin = json.loads(first).get("origin", time.time())
+            else:
+                self.origin = time.time()
+                self._file.write(json.dumps({"origin": self.origin}) + "\n")
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        logging.info("Recording requests to %s", self.path)
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import Optional
+
+from .process import NO_LIMITS, ProcessLimits, run_process
+from .spool import GIFOutput, RenderedGIF
+
+# There is no in-process WebP or H.264 encoder, so they are transcoded from a rendered GIF, costing more
+# CPU time than the GIF alone for a smaller upload
+FFMPEG_EXECUTABLE = "ffmpeg"
+# Encoder options for every format rendered GIFs are transcoded to
+FFMPEG_FORMAT_ARGS = {
+    "webp": ["-c:v", "libwebp", "-lossless", "0", "-quality", "75", "-loop", "0", "-f", "webp"],
+    # Fragmented, so the MP4 can be written to a pipe without seeking back to its header
+    "mp4": [
+        "-c:v",
+        "libx264",
+        "-preset",
+        "veryfast",
+        "-pix_fmt",
+        "yuv420p",
+        "-movflags",
+        "frag_keyframe+empty_moov",
+        "-f",
+        "mp4",
+    ],
+}
+TRANSCODED_FORMATS = tuple(FFMPEG_FORMAT_ARGS)
+
+
+def make_ffmpeg_args(gif: Path, output: str, format: str) -> list[str]:
+    """Build the ffmpeg command line transcoding a GIF file, only printing errors"""
+    return [
+        FFMPEG_EXECUTABLE,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        str(gif),
+        *FFMPEG_FORMAT_ARGS[format],
+        output,
+    ]
+
+
+async def transcode(
+    gif: Path, output: GIFOutput, format: str, limits: ProcessLimits = NO_LIMITS
+) -> Optional[str]:
+    """Transcode a rendered GIF to webp or mp4 with ffmpeg, returning ffmpeg's error if any
+
+    Like c2g, ffmpeg streams into in-memory outputs. Raises ProcessError if it is killed or times out.
+    """
+    if isinstance(output, RenderedGIF):
+        args = make_ffmpeg_args(gif, "pipe:1", format)
+        stdout_sink = output.write
+    else:
+        args = make_ffmpeg_args(gif, str(output), format)
+        stdout_sink = None
+
+    logging.info("Transcoding %s to %s", gif.name, output.name)
+    try:
+        _, error = await run_process(args, stdout_sink=stdout_sink, limits=limits)
+    finally:
+        if isinstance(output, RenderedGIF):
+            output.finish()
+    if error != "":
+        return error
+    return None
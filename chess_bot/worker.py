@@ -0,0 +1,420 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+import asyncio
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+from pathlib import Path
+import struct
+from typing import Any, Awaitable, Callable, Optional
+
+from .logs import REQUEST_ID, Payload, correlate
+from .process import (
+    NO_LIMITS,
+    ProcessError,
+    ProcessKilledError,
+    ProcessLimits,
+    ProcessTimeoutError,
+    run_process,
+)
+from .spool import GIFOutput, RenderedGIF
+
+C2G_EXECUTABLE = "c2g"
+DEFAULT_RECONNECT_DELAY = 1.0
+# A job is handed to another worker when the one rendering it disconnects, up to this many times
+MAX_JOB_ATTEMPTS = 3
+# Seconds a render may wait for an idle worker, on top of the render timeout
+DEFAULT_QUEUE_ALLOWANCE = 60.0
+
+# Every frame is a one byte kind and the payload length, followed by the payload
+FRAME_HEADER = struct.Struct("!cI")
+JOB_FRAME = b"J"
+DATA_FRAME = b"D"
+END_FRAME = b"E"
+# Sent by the render queue when a job's requests are gone, so the worker kills c2g
+CANCEL_FRAME = b"C"
+
+ConnectionHandler = Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]]
+
+
+class ProtocolError(ConnectionError):
+    """Raised when the other end of a render queue connection sends an unexpected frame"""
+
+
+class NoRenderWorkersError(ProcessError):
+    """Raised when a render is queued while no render worker is connected"""
+
+    def __init__(self):
+        super().__init__(C2G_EXECUTABLE, "has no render worker connected")
+
+
+class Transport(ABC):
+    """Where the render queue waits for workers, and where workers connect to"""
+
+    @abstractmethod
+    async def listen(self, handler: ConnectionHandler) -> asyncio.AbstractServer:
+        """Start accepting worker connections, handling each one with handler"""
+
+    @abstractmethod
+    async def connect(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Connect to the render queue"""
+
+
+class UnixTransport(Transport):
+    """A Unix socket, for workers on the same host"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def __str__(self) -> str:
+        return f"unix:{self.path}"
+
+    async def listen(self, handler: ConnectionHandler) -> asyncio.AbstractServer:
+        # A socket left behind by a previous run would make binding fail
+        self.path.unlink(missing_ok=True)
+        return await asyncio.start_unix_server(handler, path=str(self.path))
+
+    async def connect(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        return await asyncio.open_unix_connection(str(self.path))
+
+
+class TCPTransport(Transport):
+    """A TCP socket, for workers on other hosts"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+
+    def __str__(self) -> str:
+        return f"tcp:{self.host}:{self.port}"
+
+    async def listen(self, handler: ConnectionHandler) -> asyncio.AbstractServer:
+        return await asyncio.start_server(handler, host=self.host, port=self.port)
+
+    async def connect(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        return await asyncio.open_connection(self.host, self.port)
+
+
+def parse_transport(address: str) -> Transport:
+    """Parse a render queue address, like unix:/run/chess-bot.sock or tcp:0.0.0.0:8765"""
+    scheme, _, location = address.partition(":")
+    if scheme == "unix" and location:
+        return UnixTransport(Path(location))
+    if scheme == "tcp":
+        host, _, port = location.rpartition(":")
+        return TCPTransport(host or "127.0.0.1", int(port))
+    raise ValueError(f"unknown render queue address: {address}")
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[bytes, bytes]:
+    kind, length = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    return kind, await reader.readexactly(length)
+
+
+def write_frame(writer: asyncio.StreamWriter, kind: bytes, payload: bytes = b""):
+    writer.write(FRAME_HEADER.pack(kind, len(payload)))
+    writer.write(payload)
+
+
+def write_json_frame(writer: asyncio.StreamWriter, kind: bytes, value: Any):
+    write_frame(writer, kind, json.dumps(value).encode("utf-8"))
+
+
+def loggable_c2g_args(c2g_args: list[str]) -> Payload:
+    """Wrap the arguments for c2g, given without the executable, to log them
+
+    The PGN is skipped, it is too large to log on every request.
+    """
+    return Payload(c2g_args[1:])
+
+
+@dataclass
+class RenderJob:
+    c2g_args: list[str]
+    output: GIFOutput
+    result: asyncio.Future = field(repr=False)
+    attempts: int = 0
+    # Workers log the render with the id of the request it is for
+    request_id: Optional[str] = None
+    # The connection of the worker rendering the job, while it is being rendered
+    worker: Optional[asyncio.StreamWriter] = field(default=None, repr=False)
+
+
+class RenderQueue:
+    """Hands renders out to worker processes that connect to it through a transport
+
+    Idle workers pull jobs one at a time, so capacity is added by starting more workers, on this
+    host or any other that can reach the transport. A worker crashing mid render only loses its
+    connection, the job is handed to another worker.
+    """
+
+    def __init__(
+        self,
+        transport: Transport,
+        max_attempts: int = MAX_JOB_ATTEMPTS,
+        queue_allowance: float = DEFAULT_QUEUE_ALLOWANCE,
+    ):
+        self.transport = transport
+        self.max_attempts = max_attempts
+        self.queue_allowance = queue_allowance
+        self.workers = 0
+        self._jobs: Optional[asyncio.Queue[RenderJob]] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._jobs = asyncio.Queue()
+        self._server = await self.transport.listen(self.handle_worker)
+        logging.info("Waiting for render workers on %s", self.transport)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._jobs.qsize() if self._jobs is not None else 0
+
+    async def render(
+        self, c2g_args: list[str], output: GIFOutput, timeout: Optional[float] = None
+    ) -> Optional[str]:
+        """Have a worker run c2g, writing the GIF to output. Returns c2g's error, if any
+
+        c2g_args are the arguments for c2g without the executable, and must write to stdout.
+        Raises NoRenderWorkersError if no worker is connected, and ProcessTimeoutError if the
+        render is not done within timeout plus the time allowed for waiting on a worker.
+        """
+        assert self._jobs is not None, "the render queue was not started"
+        if self.workers == 0:
+            raise NoRenderWorkersError()
+
+        job = RenderJob(
+            c2g_args, output, asyncio.get_running_loop().create_future(), request_id=REQUEST_ID.get()
+        )
+        job.result.add_done_callback(lambda _: cancel_remote(job))
+        self._jobs.put_nowait(job)
+        wait = timeout + self.queue_allowance if timeout is not None else None
+        try:
+            # Timing out cancels the job, so a worker skips it if it is still queued
+            return await asyncio.wait_for(job.result, wait)
+        except asyncio.TimeoutError:
+            raise ProcessTimeoutError(C2G_EXECUTABLE, wait or 0.0) from None
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        assert self._jobs is not None
+        self.workers += 1
+        logging.info("Render worker connected, %s connected now", self.workers)
+        job = None
+        try:
+            while True:
+                job = await self.next_job(reader, writer)
+                if job is None:
+                    logging.warning("Render worker disconnected while idle")
+                    break
+                if job.result.done():
+                    # Abandoned while queued
+                    continue
+
+                job.worker = writer
+                write_json_frame(writer, JOB_FRAME, {"args": job.c2g_args, "request_id": job.request_id})
+                await writer.drain()
+                job.attempts += 1
+                try:
+                    error = await receive_gif(reader, job)
+                except ProcessError as e:
+                    job.worker = None
+                    if not job.result.done():
+                        job.result.set_exception(e)
+                else:
+                    job.worker = None
+                    if not job.result.done():
+                        job.result.set_result(error)
+                job = None
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logging.warning("Render worker disconnected: %r", e)
+        finally:
+            self.workers -= 1
+            writer.close()
+            if job is not None:
+                job.worker = None
+            if job is not None and not job.result.done():
+                self.retry(job)
+
+    async def next_job(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> Optional[RenderJob]:
+        """Wait for a job for an idle worker, None if the worker disconnects first
+
+        Idle workers send nothing, so anything read while waiting means the connection is gone.
+        """
+        assert self._jobs is not None
+        job = asyncio.ensure_future(self._jobs.get())
+        closed = asyncio.ensure_future(reader.read(1))
+        gone = True
+        try:
+            await asyncio.wait((job, closed), return_when=asyncio.FIRST_COMPLETED)
+            gone = closed.done() or writer.is_closing()
+        finally:
+            if not job.cancel() and gone:
+                # Taken as the worker disconnected, it was never handed to it
+                self._jobs.put_nowait(job.result())
+            closed.cancel()
+            # Only one read may wait on the connection at a time
+            await asyncio.wait((closed,))
+            if not closed.cancelled() and closed.exception() is not None:
+                logging.debug("Reading from an idle render worker failed with %r", closed.exception())
+        return None if gone else job.result()
+
+    def retry(self, job: RenderJob):
+        assert self._jobs is not None
+        if job.attempts >= self.max_attempts:
+            job.result.set_result(f"render worker disconnected {job.attempts} times")
+            return
+        logging.info("Handing a render to another worker, attempt %s", job.attempts + 1)
+        self._jobs.put_nowait(job)
+
+
+def cancel_remote(job: RenderJob):
+    """Tell the worker rendering an abandoned job to kill c2g, it still ends the job as usual"""
+    if job.worker is not None and not job.worker.is_closing():
+        logging.info("Cancelling a render on its worker")
+        write_frame(job.worker, CANCEL_FRAME)
+
+
+async def receive_gif(reader: asyncio.StreamReader, job: RenderJob) -> Optional[str]:
+    """Write the GIF a worker streams back to the job's output, returning the render error
+
+    Raises the ProcessError the worker reports if c2g timed out or was killed.
+    """
+    output = job.output
+    sink: Callable[[bytes], Any]
+    if isinstance(output, RenderedGIF):
+        # Anything written by a worker that disconnected is discarded
+        output.reset()
+        file = None
+        sink = output.write
+    else:
+        file = open(output, "wb")
+        sink = file.write
+
+    try:
+        while True:
+            kind, payload = await read_frame(reader)
+            if kind == END_FRAME:
+                return end_of_render(json.loads(payload))
+            if kind != DATA_FRAME:
+                raise ProtocolError(f"expected a GIF frame, got {kind!r}")
+            if not job.result.done():
+                sink(payload)
+    finally:
+        if file is not None:
+            file.close()
+        elif isinstance(output, RenderedGIF):
+            output.finish()
+
+
+def end_of_render(end: dict[str, Any]) -> Optional[str]:
+    if "timeout" in end:
+        raise ProcessTimeoutError(C2G_EXECUTABLE, end["timeout"])
+    if "signal" in end:
+        raise ProcessKilledError(C2G_EXECUTABLE, end["signal"])
+    return end["error"]
+
+
+async def run_worker(
+    transport: Transport,
+    concurrency: Optional[int] = None,
+    reconnect_delay: float = DEFAULT_RECONNECT_DELAY,
+    limits: ProcessLimits = NO_LIMITS,
+):
+    """Render jobs from a render queue, one per connection, until cancelled"""
+    concurrency = concurrency if concurrency is not None else (os.cpu_count() or 1)
+    logging.info("Rendering up to %s games at once for %s", concurrency, transport)
+    await asyncio.gather(*(work(transport, reconnect_delay, limits) for _ in range(concurrency)))
+
+
+async def work(
+    transport: Transport, reconnect_delay: float = DEFAULT_RECONNECT_DELAY, limits: ProcessLimits = NO_LIMITS
+):
+    """Keep a connection to the render queue, rendering every job sent through it"""
+    while True:
+        try:
+            reader, writer = await transport.connect()
+        except OSError as e:
+            logging.warning("Could not connect to %s: %s", transport, e)
+            await asyncio.sleep(reconnect_delay)
+            continue
+
+        try:
+            await serve_jobs(reader, writer, limits)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logging.warning("Lost the connection to %s: %r", transport, e)
+        finally:
+            writer.close()
+        await asyncio.sleep(reconnect_delay)
+
+
+async def serve_jobs(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, limits: ProcessLimits = NO_LIMITS
+):
+    while True:
+        try:
+            kind, payload = await read_frame(reader)
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise
+            # The render queue closed the connection between jobs
+            return
+        if kind == CANCEL_FRAME:
+            # For a job that ended before the cancel arrived
+            continue
+        if kind != JOB_FRAME:
+            raise ProtocolError(f"expected a job frame, got {kind!r}")
+
+        job = json.loads(payload)
+        c2g_args = job["args"]
+        with correlate(job.get("request_id")):
+            logging.info("Rendering with %s", loggable_c2g_args(c2g_args))
+            end = await render_job(reader, writer, c2g_args, limits)
+        write_json_frame(writer, END_FRAME, end)
+        await writer.drain()
+
+
+async def render_job(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, c2g_args: list[str], limits: ProcessLimits
+) -> dict[str, Any]:
+    """Run c2g for a job, killing it if the render queue cancels the job, and return its end frame"""
+    render = asyncio.ensure_future(
+        run_process(
+            [C2G_EXECUTABLE, *c2g_args],
+            stdout_sink=lambda chunk: write_frame(writer, DATA_FRAME, chunk),
+            limits=limits,
+        )
+    )
+    # The render queue sends nothing else while a job runs
+    cancel = asyncio.ensure_future(read_frame(reader))
+    try:
+        await asyncio.wait({render, cancel}, return_when=asyncio.FIRST_COMPLETED)
+        if not render.done():
+            # run_process kills c2g when cancelled
+            render.cancel()
+            await asyncio.gather(render, return_exceptions=True)
+            kind, _ = cancel.result()
+            if kind != CANCEL_FRAME:
+                raise ProtocolError(f"expected a cancel frame, got {kind!r}")
+            logging.info("Render cancelled")
+            return {"error": "cancelled"}
+
+        try:
+            _, error = render.result()
+        except ProcessTimeoutError as e:
+            return {"error": str(e), "timeout": e.timeout}
+        except ProcessKilledError as e:
+            return {"error": str(e), "signal": e.signal_number}
+        return {"error": error or None}
+    finally:
+        render.cancel()
+        cancel.cancel()
+        await asyncio.gather(render, cancel, return_exceptions=True)
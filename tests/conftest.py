@@ -1,3 +1,5 @@
+import socket
+
 import pytest
 
 
@@ -17,3 +19,10 @@ def pytest_collection_modifyitems(config, items):
         for item in items:
             if "execs" in item.keywords:
                 item.add_marker(skip_execs)
+
+
+@pytest.fixture
+def unused_tcp_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
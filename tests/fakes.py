@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from pathlib import Path
+import sys
+
+import discord
+
+from chess_bot.budget import DEFAULT_UPLOAD_LIMIT
+
+FAKE_CGF = """
+import sys, time
+time.sleep({latency!r})
+sys.stdout.write(open({pgn_path!r}).read())
+"""
+
+# Every game fetched is the same game, linked to the id or player it was fetched for
+FAKE_GAME_CGF = """
+import sys, time
+time.sleep({latency!r})
+sys.stdout.write(open({pgn_path!r}).read().replace({link_id!r}, sys.argv[1]))
+"""
+
+FAKE_FFMPEG = """
+import shutil, sys, time
+time.sleep({latency!r})
+output = sys.argv[-1]
+with open(sys.argv[sys.argv.index("-i") + 1], "rb") as gif:
+    shutil.copyfileobj(gif, sys.stdout.buffer if output == "pipe:1" else open(output, "wb"))
+"""
+
+FAKE_C2G = """
+import sys, time
+time.sleep({latency!r})
+output = sys.argv[sys.argv.index("-o") + 1]
+with open(output, "wb") as f:
+    f.write(b"GIF89a" + b"\\0" * max({size!r} - 6, 0))
+"""
+
+BOT_USER_DATA = {
+    "username": "Chess2GIF",
+    "id": "1",
+    "discriminator": "0001",
+    "avatar": None,
+    "bot": True,
+}
+
+
+def write_executable(directory: Path, name: str, script: str) -> Path:
+    path = directory / name
+    path.write_text(f"#!{sys.executable}\n{script}")
+    path.chmod(0o755)
+    return path
+
+
+def write_fake_cgf(directory: Path, pgn: str, latency: float = 0.0) -> Path:
+    """Write a cgf stand-in that prints pgn after sleeping for latency seconds"""
+    pgn_path = directory / "fake.pgn"
+    pgn_path.write_text(pgn)
+    return write_executable(directory, "cgf", FAKE_CGF.format(latency=latency, pgn_path=str(pgn_path)))
+
+
+def write_fake_game_cgf(directory: Path, pgn: str, link_id: str, latency: float = 0.0) -> Path:
+    """Write a cgf stand-in printing pgn with link_id replaced by the id or player it is run for
+
+    Requests for different games then get different PGNs, and are cached and rendered apart.
+    """
+    pgn_path = directory / "fake.pgn"
+    pgn_path.write_text(pgn)
+    script = FAKE_GAME_CGF.format(latency=latency, pgn_path=str(pgn_path), link_id=link_id)
+    return write_executable(directory, "cgf", script)
+
+
+def write_fake_ffmpeg(directory: Path, latency: float = 0.0) -> Path:
+    """Write an ffmpeg stand-in that copies the GIF it transcodes after sleeping for latency seconds"""
+    return write_executable(directory, "ffmpeg", FAKE_FFMPEG.format(latency=latency))
+
+
+def write_fake_c2g(directory: Path, size: int = 512 * 1024, latency: float = 0.0) -> Path:
+    """Write a c2g stand-in that writes size bytes to its output after sleeping for latency seconds"""
+    return write_executable(directory, "c2g", FAKE_C2G.format(latency=latency, size=size))
+
+
+class FakeState:
+    """Just enough of discord's ConnectionState to build Message objects without a connection"""
+
+    def store_user(self, data):
+        return discord.User(state=self, data=data)
+
+
+class FakeBot:
+    """Just enough of a bot for the cogs: its user, and the servers it is in"""
+
+    def __init__(self, user=None):
+        self.user = user
+        self.guilds = {}
+
+    def get_guild(self, id):
+        return self.guilds.get(id)
+
+
+class FakeGuild:
+    def __init__(self, id, filesize_limit=DEFAULT_UPLOAD_LIMIT):
+        self.id = id
+        self.filesize_limit = filesize_limit
+
+
+class FakeAttachment:
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeSentMessage:
+    """What sending a message returns, the attachments point at a fake CDN"""
+
+    def __init__(self, files):
+        self.attachments = [FakeAttachment(f"https://cdn.example.com/{file.filename}") for file in files]
+        self.edits = []
+        self.deleted = False
+
+    async def edit(self, **kwargs):
+        self.edits.append(kwargs)
+
+    async def delete(self):
+        self.deleted = True
+
+
+class FakeChannel:
+    id = 2
+
+    def __init__(self):
+        self.sent = []
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+        files = kwargs.get("files") or ([kwargs["file"]] if "file" in kwargs else [])
+        self.messages.append(FakeSentMessage(files))
+        return self.messages[-1]
+
+
+def make_message(content: str, author_id: int = 10, channel=None) -> discord.Message:
+    """Build a real discord.Message, as the gateway would, mentioning the bot"""
+    state = FakeState()
+    data = {
+        "id": "3",
+        "attachments": [],
+        "embeds": [],
+        "edited_timestamp": None,
+        "type": 0,
+        "pinned": False,
+        "mention_everyone": False,
+        "tts": False,
+        "content": f"<@!{BOT_USER_DATA['id']}> {content}",
+        "author": {"username": "a-user", "id": str(author_id), "discriminator": "0002", "avatar": None},
+        "mentions": [BOT_USER_DATA],
+    }
+    return discord.Message(state=state, channel=channel or FakeChannel(), data=data)
+
+
+def make_bot_user() -> discord.ClientUser:
+    return discord.ClientUser(state=FakeState(), data=BOT_USER_DATA)
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from aiohttp import web
+
+from chess_bot.attachments import AttachmentIndex, url_expiry
+
+CDN_URL = "https://cdn.example.com/attachments/1/2/chess.gif"
+
+
+def test_url_expiry_reads_the_signed_expiry():
+    assert url_expiry(f"{CDN_URL}?ex=65a1b2c3&is=659f3fc3&hm=abc") == float(0x65A1B2C3)
+    assert url_expiry(CDN_URL) is None
+    assert url_expiry(f"{CDN_URL}?ex=not-hex") is None
+
+
+def test_attachment_index_forgets_expiring_urls():
+    index = AttachmentIndex(max_age=3600.0, verify_interval=3600.0)
+    index.put("fresh", CDN_URL, "pgn")
+    # Signed URLs expiring within the margin are as good as expired
+    index.put("expiring", f"{CDN_URL}?ex={int(time.time()) + 60:x}", "pgn")
+
+    assert asyncio.run(index.get("fresh")).url == CDN_URL
+    assert asyncio.run(index.get("expiring")) is None
+    assert asyncio.run(index.get("missing")) is None
+    assert "expiring" not in index
+    assert (index.hits, index.misses) == (1, 2)
+
+
+def test_attachment_index_keeps_the_most_recent_entries():
+    index = AttachmentIndex(max_entries=2)
+    for key in ("a", "b", "c"):
+        index.put(key, CDN_URL, "pgn")
+
+    assert len(index) == 2
+    assert "a" not in index
+
+
+def test_attachment_index_checks_urls_not_checked_recently(unused_tcp_port):
+    gone = set()
+    peers = set()
+
+    async def handle(request: web.Request) -> web.Response:
+        assert request.transport is not None
+        peers.add(request.transport.get_extra_info("peername"))
+        return web.Response(status=404 if request.path in gone else 200)
+
+    async def run():
+        app = web.Application()
+        app.router.add_route("HEAD", "/{name}", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", unused_tcp_port).start()
+        try:
+            index = AttachmentIndex(verify_interval=0.0)
+            index.put("kept", f"http://127.0.0.1:{unused_tcp_port}/kept.gif", "pgn")
+            index.put("deleted", f"http://127.0.0.1:{unused_tcp_port}/deleted.gif", "pgn")
+            gone.add("/deleted.gif")
+            try:
+                return await index.get("kept"), await index.get("deleted")
+            finally:
+                await index.close()
+        finally:
+            await runner.cleanup()
+
+    kept, deleted = asyncio.run(run())
+    assert kept is not None
+    assert deleted is None
+    # Both checks went through the same connection
+    assert len(peers) == 1
@@ -0,0 +1,33 @@
+from benchmarks.__main__ import compare, main
+from benchmarks.pgns import SAMPLE_PGNS, generate_pgn
+from chess_bot.pgn import Game
+
+
+def test_generate_pgn_has_the_requested_plies():
+    pgn = generate_pgn(300)
+    assert "150... Ng8" in pgn
+    assert "151." not in pgn
+    assert Game.from_pgn(pgn).get("Black") == "Hikaru"
+    assert len(SAMPLE_PGNS["long"]) > len(SAMPLE_PGNS["short"])
+
+
+def test_compare_flags_regressions():
+    baseline = {"fast": {"median": 10.0}, "slow": {"median": 10.0}}
+    results = {"fast": {"median": 9.0}, "slow": {"median": 20.0}, "new": {"median": 1.0}}
+
+    lines = compare(results, baseline, threshold=0.1)
+    assert lines == [
+        "fast: 10.0us -> 9.0us (0.90x)",
+        "slow: 10.0us -> 20.0us (2.00x) REGRESSION",
+        "new: 1.0us (new)",
+    ]
+
+
+def test_benchmarks_run_offline(tmp_path, capsys):
+    output = tmp_path / "results.json"
+    assert main(["--quick", "--gif-size", "1024", "--output", str(output)]) == 0
+    assert output.exists()
+    assert "async_create_gif[long]" in capsys.readouterr().out
+
+    # Comparing against itself with a generous threshold should never report a regression
+    assert main(["--quick", "--gif-size", "1024", "--compare", str(output), "--threshold", "100"]) == 0
@@ -1,3 +1,6 @@
+import asyncio
+import itertools
+import os
 from pathlib import Path
 import subprocess
 
@@ -5,16 +8,34 @@ import discord
 from discord.ext import commands
 import pytest
 
+from chess_bot.attachments import AttachmentIndex
 from chess_bot.bot import (
-    process_message,
+    C2G_RENDERER,
+    NATIVE_RENDERER,
+    Chess2GIF,
     concat_c2g_args,
+    async_create_gif,
+    async_get_game_pgn,
     create_gif,
     make_gif_embed,
     extract_game_headers,
     get_game_pgn,
-    is_valid_message,
-    tmp_file_path,
+    make_bot,
+    render_key,
+    request_key,
 )
+from chess_bot.budget import UPLOAD_OVERHEAD, SizeBudget
+from chess_bot.cache import GIFCache, PGNCache
+from chess_bot.metrics import STAGE_SECONDS
+from chess_bot.pgn import Game
+from chess_bot.process import ProcessLimits
+from chess_bot.ratelimit import RateLimit, RateLimiter
+from chess_bot.render import NativeRenderer
+from chess_bot.request import RenderRequest
+from chess_bot.scheduler import RenderScheduler
+from chess_bot.spool import GIFSpool
+from chess_bot.worker import RenderQueue, UnixTransport, run_worker
+from tests.fakes import FakeBot, FakeChannel, FakeGuild, write_executable
 
 
 def command_not_available(command: str) -> bool:
@@ -38,11 +59,8 @@ def test_create_gif_with_player_name(tmp_path):
     p = d / "test.gif"
     assert not p.is_file()
 
-    args = {
-        "id_or_username": "pepegasacrifice",
-        "search_type": "player",
-    }
-    _, error = create_gif(args, output=p)
+    request = RenderRequest(search_type="player", id_or_username="pepegasacrifice")
+    _, error = create_gif(request, output=p)
     assert error is None
     assert p.is_file()
 
@@ -56,11 +74,8 @@ def test_create_gif_with_game_id(tmp_path):
     p = d / "test.gif"
     assert not p.is_file()
 
-    args = {
-        "id_or_username": "11219006649",
-        "search_type": "id",
-    }
-    _, error = create_gif(args, output=p)
+    request = RenderRequest(search_type="id", id_or_username="11219006649")
+    _, error = create_gif(request, output=p)
     assert error is None
     assert p.is_file()
 
@@ -124,13 +139,15 @@ def clean_str(s: str) -> str:
 
 
 def test_concat_c2g_args_all_args():
-    args = {
-        "time": "real",
-        "disable": "player-bars,feature".split(","),
-        "light": "255,255,255",
-        "dark": "0,0,0",
-    }
-    c2g_args = concat_c2g_args(SAMPLE_PGN_1, Path("chess.gif"), args)
+    request = RenderRequest(
+        search_type="id",
+        id_or_username="11219006649",
+        time="real",
+        disable=("player-bars", "feature"),
+        light="255,255,255",
+        dark="0,0,0",
+    )
+    c2g_args = concat_c2g_args(SAMPLE_PGN_1, Path("chess.gif"), request)
     assert c2g_args == [
         "c2g",
         SAMPLE_PGN_1,
@@ -145,23 +162,22 @@ def test_concat_c2g_args_all_args():
 
 
 def test_concat_c2g_args_time_arg():
-    args = {"time": "2500", "light": "255,255,255"}
-    c2g_args = concat_c2g_args(SAMPLE_PGN_1, Path("chess.gif"), args)
+    request = RenderRequest(search_type="id", id_or_username="11219006649", time="2500", light="255,255,255")
+    c2g_args = concat_c2g_args(SAMPLE_PGN_1, Path("chess.gif"), request)
     assert c2g_args == ["c2g", SAMPLE_PGN_1, "-o", "chess.gif", "--delay=2500", "--light=255,255,255,1"]
 
 
 def test_concat_c2g_args_disable_bars():
-    args = {
-        "dark": "0,0,0",
-        "disable": "player-bars".split(","),
-    }
-    c2g_args = concat_c2g_args(SAMPLE_PGN_1, Path("chess.gif"), args)
+    request = RenderRequest(
+        search_type="id", id_or_username="11219006649", dark="0,0,0", disable=("player-bars",)
+    )
+    c2g_args = concat_c2g_args(SAMPLE_PGN_1, Path("chess.gif"), request)
     assert c2g_args == ["c2g", SAMPLE_PGN_1, "-o", "chess.gif", "--no-player-bars", "--dark=0,0,0,1"]
 
 
 def test_concat_c2g_args():
-    args = {}
-    c2g_args = concat_c2g_args(SAMPLE_PGN_1, Path("chess.gif"), args)
+    request = RenderRequest(search_type="id", id_or_username="11219006649")
+    c2g_args = concat_c2g_args(SAMPLE_PGN_1, Path("chess.gif"), request)
     assert c2g_args == ["c2g", SAMPLE_PGN_1, "-o", "chess.gif"]
 
 
@@ -202,47 +218,30 @@ def test_make_gif_embed(tmp_path):
     assert embed.image.url == "attachment://test.gif"
 
 
-class FakeMessage:
-    def __init__(self, content):
-        self.clean_content = content
-        self.author = None
-        self.mention_everyone = False
-        self.mentions = []
-
+def test_make_gif_embed_only_shows_images(tmp_path):
+    png, mp4 = tmp_path / "test.png", tmp_path / "test.mp4"
+    png.write_bytes(b"png")
+    mp4.write_bytes(b"mp4")
 
-def test_process_message_with_id():
-    message = FakeMessage("@Chess2GIF id:11219006649")
-    args = process_message(message)
-    _id, search_type = args["id_or_username"], args["search_type"]
-    assert _id == "11219006649"
-    assert search_type == "id"
+    embed, _ = make_gif_embed(SAMPLE_PGN_1, png)
+    assert embed.image.url == "attachment://test.png"
+    embed, video_file = make_gif_embed(SAMPLE_PGN_1, mp4)
+    assert embed.image.url is discord.Embed.Empty
+    assert video_file.filename == "test.mp4"
 
 
-def test_process_message_with_player_name():
-    message = FakeMessage("@Chess2GIF player:hikaru")
-    args = process_message(message)
-    player, search_type = args["id_or_username"], args["search_type"]
-    assert player == "hikaru"
-    assert search_type == "player"
+MESSAGE_IDS = itertools.count(100)
 
 
-def test_process_message_with_no_player_bars():
-    message = FakeMessage("@Chess2GIF id:11219006649 disable:player-bars")
-    args = process_message(message)
-    disable = args["disable"]
-    assert disable == ["player-bars"]
-
-
-def test_process_message_with_time():
-    message = FakeMessage("@Chess2GIF id:11219006649 time:real")
-    args = process_message(message)
-    time = args["time"]
-    assert time == "real"
-
-    message = FakeMessage("@Chess2GIF id:11219006649 time:2000")
-    args = process_message(message)
-    time = args["time"]
-    assert time == "2000"
+class FakeMessage:
+    def __init__(self, content):
+        self.id = next(MESSAGE_IDS)
+        self.content = content
+        self.author = None
+        self.mention_everyone = False
+        self.mentions = []
+        self.guild = None
+        self.channel = None
 
 
 USER_DATA = {
@@ -260,62 +259,720 @@ BOT_USER_DATA = {
     "bot": True,
     "system": False,
 }
+BOT_MENTION = f"<@!{BOT_USER_DATA['id']}>"
 
 
-def test_is_valid_message():
-    message = FakeMessage("@Chess2GIF player:hikaru")
-    user = discord.ClientUser(state={}, data=USER_DATA)
-    bot = discord.ClientUser(state={}, data=BOT_USER_DATA)
-    message.mentions = [bot]
-    message.author = user
+def test_async_get_game_pgn_with_fake_cgf(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", "import sys; print(sys.argv[1:])")
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
 
-    check, error = is_valid_message(message, bot_user=bot)
-    assert check is True
-    error is None
+    pgn, error = asyncio.run(async_get_game_pgn("hikaru", search_type="player"))
+    assert error is None
+    assert pgn == "['hikaru', '--player', '--pgn']\n"
 
 
-def test_is_not_valid_message_by_bot():
-    """If the bot wrote the message, we should ignore it"""
-    bot = discord.ClientUser(state={}, data=BOT_USER_DATA)
-    message = FakeMessage("@Chess2GIF player:hikaru")
-    message.mentions = [bot]
-    message.author = bot
+def test_async_create_gif_with_fake_execs(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'w').write(' '.join(sys.argv))"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    p = tmp_path / "test.gif"
 
-    check, error = is_valid_message(message, bot_user=bot)
-    assert check is False
-    error is None
+    request = RenderRequest(search_type="player", id_or_username="Hikaru")
+    pgn, error = asyncio.run(async_create_gif(request, output=p))
+    assert error is None
+    assert clean_str(pgn) == clean_str(SAMPLE_PGN_1)
+    assert p.read_text().endswith("--flip")
+
+
+def test_render_key_for_id_does_not_need_pgn():
+    request = RenderRequest(search_type="id", id_or_username="11219006649", disable=("a", "b"))
+    key = render_key(request)
+    assert key is not None
+    assert key == render_key(request._replace(disable=("b", "a")))
+    assert key != render_key(request._replace(time="real"))
+
+
+def test_render_key_depends_on_the_format():
+    request = RenderRequest(search_type="id", id_or_username="11219006649", upload_limit=1000)
+    assert render_key(request) == render_key(request._replace(format="gif"))
+    assert render_key(request) != render_key(request._replace(format="webp"))
+    # Positions are not animated nor limited by their size
+    png = request._replace(format="png")
+    assert render_key(png) == render_key(png._replace(time="real", upload_limit=None))
+    assert render_key(png) != render_key(png._replace(ply=10))
+
+
+def test_render_key_depends_on_the_renderer():
+    request = RenderRequest(search_type="id", id_or_username="11219006649", upload_limit=1000)
+    assert render_key(request) == render_key(request, renderer=C2G_RENDERER)
+    assert render_key(request) != render_key(request, renderer=NATIVE_RENDERER)
+    assert request_key(request) != request_key(request, renderer=NATIVE_RENDERER)
+    # Positions are always rendered natively
+    png = request._replace(format="png")
+    assert render_key(png) == render_key(png, renderer=NATIVE_RENDERER)
+
+
+def test_render_key_for_player_needs_pgn():
+    request = RenderRequest(search_type="player", id_or_username="Hikaru")
+    assert render_key(request) is None
+    assert render_key(request, SAMPLE_PGN_1) != render_key(request, SAMPLE_PGN_2)
+    # Hikaru is black in SAMPLE_PGN_1, so the board is flipped for them but not for liczner
+    liczner = request._replace(id_or_username="liczner")
+    assert render_key(request, SAMPLE_PGN_1) != render_key(liczner, SAMPLE_PGN_1)
+
+
+def test_render_skips_c2g_on_gif_cache_hit(tmp_path, monkeypatch):
+    c2g = write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'w').write('gif')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    cog = Chess2GIF(bot=None, gif_cache=GIFCache(tmp_path / "cache"))
+    request = RenderRequest(search_type="player", id_or_username="pepegasacrifice")
+    game = Game.from_pgn(SAMPLE_PGN_2)
+
+    pgn, gif_path, error = asyncio.run(cog.render(request, tmp_path / "first.gif", game))
+    assert error is None
+    assert gif_path == tmp_path / "first.gif"
 
+    c2g.unlink()
+    pgn, gif_path, error = asyncio.run(cog.render(request, tmp_path / "second.gif", game))
+    assert error is None
+    assert gif_path.parent == tmp_path / "cache"
+    assert gif_path.read_text() == "gif"
+    assert not (tmp_path / "second.gif").exists()
+
+
+def test_async_get_game_pgn_uses_cache(tmp_path, monkeypatch):
+    cgf = write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    cache = PGNCache()
+
+    first, error = asyncio.run(async_get_game_pgn("11219006649", search_type="id", cache=cache))
+    assert error is None
+
+    cgf.unlink()
+    second, error = asyncio.run(async_get_game_pgn("11219006649", search_type="id", cache=cache))
+    assert error is None
+    assert first == second
+    assert (cache.hits, cache.misses) == (1, 1)
 
-def test_is_not_valid_message_has_help():
-    message = FakeMessage("@Chess2GIF help")
-    user = discord.ClientUser(state={}, data=USER_DATA)
-    bot = discord.ClientUser(state={}, data=BOT_USER_DATA)
-    message.mentions = [bot]
-    message.author = user
 
-    check, error = is_valid_message(message, bot_user=bot)
-    assert check is False
-    error is not None
+def test_request_key_ignores_option_order():
+    request = RenderRequest(search_type="player", id_or_username="hikaru", disable=("a", "b"), time="real")
+    assert request_key(request) == request_key(request._replace(disable=("b", "a")))
+    assert request_key(request) != request_key(request._replace(id_or_username="Hikaru"))
+    assert request_key(request) != request_key(request._replace(search_type="id"))
 
 
-def test_is_not_valid_message_malformed_message():
-    message = FakeMessage("@Chess2GIF malformed message")
-    user = discord.ClientUser(state={}, data=USER_DATA)
+def make_mention(content: str, channel: FakeChannel, author_id: str = "0"):
+    user = discord.ClientUser(state={}, data={**USER_DATA, "id": author_id})
     bot = discord.ClientUser(state={}, data=BOT_USER_DATA)
+    message = FakeMessage(content)
     message.mentions = [bot]
     message.author = user
+    message.channel = channel
+    return bot, message
+
 
-    check, error = is_valid_message(message, bot_user=bot)
-    assert check is False
-    error is not None
+def test_on_message_coalesces_identical_requests(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"import time; time.sleep(0.1); print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path,
+        "c2g",
+        f"import sys; open({str(tmp_path / 'c2g.log')!r}, 'a').write('run\\n');"
+        "open(sys.argv[sys.argv.index('-o') + 1], 'w').write('gif')",
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    monkeypatch.chdir(tmp_path)
+    channel = FakeChannel()
+
+    async def run():
+        messages = [make_mention(f"{BOT_MENTION} id:11219006649", channel, str(10 + i)) for i in range(3)]
+        cog = Chess2GIF(bot=FakeBot(messages[0][0]))
+        await asyncio.gather(*(cog.on_message(message) for _, message in messages))
+        return cog
+
+    cog = asyncio.run(run())
+    assert (tmp_path / "c2g.log").read_text() == "run\n"
+    assert len(channel.sent) == 3
+    assert all("file" in kwargs for _, kwargs in channel.sent)
+    assert len(cog.renders) == 0
+    assert list(tmp_path.glob("*.gif")) == []
+
+
+STAGES = ["validation", "fetch", "render", "embed", "upload"]
+
+
+def test_on_message_renders_in_memory_with_spool(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    monkeypatch.chdir(tmp_path)
+    spool_dir = tmp_path / "spool"
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:11219006649", channel, "10")
+
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(spool_dir))
+    stage_counts = {stage: STAGE_SECONDS.count(stage) for stage in STAGES}
+    asyncio.run(cog.on_message(message))
+    assert all(STAGE_SECONDS.count(stage) == stage_counts[stage] + 1 for stage in STAGES)
+
+    _, kwargs = channel.sent[0]
+    assert kwargs["file"].fp.read() == b"GIF89a"
+    assert kwargs["embed"].image.url == f"attachment://{kwargs['file'].filename}"
+    assert list(tmp_path.glob("*.gif")) == []
+    assert list(spool_dir.iterdir()) == []
+
+
+def test_on_message_renders_with_remote_worker(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    transport = UnixTransport(tmp_path / "queue.sock")
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:11219006649", channel, "10")
+
+    async def run():
+        render_queue = RenderQueue(transport)
+        await render_queue.start()
+        worker = asyncio.ensure_future(run_worker(transport, concurrency=1))
+        while render_queue.workers == 0:
+            await asyncio.sleep(0.01)
+        cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"), render_queue=render_queue)
+        try:
+            await cog.on_message(message)
+        finally:
+            worker.cancel()
+            await render_queue.close()
+
+    asyncio.run(run())
+    _, kwargs = channel.sent[0]
+    assert kwargs["file"].fp.read() == b"GIF89a"
+
+
+def test_on_message_batch_sends_one_message(tmp_path, monkeypatch):
+    pgns = {"1": SAMPLE_PGN_1, "2": SAMPLE_PGN_2}
+    write_executable(
+        tmp_path,
+        "cgf",
+        f"import sys; pgns = {pgns!r}\n"
+        "sys.stdout.write(pgns[sys.argv[1]]) if sys.argv[1] in pgns else sys.stderr.write('not found')",
+    )
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:1,2,3", channel, "10")
+
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"))
+    asyncio.run(cog.on_message(message))
+
+    assert len(channel.sent) == 1
+    content, kwargs = channel.sent[0]
+    assert content.splitlines() == [
+        "1. liczner (2836) ♔ vs Hikaru (3205) ♚",
+        "2. SXSH-2021 (1286) ♔ vs pepegasacrifice (1402) ♚",
+        "3. I could not find 3",
+    ]
+    assert len(kwargs["files"]) == 2
+    assert cog.scheduler.running == 0
 
 
-def test_tmp_file_path():
-    a_file = "file.gif"
-    assert not Path(a_file).exists()
-    with tmp_file_path(a_file) as p:
-        assert Path(a_file) == p
-        assert not p.exists()
-        p.write_text("some text")
-        assert p.exists()
-    assert not Path(a_file).exists()
+def test_on_message_batch_fetches_concurrently_and_renders_duplicates_once(tmp_path, monkeypatch):
+    write_executable(
+        tmp_path,
+        "c2g",
+        f"import sys; open({str(tmp_path / 'c2g.log')!r}, 'a').write('render\\n')\n"
+        "open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')",
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:1,2,1", channel, "10")
+    # One slot per distinct game, and nothing may queue
+    scheduler = RenderScheduler(max_concurrency=2, max_queue_size=0)
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"), scheduler=scheduler)
+    fetching, fetched = [], []
+
+    async def fetch_game(request):
+        fetching.append(request.id_or_username)
+        await asyncio.sleep(0.1)
+        fetched.append(len(fetching))
+        return Game.from_pgn(SAMPLE_PGN_1), None
+
+    monkeypatch.setattr(cog, "fetch_game", fetch_game)
+    asyncio.run(cog.on_message(message))
+
+    assert fetching == ["1", "2"]
+    # Both fetches had started before either one finished
+    assert fetched == [2, 2]
+    (content, kwargs), = channel.sent
+    assert len(content.splitlines()) == 3
+    assert len(kwargs["files"]) == 3
+    assert (tmp_path / "c2g.log").read_text().split() == ["render", "render"]
+    assert cog.scheduler.running == 0
+
+
+# Writes GIFs with a size proportional to the number of pixels in the board, logging each board size
+SIZED_C2G = """
+import sys
+size = next((int(arg[7:]) for arg in sys.argv if arg.startswith("--size=")), 640)
+open({log!r}, "a").write(f"{{size}}\\n")
+open(sys.argv[sys.argv.index("-o") + 1], "wb").write(b"G" * (size * size // 10))
+"""
+
+
+def test_on_message_renders_natively_without_c2g(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_2!r})")
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:11219006649 dark:0,0,0", channel, "10")
+
+    renderer = NativeRenderer(processes=1)
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"), renderer=renderer)
+    asyncio.run(cog.on_message(message))
+    cog.cog_unload()
+
+    _, kwargs = channel.sent[0]
+    assert kwargs["file"].fp.read().startswith(b"GIF89a")
+
+
+def test_on_message_renders_a_position_as_png_without_c2g(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_2!r})")
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:11219006649 ply:4", channel, "10")
+
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"))
+    asyncio.run(cog.on_message(message))
+    cog.cog_unload()
+
+    _, kwargs = channel.sent[0]
+    assert kwargs["file"].filename.endswith(".png")
+    assert kwargs["file"].fp.read().startswith(b"\x89PNG")
+    assert kwargs["embed"].image.url == f"attachment://{kwargs['file'].filename}"
+
+
+def test_on_message_transcodes_gifs_to_mp4_with_ffmpeg(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    write_executable(
+        tmp_path,
+        "ffmpeg",
+        "import sys; gif = open(sys.argv[sys.argv.index('-i') + 1], 'rb').read(); "
+        "sys.stdout.buffer.write(gif + b' as mp4')",
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    messages = [make_mention(f"{BOT_MENTION} id:11219006649", channel, str(10 + i)) for i in range(2)]
+
+    cog = Chess2GIF(
+        bot=FakeBot(messages[0][0]),
+        spool=GIFSpool(tmp_path / "spool"),
+        attachment_index=AttachmentIndex(verify_interval=3600.0),
+        default_format="mp4",
+    )
+
+    async def run():
+        for _, message in messages:
+            await cog.on_message(message)
+
+    asyncio.run(run())
+    (_, uploaded), (linked, _) = channel.sent
+    assert uploaded["file"].filename.endswith(".mp4")
+    assert uploaded["file"].fp.read() == b"GIF89a as mp4"
+    # Videos are not shown in embeds, the link to one already uploaded is played by Discord
+    assert uploaded["embed"].image.url is discord.Embed.Empty
+    assert linked == f"https://cdn.example.com/{uploaded['file'].filename}"
+    assert list((tmp_path / "spool").iterdir()) == []
+
+
+def test_render_shrinks_the_board_until_the_gif_fits(tmp_path, monkeypatch):
+    write_executable(tmp_path, "c2g", SIZED_C2G.format(log=str(tmp_path / "c2g.log")))
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    # A model predicting tiny GIFs, the first render at 640 pixels is 40960 bytes
+    budget = SizeBudget(base_bytes_per_pixel=0.0, bytes_per_ply_pixel=0.0)
+    cog = Chess2GIF(bot=None, spool=GIFSpool(tmp_path / "spool"), size_budget=budget)
+    request = RenderRequest(search_type="id", id_or_username="1", upload_limit=UPLOAD_OVERHEAD + 20000)
+
+    game, gif, error = asyncio.run(cog.render(request, cog.spool.new(), Game.from_pgn(SAMPLE_PGN_1)))
+    assert error is None
+    assert (tmp_path / "c2g.log").read_text().split() == ["640", "400"]
+    assert gif.size == 400 * 400 // 10
+    assert budget.bytes_per_ply_pixel > 0
+
+
+def test_on_message_replies_when_the_game_is_too_long(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(tmp_path, "c2g", SIZED_C2G.format(log=str(tmp_path / "c2g.log")))
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:11219006649", channel, "10")
+    message.guild = FakeGuild(20, filesize_limit=UPLOAD_OVERHEAD + 1000)
+    budget = SizeBudget(base_bytes_per_pixel=0.0, bytes_per_ply_pixel=0.0)
+
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"), size_budget=budget)
+    asyncio.run(cog.on_message(message))
+
+    # The GIF at 640 pixels shows none of the smaller boards can fit
+    assert (tmp_path / "c2g.log").read_text().split() == ["640"]
+    content, kwargs = channel.sent[0]
+    assert "too long" in content
+    assert "file" not in kwargs
+    assert list((tmp_path / "spool").iterdir()) == []
+    assert cog.scheduler.running == 0
+
+
+def test_on_message_tells_rate_limited_users_to_slow_down_once(tmp_path, monkeypatch):
+    write_executable(
+        tmp_path, "cgf", f"open({str(tmp_path / 'cgf.log')!r}, 'a').write('run\\n'); print({SAMPLE_PGN_1!r})"
+    )
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    messages = [make_mention(f"{BOT_MENTION} id:11219006649", channel, "10") for _ in range(3)]
+    limiter = RateLimiter(user=RateLimit(1, 60.0))
+    cog = Chess2GIF(bot=FakeBot(messages[0][0]), spool=GIFSpool(tmp_path / "spool"), rate_limiter=limiter)
+
+    async def run():
+        for _, message in messages:
+            await cog.on_message(message)
+
+    asyncio.run(run())
+    assert (tmp_path / "cgf.log").read_text() == "run\n"
+    assert len(channel.sent) == 2
+    assert "file" in channel.sent[0][1]
+    assert channel.sent[1][0].startswith("Slow down!")
+
+
+class FakeInteractionHTTP:
+    """Records the interaction requests sent to Discord, answering webhook messages with their attachments"""
+
+    def __init__(self):
+        self.requests = []
+
+    async def request(self, route, json=None, form=None, files=None, params=None):
+        filenames = [file.filename for file in files or []]
+        self.requests.append((route.method, route.url.rpartition("/secret")[2], json, filenames))
+        if json is not None and "type" in json:
+            return None
+        attachments = [{"filename": name, "url": f"https://cdn.example.com/{name}"} for name in filenames]
+        return {"id": "100", "attachments": attachments}
+
+
+def make_command(bot, **options):
+    bot.http = FakeInteractionHTTP()
+    data = {"name": "gif", "options": [{"name": name, "value": value} for name, value in options.items()]}
+    interaction = {"id": "1", "application_id": "2", "token": "secret", "type": 2, "channel_id": "3"}
+    return {"t": "INTERACTION_CREATE", "d": {**interaction, "user": {"id": "10"}, "data": data}}
+
+
+def test_gif_command_defers_the_response_until_the_gif_is_uploaded(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    bot = FakeBot(None)
+    payload = make_command(bot, id="11219006649", time="real")
+
+    cog = Chess2GIF(bot=bot, spool=GIFSpool(tmp_path / "spool"), mentions=False)
+    asyncio.run(cog.on_socket_response({"t": "MESSAGE_CREATE", "d": {}}))
+    asyncio.run(cog.on_socket_response(payload))
+
+    (_, _, deferred, _), (method, path, _, files) = bot.http.requests
+    assert deferred == {"type": 5}
+    assert (method, path) == ("PATCH", "/messages/@original")
+    assert len(files) == 1 and files[0].endswith(".gif")
+
+
+def test_gif_command_rejects_invalid_options_right_away():
+    bot = FakeBot(None)
+    payload = make_command(bot, time="soon")
+
+    cog = Chess2GIF(bot=bot)
+    asyncio.run(cog.on_socket_response(payload))
+
+    # Only the user who ran the command sees the error
+    ((_, _, response, _),) = bot.http.requests
+    assert response["type"] == 4
+    assert response["data"]["flags"] == 64
+    assert response["data"]["content"].startswith("Pick a game")
+
+
+def test_on_message_ignores_mentions_when_disabled():
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:11219006649", channel, "10")
+
+    cog = Chess2GIF(bot=FakeBot(bot), mentions=False)
+    asyncio.run(cog.on_message(message))
+    assert channel.sent == []
+
+
+def test_on_message_sheds_batches_when_the_queue_is_backed_up(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    bot, batch = make_mention(f"{BOT_MENTION} id:1,2", channel, "10")
+    _, single = make_mention(f"{BOT_MENTION} id:1", channel, "10")
+
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"), shed_queue_depth=0)
+    asyncio.run(cog.on_message(batch))
+    asyncio.run(cog.on_message(single))
+
+    assert "try again" in channel.sent[0][0]
+    assert "file" in channel.sent[1][1]
+
+
+def test_on_message_links_gifs_already_uploaded(tmp_path, monkeypatch):
+    write_executable(
+        tmp_path, "cgf", f"open({str(tmp_path / 'cgf.log')!r}, 'a').write('run\\n'); print({SAMPLE_PGN_1!r})"
+    )
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    messages = [make_mention(f"{BOT_MENTION} id:11219006649", channel, str(10 + i)) for i in range(2)]
+    index = AttachmentIndex(verify_interval=3600.0)
+    cog = Chess2GIF(bot=FakeBot(messages[0][0]), spool=GIFSpool(tmp_path / "spool"), attachment_index=index)
+
+    async def run():
+        for _, message in messages:
+            await cog.on_message(message)
+
+    asyncio.run(run())
+    # Games requested by id are linked without being fetched again
+    assert (tmp_path / "cgf.log").read_text() == "run\n"
+    (_, uploaded), (_, linked) = channel.sent
+    assert "file" in uploaded
+    assert "file" not in linked
+    assert linked["embed"].image.url.startswith("https://cdn.example.com/")
+    assert linked["embed"].title == uploaded["embed"].title
+
+
+def test_on_message_links_players_games_without_queueing(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    messages = [make_mention(f"{BOT_MENTION} player:Hikaru", channel, str(10 + i)) for i in range(2)]
+    cog = Chess2GIF(
+        bot=FakeBot(messages[0][0]),
+        scheduler=RenderScheduler(max_concurrency=1, max_queue_size=0),
+        spool=GIFSpool(tmp_path / "spool"),
+        attachment_index=AttachmentIndex(verify_interval=3600.0),
+    )
+
+    async def run():
+        await cog.on_message(messages[0][1])
+        # Every render slot is taken, and nothing may queue
+        async with cog.scheduler.enqueue(1, 1):
+            await cog.on_message(messages[1][1])
+
+    asyncio.run(run())
+    (_, uploaded), (_, linked) = channel.sent
+    assert "file" in uploaded
+    assert linked["embed"].image.url.startswith("https://cdn.example.com/")
+
+
+def test_on_message_fetches_without_holding_a_render_slot(tmp_path, monkeypatch):
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    single = make_mention(f"{BOT_MENTION} id:1", channel, "10")
+    batch = make_mention(f"{BOT_MENTION} id:2,3", channel, "10")
+    cog = Chess2GIF(bot=FakeBot(single[0]), spool=GIFSpool(tmp_path / "spool"))
+    running = []
+
+    async def fetch_game(request):
+        running.append(cog.scheduler.running)
+        return Game.from_pgn(SAMPLE_PGN_1), None
+
+    monkeypatch.setattr(cog, "fetch_game", fetch_game)
+    for _, message in (single, batch):
+        asyncio.run(cog.on_message(message))
+
+    assert running == [0, 0, 0]
+    assert cog.scheduler.running == 0
+
+
+def test_on_message_replies_when_the_render_times_out(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(tmp_path, "c2g", "import time; time.sleep(30)")
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:11219006649", channel, "10")
+
+    limits = ProcessLimits(timeout=0.2)
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"), render_limits=limits)
+    asyncio.run(cog.on_message(message))
+
+    assert channel.sent == [("Your game took too long to render, please try again later", {})]
+    assert cog.scheduler.running == 0
+
+
+def test_on_message_delete_kills_the_render(tmp_path, monkeypatch):
+    pid_path = tmp_path / "c2g.pid"
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path,
+        "c2g",
+        f"import os, time; open({str(pid_path)!r}, 'w').write(str(os.getpid())); time.sleep(30)",
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:11219006649", channel, "10")
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"))
+
+    async def run():
+        task = asyncio.ensure_future(cog.on_message(message))
+        while not pid_path.exists() or not pid_path.read_text():
+            await asyncio.sleep(0.01)
+        await cog.on_message_delete(message)
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The render is cancelled once its last waiter is gone
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_path.read_text()), 0)
+    assert channel.sent == []
+    assert cog.in_flight == {}
+    assert len(cog.renders) == 0
+    assert cog.scheduler.running == 0
+    assert list((tmp_path / "spool").iterdir()) == []
+
+
+def test_on_message_delete_kills_the_render_on_a_worker(tmp_path, monkeypatch):
+    pid_path = tmp_path / "c2g.pid"
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path,
+        "c2g",
+        f"import os, time; open({str(pid_path)!r}, 'w').write(str(os.getpid())); time.sleep(30)",
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:11219006649", channel, "10")
+    transport = UnixTransport(tmp_path / "queue.sock")
+    render_queue = RenderQueue(transport)
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"), render_queue=render_queue)
+
+    async def run():
+        await render_queue.start()
+        worker = asyncio.ensure_future(run_worker(transport, concurrency=1))
+        while render_queue.workers == 0:
+            await asyncio.sleep(0.01)
+        task = asyncio.ensure_future(cog.on_message(message))
+        while not pid_path.exists() or not pid_path.read_text():
+            await asyncio.sleep(0.01)
+        await cog.on_message_delete(message)
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The render is cancelled once its last waiter is gone, and the worker told to kill c2g
+        await asyncio.sleep(0.2)
+        try:
+            with pytest.raises(ProcessLookupError):
+                os.kill(int(pid_path.read_text()), 0)
+        finally:
+            worker.cancel()
+            await render_queue.close()
+
+    asyncio.run(run())
+    assert channel.sent == []
+    assert cog.in_flight == {}
+    assert len(cog.renders) == 0
+    assert cog.scheduler.running == 0
+    assert list((tmp_path / "spool").iterdir()) == []
+
+
+def test_on_message_posts_a_placeholder_until_the_gif_is_uploaded(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path,
+        "c2g",
+        "import sys, time; time.sleep(0.2); open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')",
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    bot, message = make_mention(f"{BOT_MENTION} id:11219006649", channel, "10")
+
+    cog = Chess2GIF(bot=FakeBot(bot), spool=GIFSpool(tmp_path / "spool"), placeholders=True)
+    asyncio.run(cog.on_message(message))
+
+    (_, posted), (_, uploaded) = channel.sent
+    # Posted as soon as the game was fetched, then deleted once the GIF was posted
+    assert posted["embed"].title == "liczner (2836) ♔ vs Hikaru (3205) ♚"
+    assert posted["embed"].description == "Rendering the GIF..."
+    assert "file" in uploaded
+    assert channel.messages[0].deleted is True
+
+
+def test_on_message_replaces_the_placeholder_with_a_linked_gif(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", f"print({SAMPLE_PGN_1!r})")
+    write_executable(
+        tmp_path, "c2g", "import sys; open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    channel = FakeChannel()
+    messages = [make_mention(f"{BOT_MENTION} player:Hikaru", channel, str(10 + i)) for i in range(2)]
+    cog = Chess2GIF(
+        bot=FakeBot(messages[0][0]),
+        spool=GIFSpool(tmp_path / "spool"),
+        attachment_index=AttachmentIndex(verify_interval=3600.0),
+        placeholders=True,
+    )
+
+    async def run():
+        # Both join the same render, the second links the GIF the first uploaded
+        await asyncio.gather(*(cog.on_message(message) for _, message in messages))
+
+    asyncio.run(run())
+    # The first placeholder makes way for the upload, the second one is edited into the reply
+    assert len(channel.sent) == 3
+    first, second, _ = channel.messages
+    assert first.deleted is True
+    assert second.deleted is False
+    assert second.edits[-1]["embed"].image.url.startswith("https://cdn.example.com/")
+
+
+def test_bot_registers_commands_once(monkeypatch):
+    registered = []
+
+    async def register_commands(bot):
+        registered.append(bot)
+        return True
+
+    async def change_presence(**kwargs):
+        pass
+
+    monkeypatch.setattr("chess_bot.bot.register_commands", register_commands)
+
+    async def run():
+        new_bot = make_bot()
+        new_bot.change_presence = change_presence
+        # Reconnecting makes the bot ready again
+        await new_bot.on_ready()
+        await new_bot.on_ready()
+        return new_bot
+
+    assert registered == [asyncio.run(run())]
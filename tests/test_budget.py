@@ -0,0 +1,42 @@
+from chess_bot.budget import UPLOAD_OVERHEAD, SizeBudget
+
+LIMIT = 8 * 1024 * 1024
+
+
+def test_board_size_is_the_largest_predicted_to_fit():
+    budget = SizeBudget(board_sizes=(640, 320), base_bytes_per_pixel=0.0, bytes_per_ply_pixel=0.1)
+    # 640 * 640 * 0.1 bytes per ply, about 40KiB
+    assert budget.board_size(plies=100, limit=LIMIT) == 640
+    assert budget.board_size(plies=300, limit=LIMIT) == 320
+
+
+def test_board_size_is_none_for_games_far_over_the_limit():
+    budget = SizeBudget(board_sizes=(640, 320), base_bytes_per_pixel=0.0, bytes_per_ply_pixel=0.1)
+    # Slightly over the limit at the smallest size is still worth a try
+    assert budget.board_size(plies=900, limit=LIMIT) == 320
+    assert budget.board_size(plies=2000, limit=LIMIT) is None
+
+
+def test_observe_learns_the_cost_per_ply():
+    budget = SizeBudget(base_bytes_per_pixel=0.0, bytes_per_ply_pixel=0.1, smoothing=0.5)
+    budget.observe(plies=10, board_size=100, size=30000)
+    assert budget.bytes_per_ply_pixel == 0.2
+    assert budget.predict(plies=10, board_size=100) == 20000
+
+    budget.observe(plies=0, board_size=100, size=30000)
+    assert budget.bytes_per_ply_pixel == 0.2
+
+
+def test_retry_size_scales_the_actual_size():
+    budget = SizeBudget(board_sizes=(640, 512, 320))
+    # A quarter of the pixels at 320
+    assert budget.retry_size(640, size=2 * (LIMIT - UPLOAD_OVERHEAD), limit=LIMIT) == 320
+    assert budget.retry_size(640, size=int(1.5 * (LIMIT - UPLOAD_OVERHEAD)), limit=LIMIT) == 512
+    assert budget.retry_size(640, size=5 * LIMIT, limit=LIMIT) is None
+    assert budget.retry_size(320, size=LIMIT, limit=LIMIT) is None
+
+
+def test_fits_leaves_room_for_the_message():
+    budget = SizeBudget()
+    assert budget.fits(LIMIT - UPLOAD_OVERHEAD, LIMIT)
+    assert not budget.fits(LIMIT, LIMIT)
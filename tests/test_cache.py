@@ -0,0 +1,191 @@
+import os
+import time
+
+from chess_bot.cache import GIFCache, PGNCache, make_cache_key
+from chess_bot.metrics import PGN_CACHE_LOOKUPS
+
+
+def write_gif(directory, name, size):
+    path = directory / name
+    path.write_bytes(b"G" * size)
+    return path
+
+
+def test_make_cache_key_depends_on_all_parts():
+    key = make_cache_key("id:1", ["--delay=real"], flip=False)
+    assert key == make_cache_key("id:1", ["--delay=real"], flip=False)
+    assert key != make_cache_key("id:2", ["--delay=real"], flip=False)
+    assert key != make_cache_key("id:1", ["--delay=1000"], flip=False)
+    assert key != make_cache_key("id:1", ["--delay=real"], flip=True)
+
+
+def test_gif_cache_put_and_get(tmp_path):
+    cache = GIFCache(tmp_path / "cache")
+    gif = write_gif(tmp_path, "test.gif", 10)
+
+    assert cache.get("key") is None
+    cache.put("key", "1. e4 e5", gif)
+
+    cached = cache.get("key")
+    assert cached is not None
+    assert cached.pgn == "1. e4 e5"
+    assert cached.path.read_bytes() == gif.read_bytes()
+    assert cached.path.parent == tmp_path / "cache"
+
+
+def test_gif_cache_evicts_least_recently_used(tmp_path):
+    cache = GIFCache(tmp_path / "cache", max_bytes=250)
+    gif = write_gif(tmp_path, "test.gif", 100)
+
+    cache.put("a", "", gif)
+    cache.put("b", "", gif)
+    cache.get("a")
+    cache.put("c", "", gif)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.total_bytes == 200
+    assert not (tmp_path / "cache" / "b.gif").exists()
+
+
+def test_gif_cache_survives_restarts(tmp_path):
+    gif = write_gif(tmp_path, "test.gif", 100)
+    cache = GIFCache(tmp_path / "cache", max_bytes=250)
+    cache.put("a", "pgn a", gif)
+    cache.put("b", "pgn b", gif)
+    # Make "a" the oldest entry regardless of file system timestamp resolution
+    os.utime(tmp_path / "cache" / "a.gif", (0, 0))
+
+    restarted = GIFCache(tmp_path / "cache", max_bytes=250)
+    assert len(restarted) == 2
+    assert restarted.total_bytes == cache.total_bytes
+    assert restarted.get("b").pgn == "pgn b"
+
+    restarted.put("c", "pgn c", gif)
+    assert "a" not in restarted
+    assert "b" in restarted
+
+
+def test_gif_cache_keeps_the_format_of_entries(tmp_path):
+    cache = GIFCache(tmp_path / "cache")
+    cache.put("a", "pgn a", write_gif(tmp_path, "test.png", 10))
+    assert cache.get("a").path == tmp_path / "cache" / "a.png"
+
+    restarted = GIFCache(tmp_path / "cache")
+    assert restarted.get("a").path == tmp_path / "cache" / "a.png"
+    restarted.put("a", "pgn a", write_gif(tmp_path, "test.mp4", 10))
+    assert restarted.get("a").path == tmp_path / "cache" / "a.mp4"
+    assert not (tmp_path / "cache" / "a.png").exists()
+
+
+def test_gif_cache_forgets_deleted_files(tmp_path):
+    cache = GIFCache(tmp_path / "cache")
+    gif = write_gif(tmp_path, "test.gif", 10)
+    cached = cache.put("key", "", gif)
+    cached.path.unlink()
+
+    assert cache.get("key") is None
+    assert len(cache) == 0
+    assert cache.total_bytes == 0
+
+
+def test_gif_cache_only_removes_stale_temporary_files(tmp_path):
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    stale = directory / "stale.gif.tmp"
+    stale.write_bytes(b"G")
+    os.utime(stale, (0, 0))
+    # Possibly being written by another process sharing the directory
+    recent = directory / "recent.gif.tmp"
+    recent.write_bytes(b"G")
+
+    GIFCache(directory)
+
+    assert not stale.exists()
+    assert recent.exists()
+
+
+def test_pgn_cache_hit_and_miss_counters():
+    cache = PGNCache()
+    exported = {tier: PGN_CACHE_LOOKUPS.get(tier) for tier in ("memory", "miss")}
+    assert cache.get("11219006649", "id") is None
+    cache.put("11219006649", "id", "1. e4 e5")
+    assert cache.get("11219006649", "id") == "1. e4 e5"
+    assert cache.get("11219006649", "player") is None
+
+    assert cache.hits == 1
+    assert cache.misses == 2
+    assert PGN_CACHE_LOOKUPS.get("memory") == exported["memory"] + 1
+    assert PGN_CACHE_LOOKUPS.get("miss") == exported["miss"] + 2
+
+
+def test_pgn_cache_player_entries_expire(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(time, "time", lambda: now)
+    cache = PGNCache(player_ttl=60)
+    cache.put("Hikaru", "player", "latest")
+    cache.put("11219006649", "id", "game")
+
+    now += 30
+    assert cache.get("hikaru", "player") == "latest"
+
+    now += 3600
+    assert cache.get("hikaru", "player") is None
+    assert cache.get("11219006649", "id") == "game"
+
+
+def test_pgn_cache_evicts_least_recently_used():
+    cache = PGNCache(max_entries=2)
+    cache.put("a", "id", "a")
+    cache.put("b", "id", "b")
+    cache.get("a", "id")
+    cache.put("c", "id", "c")
+
+    assert len(cache) == 2
+    assert cache.get("b", "id") is None
+    assert cache.get("a", "id") == "a"
+
+
+def test_pgn_cache_reads_through_to_disk(tmp_path):
+    cache = PGNCache(tmp_path, max_entries=1)
+    cache.put("a", "id", "a")
+    cache.put("b", "id", "b")
+
+    restarted = PGNCache(tmp_path)
+    disk_hits = PGN_CACHE_LOOKUPS.get("disk")
+    assert restarted.get("a", "id") == "a"
+    assert restarted.get("b", "id") == "b"
+    assert restarted.disk_hits == 2
+    assert PGN_CACHE_LOOKUPS.get("disk") == disk_hits + 2
+    assert len(restarted) == 2
+
+
+def test_pgn_cache_expires_player_entries_on_disk(tmp_path):
+    cache = PGNCache(tmp_path, player_ttl=60)
+    cache.put("hikaru", "player", "latest")
+    path = tmp_path / f"{PGNCache.key('hikaru', 'player')}.pgn"
+    os.utime(path, (0, 0))
+
+    restarted = PGNCache(tmp_path, player_ttl=60)
+    assert restarted.get("hikaru", "player") is None
+    assert not path.exists()
+
+
+def test_pgn_cache_evicts_least_recently_used_from_disk(tmp_path):
+    cache = PGNCache(tmp_path, max_entries=1, max_disk_bytes=250)
+    for id in ("a", "b"):
+        cache.put(id, "id", id * 100)
+    # Read from disk, so b is the least recently used on disk
+    assert cache.get("a", "id") == "a" * 100
+    cache.put("c", "id", "c" * 100)
+
+    assert cache.disk_bytes == 200
+    assert sorted(path.stem for path in tmp_path.glob("*.pgn")) == sorted(
+        PGNCache.key(id, "id") for id in ("a", "c")
+    )
+
+    # The limit is applied to what is already on disk when starting
+    restarted = PGNCache(tmp_path, max_disk_bytes=150)
+    assert restarted.disk_bytes == 100
+    assert len(list(tmp_path.glob("*.pgn"))) == 1
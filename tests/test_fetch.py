@@ -0,0 +1,249 @@
+import asyncio
+import os
+
+from aiohttp import web
+import pytest
+
+from chess_bot.bot import ONLY_LATEST_GAME_ERROR, async_get_game_pgn
+from chess_bot.fetch import PGN_CONTENT_TYPE, FetchError, GameFetcher
+from tests.fakes import write_executable
+
+LICHESS_PGN = """[Event "Rated Blitz game"]
+[Site "https://lichess.org/q7ZvsdUF"]
+[White "DrNykterstein"]
+[Black "Alireza2003"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 1-0
+"""
+
+OLDER_LICHESS_PGN = """[Event "Rated Bullet game"]
+[Site "https://lichess.org/Ab12Cd34"]
+[White "Alireza2003"]
+[Black "DrNykterstein"]
+[Result "0-1"]
+
+1. d4 Nf6 2. c4 e6 0-1
+"""
+
+OLDEST_CHESS_COM_PGN = """[Event "Live Chess"]
+[Site "Chess.com"]
+[White "Hikaru"]
+[Black "Firouzja2003"]
+[Result "1-0"]
+
+1. c4 e5 2. g3 Nf6 1-0
+"""
+
+OLDER_CHESS_COM_PGN = """[Event "Live Chess"]
+[Site "Chess.com"]
+[White "Hikaru"]
+[Black "GMWSO"]
+[Result "0-1"]
+
+1. d4 d5 2. c4 e6 0-1
+"""
+
+LATEST_CHESS_COM_PGN = """[Event "Live Chess"]
+[Site "Chess.com"]
+[White "GMWSO"]
+[Black "Hikaru"]
+[Result "1/2-1/2"]
+
+1. e4 c5 2. Nf3 d6 1/2-1/2
+"""
+
+ARCHIVES_ETAG = '"archives-v1"'
+
+
+class RecordedAPI:
+    """Stands in for the lichess and chess.com APIs, answering with recorded responses"""
+
+    def __init__(self, port: int):
+        self.url = f"http://127.0.0.1:{port}"
+        self.port = port
+        self.requests: list[str] = []
+        self.not_modified = 0
+        self.delay = 0.0
+        self.runner: web.AppRunner
+
+    async def lichess_game(self, request: web.Request) -> web.Response:
+        await self.record(request)
+        assert request.headers["Accept"] == PGN_CONTENT_TYPE
+        if request.match_info["id"] == "latin1PG":
+            return web.Response(body=LICHESS_PGN.encode("latin-1") + b"\xe9", content_type=PGN_CONTENT_TYPE)
+        if request.match_info["id"] != "q7ZvsdUF":
+            return web.Response(status=404)
+        return web.Response(text=LICHESS_PGN, content_type=PGN_CONTENT_TYPE)
+
+    async def lichess_user_games(self, request: web.Request) -> web.Response:
+        await self.record(request)
+        if request.match_info["user"] != "DrNykterstein":
+            # lichess answers unknown players with an empty export
+            return web.Response(text="", content_type=PGN_CONTENT_TYPE)
+        # Latest first, separated by blank lines
+        games = [LICHESS_PGN, OLDER_LICHESS_PGN][: int(request.query["max"])]
+        return web.Response(text="\n\n".join(games), content_type=PGN_CONTENT_TYPE)
+
+    async def chess_com_archives(self, request: web.Request) -> web.Response:
+        await self.record(request)
+        if request.match_info["user"] != "hikaru":
+            return web.json_response({"code": 0, "message": "User not found"}, status=404)
+        if request.headers.get("If-None-Match") == ARCHIVES_ETAG:
+            self.not_modified += 1
+            return web.Response(status=304)
+        archives = [f"{self.url}/pub/player/hikaru/games/2021/{month:02}" for month in (3, 4)]
+        return web.json_response({"archives": archives}, headers={"ETag": ARCHIVES_ETAG})
+
+    async def chess_com_month(self, request: web.Request) -> web.Response:
+        await self.record(request)
+        if request.match_info["month"] == "03":
+            games = [{"pgn": OLDEST_CHESS_COM_PGN, "end_time": 1617000000}]
+        else:
+            games = [
+                {"pgn": OLDER_CHESS_COM_PGN, "end_time": 1618000100},
+                {"pgn": LATEST_CHESS_COM_PGN, "end_time": 1618000200},
+            ]
+        return web.json_response({"games": games})
+
+    async def record(self, request: web.Request):
+        self.requests.append(request.path)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/game/export/{id}", self.lichess_game)
+        app.router.add_get("/api/games/user/{user}", self.lichess_user_games)
+        app.router.add_get("/pub/player/{user}/games/archives", self.chess_com_archives)
+        app.router.add_get("/pub/player/{user}/games/{year}/{month}", self.chess_com_month)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", self.port).start()
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def run_against_api(port: int, test):
+    async def run():
+        api = RecordedAPI(port)
+        await api.start()
+        fetcher = GameFetcher(lichess_url=api.url, chess_com_url=api.url)
+        try:
+            return await test(api, fetcher)
+        finally:
+            await fetcher.close()
+            await api.stop()
+
+    return asyncio.run(run())
+
+
+def test_fetcher_fetches_lichess_games_by_id(unused_tcp_port):
+    async def test(api, fetcher):
+        # Game URLs may carry the side the board is shown from
+        assert await fetcher.fetch("q7ZvsdUFwhite", "id") == (LICHESS_PGN, None)
+        assert await fetcher.fetch("missing0", "id") == (None, "Game not found")
+
+    run_against_api(unused_tcp_port, test)
+
+
+def test_fetcher_leaves_chess_com_games_by_id_to_cgf(unused_tcp_port):
+    async def test(api, fetcher):
+        with pytest.raises(FetchError):
+            await fetcher.fetch("11219006649", "id")
+        assert api.requests == []
+
+    run_against_api(unused_tcp_port, test)
+
+
+def test_fetcher_prefers_the_latest_chess_com_game(unused_tcp_port):
+    async def test(api, fetcher):
+        assert await fetcher.fetch("Hikaru", "player") == (LATEST_CHESS_COM_PGN, None)
+        assert await fetcher.fetch("DrNykterstein", "player") == (LICHESS_PGN, None)
+        assert await fetcher.fetch("nobody", "player") == (None, "No games found for nobody")
+
+    run_against_api(unused_tcp_port, test)
+
+
+def test_fetcher_quotes_usernames_in_urls(unused_tcp_port):
+    async def test(api, fetcher):
+        assert await fetcher.fetch("a/b?c", "player") == (None, "No games found for a/b?c")
+        # Each site was asked about the whole username, as one path segment
+        assert "/pub/player/a/b?c/games/archives" in api.requests
+        assert "/api/games/user/a/b?c" in api.requests
+
+    run_against_api(unused_tcp_port, test)
+
+
+def test_fetcher_raises_on_pgns_that_are_not_utf8(unused_tcp_port):
+    async def test(api, fetcher):
+        with pytest.raises(FetchError):
+            await fetcher.fetch("latin1PG", "id")
+
+    run_against_api(unused_tcp_port, test)
+
+
+def test_fetcher_fetches_older_games_of_players(unused_tcp_port):
+    async def test(api, fetcher):
+        assert await fetcher.fetch("Hikaru", "player", game=2) == (OLDER_CHESS_COM_PGN, None)
+        # Older than every game of the latest month
+        assert await fetcher.fetch("Hikaru", "player", game=3) == (OLDEST_CHESS_COM_PGN, None)
+        assert await fetcher.fetch("DrNykterstein", "player", game=2) == (OLDER_LICHESS_PGN, None)
+        fewer = await fetcher.fetch("Hikaru", "player", game=4)
+        assert fewer == (None, "Hikaru has played fewer than 4 games")
+
+    run_against_api(unused_tcp_port, test)
+
+
+def test_fetcher_revalidates_responses(unused_tcp_port):
+    async def test(api, fetcher):
+        first = await fetcher.fetch("hikaru", "player")
+        second = await fetcher.fetch("hikaru", "player")
+        assert first == second == (LATEST_CHESS_COM_PGN, None)
+        assert api.not_modified == fetcher.revalidated == 1
+
+    run_against_api(unused_tcp_port, test)
+
+
+def test_fetcher_coalesces_concurrent_lookups(unused_tcp_port):
+    async def test(api, fetcher):
+        api.delay = 0.1
+        results = await asyncio.gather(*(fetcher.fetch(name, "player") for name in ("hikaru", "Hikaru") * 5))
+        assert results == [(LATEST_CHESS_COM_PGN, None)] * 10
+        assert api.requests.count("/pub/player/hikaru/games/archives") == 1
+
+    run_against_api(unused_tcp_port, test)
+
+
+def test_fetcher_raises_when_a_site_is_unreachable(unused_tcp_port):
+    async def run():
+        fetcher = GameFetcher(lichess_url=f"http://127.0.0.1:{unused_tcp_port}", timeout=5.0)
+        try:
+            await fetcher.fetch("q7ZvsdUF", "id")
+        finally:
+            await fetcher.close()
+
+    with pytest.raises(FetchError):
+        asyncio.run(run())
+
+
+def test_async_get_game_pgn_falls_back_to_cgf(tmp_path, monkeypatch, unused_tcp_port):
+    write_executable(tmp_path, "cgf", "import sys; print(sys.argv[1:])")
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+
+    async def test(api, fetcher):
+        fetched = await async_get_game_pgn("q7ZvsdUF", "id", fetcher=fetcher)
+        fallback = await async_get_game_pgn("11219006649", "id", fetcher=fetcher)
+        return fetched, fallback
+
+    fetched, fallback = run_against_api(unused_tcp_port, test)
+    assert fetched == (LICHESS_PGN, None)
+    assert fallback == ("['11219006649', '--pgn']\n", None)
+
+
+def test_async_get_game_pgn_only_fetches_older_games_over_http(tmp_path, monkeypatch):
+    write_executable(tmp_path, "cgf", "raise SystemExit('cgf should not run')")
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+
+    assert asyncio.run(async_get_game_pgn("hikaru", "player", game=2)) == (None, ONLY_LATEST_GAME_ERROR)
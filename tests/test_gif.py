@@ -0,0 +1,73 @@
+import random
+
+from chess_bot.gif import GIFWriter, lzw_compress, sub_blocks
+
+
+def lzw_decompress(data: bytes, min_code_size: int) -> bytes:
+    """A plain GIF LZW decoder, to check the encoder against"""
+    clear_code, end_code = 1 << min_code_size, (1 << min_code_size) + 1
+    value, bits, position = 0, 0, 0
+    code_size = min_code_size + 1
+    table: list[bytes] = []
+    previous = b""
+    output = bytearray()
+    while True:
+        while bits < code_size:
+            value |= data[position] << bits
+            bits += 8
+            position += 1
+        code = value & ((1 << code_size) - 1)
+        value >>= code_size
+        bits -= code_size
+
+        if code == clear_code:
+            table = [bytes([index]) for index in range(clear_code)] + [b"", b""]
+            code_size = min_code_size + 1
+            previous = b""
+            continue
+        if code == end_code:
+            return bytes(output)
+
+        if code < len(table):
+            entry = table[code]
+            if previous:
+                table.append(previous + entry[:1])
+        else:
+            entry = previous + previous[:1]
+            table.append(entry)
+        output += entry
+        previous = entry
+        if len(table) == 1 << code_size and code_size < 12:
+            code_size += 1
+
+
+def test_lzw_round_trips():
+    random.seed(0)
+    samples = [
+        bytes([0]),
+        bytes([1, 2, 3, 0]) * 1000,
+        bytes([5]) * 100_000,
+        # Noise fills the code table several times over
+        bytes(random.randrange(8) for _ in range(50_000)),
+    ]
+    for pixels in samples:
+        assert lzw_decompress(lzw_compress(pixels, 3), 3) == pixels
+
+
+def test_sub_blocks_are_at_most_255_bytes():
+    blocks = sub_blocks(b"x" * 300)
+    assert blocks == bytes([255]) + b"x" * 255 + bytes([45]) + b"x" * 45 + b"\0"
+
+
+def test_gif_writer_writes_a_looping_gif():
+    writer = GIFWriter(2, 2, [(0, 0, 0), (255, 255, 255)])
+    writer.add_frame(bytes([0, 1, 1, 0]), 0, 0, 2, 2, delay=1000)
+    writer.add_frame(bytes([1]), 1, 1, 1, 1, delay=50, transparent=0)
+    data = writer.finish()
+
+    assert data.startswith(b"GIF89a\x02\x00\x02\x00")
+    assert b"NETSCAPE2.0" in data
+    # Graphic control extensions with the delay in hundredths of a second and the transparent index
+    assert b"\x21\xf9\x04\x04\x64\x00\x00\x00" in data
+    assert b"\x21\xf9\x04\x05\x05\x00\x00\x00" in data
+    assert data.endswith(b"\x3b")
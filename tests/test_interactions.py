@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+import discord
+
+from chess_bot.interactions import (
+    CHANNEL_MESSAGE_WITH_SOURCE,
+    DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE,
+    EPHEMERAL,
+    Interaction,
+    InteractionRoute,
+)
+from tests.fakes import FakeBot
+
+
+class FakeHTTP:
+    """Records the requests discord.py would send, answering them like Discord does"""
+
+    def __init__(self):
+        self.requests = []
+        self.message_ids = iter(range(100, 200))
+
+    async def request(self, route, json=None, form=None, files=None, params=None):
+        uploaded = {file.filename: file.fp.read() for file in files or []}
+        self.requests.append((route.method, route.url, json, form, uploaded, params))
+        if route.method == "DELETE" or route.url.endswith("/callback"):
+            return None
+        return {
+            "id": str(next(self.message_ids)),
+            "attachments": [
+                {"filename": name, "url": f"https://cdn.example.com/{name}"} for name in uploaded
+            ],
+        }
+
+
+def make_payload(**options):
+    return {
+        "id": "10",
+        "application_id": "20",
+        "token": "secret",
+        "type": 2,
+        "guild_id": "30",
+        "channel_id": "40",
+        "member": {"user": {"id": "50"}},
+        "data": {
+            "name": "gif",
+            "options": [{"name": name, "value": value} for name, value in options.items()],
+        },
+    }
+
+
+def test_interaction_looks_like_a_message():
+    bot = FakeBot()
+    bot.http = FakeHTTP()
+    bot.guilds[30] = "guild"
+    interaction = Interaction(bot, make_payload(player="hikaru", ply=20))
+
+    assert interaction.is_command("gif")
+    assert not interaction.is_command("help")
+    assert interaction.options == {"player": "hikaru", "ply": 20}
+    assert (interaction.id, interaction.author.id, interaction.channel.id) == (10, 50, 40)
+    assert interaction.guild == "guild"
+
+
+def test_interaction_replies_edit_the_deferred_response_then_follow_it():
+    bot = FakeBot()
+    bot.http = FakeHTTP()
+    interaction = Interaction(bot, make_payload(id="1"))
+
+    async def run():
+        await interaction.defer()
+        placeholder = await interaction.channel.send(embed=discord.Embed(title="Rendering"))
+        gif = discord.File(__file__, filename="chess.gif")
+        sent = await interaction.channel.send(embed=discord.Embed(title="Game"), file=gif)
+        await placeholder.delete()
+        return sent
+
+    sent = asyncio.run(run())
+    callback, original, followup, deleted = bot.http.requests
+    assert callback[1].endswith("/interactions/10/secret/callback")
+    assert callback[2] == {"type": DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE}
+    assert original[:2] == ("PATCH", "https://discord.com/api/v10/webhooks/20/secret/messages/@original")
+    assert original[2]["embeds"][0]["title"] == "Rendering"
+
+    # Followups are waited for, to know the URLs of their attachments
+    method, url, _, form, uploaded, params = followup
+    assert (method, url) == ("POST", "https://discord.com/api/v10/webhooks/20/secret")
+    assert params == {"wait": "true"}
+    payload = json.loads(form[0]["value"])
+    assert payload["embeds"][0]["title"] == "Game"
+    assert payload["attachments"] == [{"id": 0, "filename": "chess.gif"}]
+    assert form[1]["name"] == "files[0]"
+    assert uploaded["chess.gif"].startswith(b"import asyncio")
+    assert sent.attachments[0].url == "https://cdn.example.com/chess.gif"
+    assert deleted[:2] == ("DELETE", original[1])
+
+
+def test_interaction_respond_makes_replies_followups():
+    bot = FakeBot()
+    bot.http = FakeHTTP()
+    interaction = Interaction(bot, make_payload())
+
+    async def run():
+        await interaction.respond("Pick a game", ephemeral=True)
+        await interaction.channel.send("Another reply")
+
+    asyncio.run(run())
+    (_, _, callback, *_), (method, url, *_) = bot.http.requests
+    assert callback == {
+        "type": CHANNEL_MESSAGE_WITH_SOURCE,
+        "data": {"content": "Pick a game", "flags": EPHEMERAL},
+    }
+    assert (method, url) == ("POST", "https://discord.com/api/v10/webhooks/20/secret")
+
+
+def test_interaction_routes_are_rate_limited_per_interaction():
+    path = "/webhooks/{application_id}/{interaction_token}"
+    first = InteractionRoute("POST", path, token="a", application_id=1, interaction_token="a")
+    second = InteractionRoute("POST", path, token="b", application_id=1, interaction_token="b")
+    assert first.bucket != second.bucket
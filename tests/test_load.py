@@ -0,0 +1,55 @@
+import asyncio
+import json
+import os
+
+from benchmarks.load import SAMPLE_LINK_ID, main, percentile, run_load, synthetic_trace
+from benchmarks.pgns import SAMPLE_PGNS
+from chess_bot.traffic import write_trace
+from tests.fakes import write_fake_c2g, write_fake_ffmpeg, write_fake_game_cgf
+
+
+def test_synthetic_trace_is_repeatable():
+    events = synthetic_trace(100, rate=10)
+    assert events == synthetic_trace(100, rate=10)
+    assert [event.at for event in events] == sorted(event.at for event in events)
+    # Popular players are requested more than once
+    players = [event.targets for event in events if event.search_type == "player"]
+    assert len(set(players)) < len(players)
+
+
+def test_percentile():
+    assert percentile([], 0.5) == 0.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 3.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 1.0) == 4.0
+
+
+def test_load_replays_a_trace_through_a_fake_discord(tmp_path, monkeypatch):
+    write_fake_game_cgf(tmp_path, SAMPLE_PGNS["short"], SAMPLE_LINK_ID)
+    write_fake_c2g(tmp_path, size=2048)
+    write_fake_ffmpeg(tmp_path)
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    events = synthetic_trace(10, rate=100)
+    events[0] = events[0]._replace(options=("format:webp",))
+
+    report = asyncio.run(run_load(events, speed=2, spool_dir=tmp_path / "spool", placeholders=True))
+    assert report["requests"] == 10
+    assert report["errors"] == 0
+    assert report["uploads"] == 10
+    assert report["uploaded_bytes"] >= 10 * 2048
+    # Placeholders are deleted once their GIF is posted
+    assert report["deletes"] == 10
+    assert 0 < report["latency_ms"]["p50"] <= report["latency_ms"]["max"]
+    assert report["throughput"] > 0
+    assert report["peak_rss_bytes"] > 0
+
+
+def test_load_main_writes_reports(tmp_path, capsys):
+    trace = tmp_path / "trace.jsonl"
+    write_trace(trace, synthetic_trace(5, rate=100))
+    output = tmp_path / "load.json"
+
+    args = [str(trace), "--speed", "1,4", "--cgf-latency", "0", "--c2g-latency", "0", "--rest-latency", "0"]
+    assert main([*args, "--output", str(output)]) == 0
+    runs = json.loads(output.read_text())["runs"]
+    assert [(run["speed"], run["requests"], run["uploads"]) for run in runs] == [(1, 5, 5), (4, 5, 5)]
+    assert "4x: 5 requests" in capsys.readouterr().out
@@ -0,0 +1,92 @@
+import json
+import logging
+import threading
+
+from chess_bot.logs import (
+    REQUEST_ID,
+    JSONFormatter,
+    Payload,
+    PayloadSampler,
+    RequestIdFilter,
+    correlate,
+    setup_logging,
+)
+
+
+def make_record(level, message, *args):
+    record = logging.LogRecord("chess_bot", level, __file__, 1, message, args, None)
+    RequestIdFilter().filter(record)
+    return record
+
+
+def test_payload_is_truncated():
+    assert str(Payload("1. e4 e5")) == "1. e4 e5"
+    assert str(Payload("e4 " * 10, limit=6)) == "e4 e4 ... (24 more characters)"
+    assert str(Payload(["--size", "640"])) == "['--size', '640']"
+
+
+def test_correlate_sets_the_request_id():
+    assert REQUEST_ID.get() is None
+    with correlate("42"):
+        assert make_record(logging.INFO, "Answering").request_id == "42"
+    assert make_record(logging.INFO, "Answering").request_id is None
+
+
+def test_sampler_only_drops_debug_payloads_of_unsampled_requests():
+    sampler = PayloadSampler(rate=0.5)
+    request_ids = [str(id) for id in range(1000)]
+    sampled = {id for id in request_ids if sampler.sampled(id)}
+    assert 400 < len(sampled) < 600
+
+    for request_id in request_ids[:20]:
+        with correlate(request_id):
+            debug = make_record(logging.DEBUG, "PGN: %s", Payload("1. e4"))
+            assert sampler.filter(debug) == (request_id in sampled)
+            # Sampled requests keep every payload
+            assert sampler.filter(debug) == sampler.filter(debug)
+            assert sampler.filter(make_record(logging.DEBUG, "Fetching %s", "hikaru"))
+            assert sampler.filter(make_record(logging.ERROR, "Failed with %s", Payload("error")))
+
+
+def test_sampler_samples_records_outside_requests():
+    sampler = PayloadSampler(rate=0.25)
+    kept = [sampler.filter(make_record(logging.DEBUG, "Args: %s", Payload([]))) for _ in range(8)]
+    assert kept.count(True) == 2
+    assert all(PayloadSampler(rate=1).sampled(str(id)) for id in range(100))
+
+
+def test_json_formatter():
+    with correlate("42"):
+        record = make_record(logging.WARNING, "Rejecting: %s", Payload("x" * 20, limit=5))
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry["level"] == "WARNING"
+    assert entry["logger"] == "chess_bot"
+    assert entry["message"] == "Rejecting: xxxxx... (15 more characters)"
+    assert entry["request_id"] == "42"
+    assert "request_id" not in json.loads(JSONFormatter().format(make_record(logging.INFO, "Ready")))
+
+
+def test_setup_logging_writes_in_a_thread(capsys):
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    written = []
+
+    class RecordingFormatter(JSONFormatter):
+        def format(self, record):
+            written.append(threading.current_thread())
+            return super().format(record)
+
+    listener = setup_logging(logging.DEBUG, payload_sample_rate=0)
+    try:
+        listener.handlers[0].setFormatter(RecordingFormatter())
+        with correlate("42"):
+            logging.info("Rendering %s", "hikaru")
+            logging.debug("Args: %s", Payload(["--size", "640"]))
+    finally:
+        listener.stop()
+        root.handlers[:] = handlers
+        root.setLevel(level)
+
+    lines = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert [(line["message"], line["request_id"]) for line in lines] == [("Rendering hikaru", "42")]
+    assert written and threading.current_thread() not in written
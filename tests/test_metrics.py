@@ -0,0 +1,83 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from chess_bot.metrics import Counter, Gauge, Histogram, Registry, start_metrics_server, track_stage
+
+
+def test_counter_exposition():
+    counter = Counter("errors_total", "Errors", labels=("stage",))
+    counter.inc("fetch")
+    counter.inc("fetch")
+    counter.inc("render")
+    assert counter.expose() == "\n".join(
+        [
+            "# HELP errors_total Errors",
+            "# TYPE errors_total counter",
+            'errors_total{stage="fetch"} 2.0',
+            'errors_total{stage="render"} 1.0',
+        ]
+    )
+
+
+def test_gauge_reads_functions_on_scrape():
+    depth = 0
+    gauge = Gauge("queue", "Queue", labels=("state",))
+    gauge.set_function("queued", function=lambda: depth)
+
+    depth = 3
+    assert 'queue{state="queued"} 3.0' in gauge.expose()
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    histogram.observe(value=0.05)
+    histogram.observe(value=0.5)
+    histogram.observe(value=5)
+
+    lines = histogram.expose().splitlines()[2:]
+    assert lines == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+
+
+def test_track_stage_counts_errors():
+    from chess_bot.metrics import IN_FLIGHT, STAGE_ERRORS, STAGE_SECONDS
+
+    errors = STAGE_ERRORS.get("test-stage")
+    count = STAGE_SECONDS.count("test-stage")
+
+    with track_stage("test-stage"):
+        assert IN_FLIGHT.get("test-stage") == 1
+
+    with pytest.raises(ValueError):
+        with track_stage("test-stage"):
+            raise ValueError()
+
+    assert IN_FLIGHT.get("test-stage") == 0
+    assert STAGE_ERRORS.get("test-stage") == errors + 1
+    assert STAGE_SECONDS.count("test-stage") == count + 2
+
+
+def test_metrics_server_serves_registry(unused_tcp_port):
+    registry = Registry()
+    counter = registry.register(Counter("requests_total", "Requests"))
+    counter.inc()
+
+    async def scrape():
+        runner = await start_metrics_server(unused_tcp_port, registry=registry)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{unused_tcp_port}/metrics") as response:
+                    return response.status, await response.text()
+        finally:
+            await runner.cleanup()
+
+    status, body = asyncio.run(scrape())
+    assert status == 200
+    assert "requests_total 1.0" in body
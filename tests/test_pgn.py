@@ -0,0 +1,68 @@
+import dataclasses
+
+import pytest
+
+from chess_bot.pgn import Game, count_plies, parse_headers, parse_moves
+
+PGN = """
+[Event "Rated Blitz game"]
+[White "magnus_carlsen"]
+[Black "O'Brien"]
+[Opening "King's Pawn: \\"Wayward\\" Queen"]
+[Result "1-0"]
+
+1. e4 e5 2. Qh5 { [%clk 0:03:00] [Fake "header"] } 1-0
+"""
+
+
+def test_parse_headers_accepts_any_character_in_values():
+    headers = parse_headers(PGN)
+    assert headers["White"] == "magnus_carlsen"
+    assert headers["Black"] == "O'Brien"
+    assert headers["Opening"] == 'King\'s Pawn: "Wayward" Queen'
+
+
+def test_parse_headers_stops_at_movetext():
+    headers = parse_headers(PGN)
+    assert list(headers.keys()) == ["Event", "White", "Black", "Opening", "Result"]
+
+
+def test_parse_headers_without_blank_line_before_movetext():
+    headers = parse_headers('[White "a"]\n[Black "b"]\n1. e4 [Fake "header"]')
+    assert headers == {"White": "a", "Black": "b"}
+
+
+def test_parse_headers_empty_pgn():
+    assert parse_headers("") == {}
+    assert parse_headers("1. e4 e5") == {}
+
+
+def test_game_header_lookup_is_case_insensitive():
+    game = Game.from_pgn(PGN)
+    assert game.get("black") == "O'Brien"
+    assert game.get("Link") is None
+    assert game.get("Link", "N/A") == "N/A"
+
+
+def test_game_is_immutable():
+    game = Game.from_pgn(PGN)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        game.pgn = ""  # type: ignore
+    with pytest.raises(TypeError):
+        game.headers["White"] = "someone else"  # type: ignore
+
+
+def test_count_plies_skips_everything_but_moves():
+    assert count_plies(PGN) == 3
+    movetext = "1. e4 (1. d4 d5 (1... Nf6)) 1... e5 $1 2.Nf3 {a (comment} Nc6 ; rest\n3. Bb5 1-0"
+    assert count_plies(movetext) == 5
+    assert count_plies("") == 0
+
+
+def test_parse_moves_keeps_the_clocks_of_the_main_line():
+    movetext = "1. e4 {[%clk 0:02:59.9]} (1. d4 {[%clk 0:01:00]}) 1... e5 {[%clk 1:00:00]} 2. Nf3 1-0"
+    assert parse_moves(movetext) == [("e4", 179.9), ("e5", 3600.0), ("Nf3", None)]
+
+
+def test_game_plies():
+    assert Game.from_pgn(PGN).plies == 3
@@ -0,0 +1,132 @@
+import asyncio
+import os
+
+from chess_bot.bot import Chess2GIF
+from chess_bot.cache import GIFCache, PGNCache
+from chess_bot.prefetch import Prefetcher
+from chess_bot.scheduler import RenderScheduler
+from chess_bot.spool import GIFSpool
+from tests.fakes import FakeBot, FakeChannel, make_bot_user, make_message, write_executable
+
+PGN = """
+[White "liczner"]
+[Black "Hikaru"]
+
+1. e4 g6 2. d4 Bg7 1/2-1/2
+"""
+
+
+def write_fake_execs(tmp_path, monkeypatch):
+    write_executable(
+        tmp_path,
+        "cgf",
+        f"open({str(tmp_path / 'cgf.log')!r}, 'a').write('run\\n'); print({PGN!r})",
+    )
+    write_executable(
+        tmp_path,
+        "c2g",
+        f"import sys; open({str(tmp_path / 'c2g.log')!r}, 'a').write('run\\n');"
+        "open(sys.argv[sys.argv.index('-o') + 1], 'wb').write(b'GIF89a')",
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+
+
+def runs(path):
+    return len(path.read_text().splitlines()) if path.exists() else 0
+
+
+def test_prefetch_renders_new_games_once(tmp_path, monkeypatch):
+    write_fake_execs(tmp_path, monkeypatch)
+    cog = Chess2GIF(
+        bot=None,
+        gif_cache=GIFCache(tmp_path / "cache"),
+        pgn_cache=PGNCache(),
+        spool=GIFSpool(tmp_path / "spool"),
+    )
+    prefetcher = Prefetcher(cog, ["Hikaru"])
+
+    asyncio.run(prefetcher.poll())
+    asyncio.run(prefetcher.poll())
+
+    # The PGN is refreshed every poll, the GIF only rendered once
+    assert runs(tmp_path / "cgf.log") == 2
+    assert runs(tmp_path / "c2g.log") == 1
+    assert len(cog.gif_cache) == 1
+    assert list((tmp_path / "spool").iterdir()) == []
+
+
+def test_requests_for_watched_players_are_served_warm(tmp_path, monkeypatch):
+    write_fake_execs(tmp_path, monkeypatch)
+    channel = FakeChannel()
+    message = make_message("player:Hikaru", channel=channel)
+    cog = Chess2GIF(
+        bot=FakeBot(make_bot_user()),
+        gif_cache=GIFCache(tmp_path / "cache"),
+        pgn_cache=PGNCache(),
+        spool=GIFSpool(tmp_path / "spool"),
+    )
+
+    asyncio.run(Prefetcher(cog, ["Hikaru"]).poll())
+    asyncio.run(cog.on_message(message))
+
+    assert runs(tmp_path / "cgf.log") == 1
+    assert runs(tmp_path / "c2g.log") == 1
+    _, kwargs = channel.sent[0]
+    assert kwargs["file"].fp.read() == b"GIF89a"
+
+
+def test_requests_for_watched_players_skip_the_render_queue(tmp_path, monkeypatch):
+    write_fake_execs(tmp_path, monkeypatch)
+    channel = FakeChannel()
+    message = make_message("player:Hikaru", channel=channel)
+    cog = Chess2GIF(
+        bot=FakeBot(make_bot_user()),
+        scheduler=RenderScheduler(max_concurrency=1, max_queue_size=0),
+        gif_cache=GIFCache(tmp_path / "cache"),
+        pgn_cache=PGNCache(),
+        spool=GIFSpool(tmp_path / "spool"),
+    )
+
+    async def run():
+        await Prefetcher(cog, ["Hikaru"]).poll()
+        # Every render slot is taken, and nothing may queue
+        async with cog.scheduler.enqueue(1, 1):
+            await cog.on_message(message)
+
+    asyncio.run(run())
+    _, kwargs = channel.sent[0]
+    assert kwargs["file"].fp.read() == b"GIF89a"
+
+
+def test_prefetch_interval_stays_below_the_player_pgn_ttl():
+    cog = Chess2GIF(bot=None, pgn_cache=PGNCache(player_ttl=60.0))
+    assert Prefetcher(cog, ["Hikaru"], interval=60.0).interval == 30.0
+    assert Prefetcher(cog, ["Hikaru"], interval=10.0).interval == 10.0
+
+
+def test_prefetch_waits_for_interactive_renders(tmp_path, monkeypatch):
+    write_fake_execs(tmp_path, monkeypatch)
+
+    async def run():
+        cog = Chess2GIF(
+            bot=None,
+            scheduler=RenderScheduler(max_concurrency=1),
+            gif_cache=GIFCache(tmp_path / "cache"),
+            spool=GIFSpool(tmp_path / "spool"),
+        )
+        running = cog.scheduler.enqueue(1, 1)
+        waiting = cog.scheduler.enqueue(1, 2)
+
+        poll = asyncio.ensure_future(Prefetcher(cog, ["Hikaru"], idle_check_interval=0.01).poll())
+        await asyncio.sleep(0.5)
+        rendered_while_busy = runs(tmp_path / "c2g.log")
+
+        async with running:
+            pass
+        async with waiting:
+            pass
+        await asyncio.wait_for(poll, timeout=10)
+        return rendered_while_busy
+
+    assert asyncio.run(run()) == 0
+    assert runs(tmp_path / "c2g.log") == 1
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import signal
+import sys
+
+import pytest
+
+from chess_bot.process import (
+    ProcessKilledError,
+    ProcessLimits,
+    ProcessTimeoutError,
+    run_process,
+    run_process_sync,
+)
+
+
+def test_run_process_captures_stdout():
+    stdout, error = asyncio.run(run_process([sys.executable, "-c", "print('hello')"]))
+    assert stdout == b"hello\n"
+    assert error == ""
+
+
+def test_run_process_captures_stderr():
+    stdout, error = asyncio.run(
+        run_process([sys.executable, "-c", "import sys; sys.stderr.write('game not found')"])
+    )
+    assert stdout == b""
+    assert error == "game not found"
+
+
+def test_run_process_large_output_does_not_deadlock():
+    script = "import sys; sys.stdout.write('a' * 1000000); sys.stderr.write('b' * 1000000)"
+    stdout, error = asyncio.run(run_process([sys.executable, "-c", script]))
+    assert len(stdout) == 1000000
+    assert len(error) == 1000000
+
+
+def test_run_process_runs_concurrently():
+    async def run_many():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(
+            *(run_process([sys.executable, "-c", "import time; time.sleep(0.5)"]) for _ in range(4))
+        )
+        return loop.time() - start
+
+    assert asyncio.run(run_many()) < 2.0
+
+
+def test_run_process_kills_processes_that_time_out():
+    args = [sys.executable, "-c", "import time; time.sleep(30)"]
+    with pytest.raises(ProcessTimeoutError) as e:
+        asyncio.run(run_process(args, limits=ProcessLimits(timeout=0.2)))
+    assert e.value.timeout == 0.2
+
+
+def test_run_process_kills_cancelled_processes(tmp_path):
+    pid_path = tmp_path / "pid"
+    script = f"import os, time; open({str(pid_path)!r}, 'w').write(str(os.getpid())); time.sleep(30)"
+
+    async def run():
+        task = asyncio.ensure_future(run_process([sys.executable, "-c", script]))
+        while not pid_path.exists() or not pid_path.read_text():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_path.read_text()), 0)
+
+
+def test_run_process_reports_processes_over_the_cpu_limit():
+    with pytest.raises(ProcessKilledError) as e:
+        asyncio.run(run_process([sys.executable, "-c", "while True: pass"], limits=ProcessLimits(cpu=1)))
+    assert e.value.signal_number in (signal.SIGXCPU, signal.SIGKILL)
+
+
+def test_run_process_applies_the_memory_limit_and_niceness():
+    script = "import os; print(os.nice(0)); bytearray(512 * 1024 * 1024)"
+    limits = ProcessLimits(memory=256 * 1024 * 1024, niceness=5)
+    stdout, error = asyncio.run(run_process([sys.executable, "-c", script], limits=limits))
+    assert int(stdout) == os.nice(0) + 5
+    assert "MemoryError" in error
+
+
+def test_run_process_sync_applies_the_limits():
+    script = "import os; print(os.nice(0)); bytearray(512 * 1024 * 1024)"
+    limits = ProcessLimits(memory=256 * 1024 * 1024, niceness=5)
+    stdout, error = run_process_sync([sys.executable, "-c", script], limits=limits)
+    assert int(stdout) == os.nice(0) + 5
+    assert "MemoryError" in error
+
+
+def test_run_process_sync_kills_processes_past_the_timeout():
+    with pytest.raises(ProcessTimeoutError):
+        run_process_sync(
+            [sys.executable, "-c", "import time; time.sleep(30)"], limits=ProcessLimits(timeout=0.2)
+        )
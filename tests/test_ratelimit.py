@@ -0,0 +1,80 @@
+import pytest
+
+from chess_bot.ratelimit import Buckets, RateLimit, RateLimitedError, RateLimiter, parse_rate_limit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_rate_limit():
+    assert parse_rate_limit("5/60") == RateLimit(5, 60.0)
+    assert parse_rate_limit("3") == RateLimit(3, 1.0)
+    with pytest.raises(ValueError):
+        parse_rate_limit("0/60")
+
+
+def test_buckets_refill_at_the_limit_rate():
+    buckets = Buckets(RateLimit(2, 10.0))
+    buckets.take("a", 1, now=0.0)
+    buckets.take("a", 1, now=0.0)
+
+    assert buckets.retry_after("a", 1, now=0.0) == pytest.approx(5.0)
+    assert buckets.retry_after("a", 1, now=5.0) == 0
+    # Other keys have buckets of their own
+    assert buckets.retry_after("b", 2, now=0.0) == 0
+
+
+def test_buckets_forget_the_ones_refilled():
+    buckets = Buckets(RateLimit(2, 10.0))
+    for user in range(1000):
+        buckets.take(user, 1, now=user * 0.001)
+    assert len(buckets) == 1000
+
+    buckets.take("late", 1, now=100.0)
+    assert len(buckets) == 1
+    # A forgotten bucket is as good as a full one
+    assert buckets.tokens(0, now=100.0) == 2
+
+
+def test_rate_limiter_takes_nothing_unless_every_level_has_room():
+    clock = FakeClock()
+    limiter = RateLimiter(
+        user=RateLimit(5, 60.0), channel=RateLimit(2, 60.0), guild=RateLimit(10, 60.0), clock=clock
+    )
+    limiter.acquire("a", "channel", "guild")
+    limiter.acquire("b", "channel", "guild")
+
+    with pytest.raises(RateLimitedError) as e:
+        limiter.acquire("c", "channel", "guild")
+    assert e.value.retry_after == pytest.approx(30.0)
+    # The user's bucket was left untouched by the rejected request
+    assert limiter.users.tokens("c", clock.now) == 5
+
+    limiter.acquire("c", "another-channel", "guild")
+
+
+def test_rate_limiter_charges_batches_up_to_the_burst():
+    clock = FakeClock()
+    limiter = RateLimiter(user=RateLimit(3, 30.0), clock=clock)
+    limiter.acquire("a", "channel", None, cost=10)
+
+    with pytest.raises(RateLimitedError):
+        limiter.acquire("a", "channel", None)
+    clock.now = 10.0
+    limiter.acquire("a", "channel", None)
+
+
+def test_rate_limiter_warns_once_per_interval():
+    clock = FakeClock()
+    limiter = RateLimiter(warning_interval=60.0, clock=clock)
+
+    assert limiter.should_warn("a") is True
+    assert limiter.should_warn("a") is False
+    assert limiter.should_warn("b") is True
+    clock.now = 60.0
+    assert limiter.should_warn("a") is True
@@ -0,0 +1,161 @@
+import asyncio
+import struct
+import zlib
+
+import pytest
+
+from chess_bot.render import (
+    DEFAULT_DELAY,
+    LAST_FRAME_DELAY,
+    NativeRenderer,
+    RenderOptions,
+    frame_delays,
+    get_atlas,
+    render_gif,
+    render_options,
+    render_png,
+)
+from chess_bot.pgn import parse_moves
+from chess_bot.request import RenderRequest
+from chess_bot.spool import RenderedGIF
+
+PGN = """[Event "Live Chess"]
+[White "liczner"]
+[Black "Hikaru"]
+[TimeControl "180+2"]
+
+1. e4 {[%clk 0:03:00]} e5 {[%clk 0:03:00]} 2. Nf3 {[%clk 0:02:57.5]} Nc6 {[%clk 0:02:50]}
+3. Bc4 Bc5 4. O-O 1-0
+"""
+
+
+def skip_sub_blocks(data: bytes, position: int) -> int:
+    while data[position]:
+        position += data[position] + 1
+    return position + 1
+
+
+def frame_rectangles(data: bytes) -> list[tuple[int, int, int, int]]:
+    """Return the left, top, width and height of every frame of a GIF"""
+    color_table = 3 * (2 << (data[10] & 0x07))
+    position = 13 + color_table
+    rectangles = []
+    while data[position] != 0x3B:
+        if data[position] == 0x21:
+            position = skip_sub_blocks(data, position + 2)
+        else:
+            rectangles.append(struct.unpack_from("<HHHH", data, position + 1))
+            # The descriptor, and the LZW minimum code size before the image data
+            position = skip_sub_blocks(data, position + 11)
+    return rectangles
+
+
+def test_render_options_follow_the_c2g_options():
+    request = RenderRequest(
+        search_type="id",
+        id_or_username="1",
+        time="real",
+        disable=("coordinates", "player-bars"),
+        light="255,255,255",
+        dark="0,0,0",
+        board_size=400,
+    )
+    options = render_options(PGN, request, flip=True)
+    assert options == RenderOptions(
+        pgn=PGN,
+        board_size=400,
+        delay=None,
+        light=(255, 255, 255),
+        dark=(0, 0, 0),
+        coordinates=False,
+        flip=True,
+    )
+    assert render_options(PGN, request._replace(time="500")).delay == 500
+    assert render_options(PGN, request._replace(time=None)).delay == DEFAULT_DELAY
+
+
+def test_frame_delays_in_real_time_come_from_the_clocks():
+    moves = parse_moves(PGN)
+    opening = [DEFAULT_DELAY, DEFAULT_DELAY, 4500, 12000]
+    assert frame_delays(PGN, moves, None) == opening + [DEFAULT_DELAY] * 3 + [LAST_FRAME_DELAY]
+    assert frame_delays(PGN, moves, 200) == [200] * 7 + [LAST_FRAME_DELAY]
+
+
+def test_render_gif_only_redraws_the_squares_a_move_changed():
+    data = render_gif(RenderOptions(pgn=PGN, board_size=320))
+    squares = 40
+    assert frame_rectangles(data) == [
+        (0, 0, 320, 320),
+        # e2-e4
+        (4 * squares, 4 * squares, squares, 3 * squares),
+        # e7-e5
+        (4 * squares, 1 * squares, squares, 3 * squares),
+        # g1-f3
+        (5 * squares, 5 * squares, 2 * squares, 3 * squares),
+        # b8-c6
+        (1 * squares, 0, 2 * squares, 3 * squares),
+        # f1-c4 and f8-c5
+        (2 * squares, 4 * squares, 4 * squares, 4 * squares),
+        (2 * squares, 0, 4 * squares, 4 * squares),
+        # Castling moves the king and rook, from e1 to h1
+        (4 * squares, 7 * squares, 4 * squares, squares),
+    ]
+
+    flipped = frame_rectangles(render_gif(RenderOptions(pgn=PGN, board_size=320, flip=True)))
+    assert flipped[1] == (3 * squares, 1 * squares, squares, 3 * squares)
+
+
+def test_render_gif_reuses_encoded_frames():
+    get_atlas.cache_clear()
+    render_gif(RenderOptions(pgn=PGN, board_size=256))
+    atlas = get_atlas(32, True, False)
+    frames = len(atlas._frames)
+    # Another game, in other colors, opening the same way
+    render_gif(RenderOptions(pgn=PGN.replace("4. O-O", "4. d3"), board_size=256, light=(1, 2, 3)))
+    assert len(atlas._frames) == frames + 1
+
+
+def read_png(data: bytes) -> tuple[int, int, bytes]:
+    """Return the width, height and palette indices of an unfiltered 8 bit PNG"""
+    width, height = struct.unpack_from(">II", data, 16)
+    compressed, position = b"", 8
+    while position < len(data):
+        length, kind = struct.unpack_from(">I4s", data, position)
+        start, end = position + 8, position + 8 + length
+        if kind == b"IDAT":
+            compressed += data[start:end]
+        position = end + 4
+    rows = zlib.decompress(compressed)
+    # Every row starts with its filter type
+    return width, height, bytes(pixel for index, pixel in enumerate(rows) if index % (width + 1))
+
+
+def test_render_png_draws_a_single_position():
+    width, height, final = read_png(render_png(RenderOptions(pgn=PGN, board_size=256)))
+    assert (width, height) == (256, 256)
+    assert read_png(render_png(RenderOptions(pgn=PGN, board_size=256, ply=100)))[2] == final
+
+    # Only the first rank changes when castling, on the last move
+    _, _, before = read_png(render_png(RenderOptions(pgn=PGN, board_size=256, ply=6)))
+    first_rank = 7 * 32 * 256
+    assert before[:first_rank] == final[:first_rank]
+    assert before[first_rank:] != final[first_rank:]
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_native_renderer_renders_into_outputs(tmp_path, processes):
+    async def run():
+        renderer = NativeRenderer(processes=processes)
+        try:
+            request = RenderRequest(search_type="player", id_or_username="Hikaru", board_size=256)
+            output = RenderedGIF("chess.gif", tmp_path)
+            error = await renderer.render(PGN, request, output)
+            broken = await renderer.render(PGN.replace("Nc6", "Nc5"), request, RenderedGIF("x.gif", tmp_path))
+            return output, error, broken
+        finally:
+            renderer.close()
+
+    output, error, broken = asyncio.run(run())
+    assert error is None
+    assert output.open().read().startswith(b"GIF89a")
+    assert broken == "Can't play Nc5"
@@ -0,0 +1,50 @@
+import pytest
+
+from chess_bot.replay import ReplayError, changed_squares, parse_fen, replay, square
+
+
+def piece_at(board, name):
+    return board[square(name)]
+
+
+def test_replay_castles_both_ways():
+    boards = replay(["e4", "d5", "Nf3", "Be6", "Bc4", "Nc6", "O-O", "Qd7", "d3", "O-O-O"])
+    board = boards[-1]
+    assert [piece_at(board, name) for name in ("g1", "f1", "e1", "h1")] == ["K", "R", "", ""]
+    assert [piece_at(board, name) for name in ("c8", "d8", "e8", "a8")] == ["k", "r", "", ""]
+
+
+def test_replay_captures_en_passant():
+    board = replay(["e4", "a6", "e5", "d5", "exd6"])[-1]
+    assert piece_at(board, "d6") == "P"
+    assert piece_at(board, "d5") == ""
+    assert changed_squares(replay(["e4", "a6", "e5", "d5"])[-1], board) == [
+        square("d5"),
+        square("e5"),
+        square("d6"),
+    ]
+
+
+def test_replay_promotes_pawns():
+    board = replay(["h4", "g5", "hxg5", "h6", "gxh6", "Nc6", "h7", "Nb8", "hxg8=Q+"])[-1]
+    assert piece_at(board, "g8") == "Q"
+
+
+def test_replay_disambiguates_with_pins():
+    # Both knights reach d2, but the one on c3 is pinned to the king by the bishop on b4
+    fen = "4k3/8/8/8/1b6/2N5/8/4K1N1 w - - 0 1"
+    board = replay(["Nf3", "Kd7", "Nd2"], fen)[-1]
+    assert piece_at(board, "d2") == "N"
+    assert piece_at(board, "c3") == "N"
+
+
+def test_replay_from_a_fen_with_black_to_move():
+    board, white = parse_fen("4k3/8/8/8/8/8/8/4K3 b - - 0 1")
+    assert white is False
+    assert replay(["Kd7"], "4k3/8/8/8/8/8/8/4K3 b - - 0 1")[-1][square("d7")] == "k"
+
+
+@pytest.mark.parametrize("moves", [["e5"], ["Nf4"], ["O-O"], ["e4", "e5", "Ke3"], ["castle"]])
+def test_replay_rejects_moves_that_cant_be_played(moves):
+    with pytest.raises(ReplayError):
+        replay(moves)
@@ -0,0 +1,189 @@
+import discord
+
+from chess_bot.request import (
+    MISSING_SEARCH_ERROR,
+    MISSING_SEARCH_OPTION_ERROR,
+    RenderRequest,
+    mentions_user,
+    parse_message,
+    parse_options,
+    parse_request,
+    split_batch,
+)
+
+USER_DATA = {
+    "username": "a-user",
+    "id": "10",
+    "discriminator": "#123",
+    "avatar": "N/A",
+}
+
+BOT_USER_DATA = {
+    "username": "@Chess2GIF",
+    "id": "1",
+    "discriminator": "#123",
+    "avatar": "N/A",
+    "bot": True,
+    "system": False,
+}
+BOT_MENTION = "<@!1>"
+
+
+class FakeMessage:
+    def __init__(self, content, author_data=USER_DATA):
+        self.content = content
+        self.author = discord.ClientUser(state={}, data=author_data)
+        self.mention_everyone = False
+
+    @property
+    def clean_content(self):
+        raise AssertionError("resolving mentions is not needed to parse a message")
+
+
+def parse(content: str):
+    return parse_message(FakeMessage(content), discord.ClientUser(state={}, data=BOT_USER_DATA))
+
+
+def test_parse_message_with_id():
+    request, error = parse(f"{BOT_MENTION} id:11219006649")
+    assert error is None
+    assert request == RenderRequest(search_type="id", id_or_username="11219006649")
+
+
+def test_parse_message_with_player_name():
+    request, error = parse(f"{BOT_MENTION} player:hikaru")
+    assert error is None
+    assert request.search_type == "player"
+    assert request.id_or_username == "hikaru"
+
+
+def test_parse_message_with_options():
+    request, error = parse(
+        f"{BOT_MENTION} id:11219006649 time:real disable:player-bars,clock light:255,255,255 dark:0,0,0"
+    )
+    assert error is None
+    assert request.time == "real"
+    assert request.disable == ("player-bars", "clock")
+    assert (request.light, request.dark) == ("255,255,255", "0,0,0")
+
+    request, _ = parse(f"{BOT_MENTION} id:11219006649 time:2000")
+    assert request.time == "2000"
+
+
+def test_parse_message_ignores_messages_not_for_the_bot():
+    assert parse("just chatting about id:11219006649") == (None, None)
+    assert parse("<@!2> player:hikaru") == (None, None)
+
+    message = FakeMessage(f"{BOT_MENTION} player:hikaru", author_data=BOT_USER_DATA)
+    bot = discord.ClientUser(state={}, data=BOT_USER_DATA)
+    assert parse_message(message, bot) == (None, None)
+
+    message = FakeMessage(f"@everyone {BOT_MENTION} player:hikaru")
+    message.mention_everyone = True
+    assert parse_message(message, bot) == (None, None)
+
+
+def test_parse_message_leaves_help_to_the_help_command():
+    assert parse(f"{BOT_MENTION} help") == (None, None)
+
+
+def test_parse_message_malformed():
+    request, error = parse(f"{BOT_MENTION} malformed message")
+    assert request is None
+    assert error == MISSING_SEARCH_ERROR
+
+    # Tokens without a value used to raise an IndexError
+    request, error = parse(f"{BOT_MENTION} please gif id:11219006649 time")
+    assert error is None
+    assert request.id_or_username == "11219006649"
+
+
+def test_parse_request_validates_options():
+    assert parse_request(["id:1", "time:soon"])[1] is not None
+    assert parse_request(["id:1", "light:white"])[1] is not None
+    assert parse_request(["id:1", "dark:0,0,256"])[1] is not None
+    assert parse_request(["id:1", "last:0"])[1] is not None
+    request, error = parse_request(["id:1", "last:2"])
+    assert error is None
+    assert request == RenderRequest(search_type="id", id_or_username="1", last=2)
+
+
+def test_parse_request_output_formats():
+    request, error = parse_request(["id:1", "format:webp"])
+    assert error is None
+    assert request.format == "webp"
+    # Picking a position implies a png
+    request, error = parse_request(["id:1", "ply:20"])
+    assert error is None
+    assert (request.format, request.ply) == ("png", 20)
+    assert parse_request(["id:1", "format:bmp"])[1] is not None
+    assert parse_request(["id:1", "ply:last"])[1] is not None
+    assert parse_request(["id:1", "format:mp4", "ply:20"])[1] is not None
+
+
+def test_parse_options_of_a_command():
+    request, error = parse_options({"player": "hikaru", "time": "real", "ply": 0})
+    assert error is None
+    assert request == RenderRequest(
+        search_type="player", id_or_username="hikaru", time="real", format="png", ply=0
+    )
+    assert parse_options({"time": "soon", "id": "1"})[1] is not None
+    # The error for a message would ask for help with a mention
+    assert parse_options({"time": "real"}) == (None, MISSING_SEARCH_OPTION_ERROR)
+
+
+def test_mentions_user():
+    assert mentions_user("<@1> id:1", 1)
+    assert mentions_user("<@!1> id:1", 1)
+    assert not mentions_user("<@!12> id:1", 1)
+
+
+def test_render_request_is_immutable():
+    request = RenderRequest(search_type="id", id_or_username="1")
+    assert not hasattr(request, "__dict__")
+    try:
+        request.time = "real"  # type: ignore[misc]
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("RenderRequest should be immutable")
+
+
+def test_split_batch():
+    request, _ = parse(f"{BOT_MENTION} id:a,b,c time:real")
+    batch, error = split_batch(request)
+    assert error is None
+    assert [r.id_or_username for r in batch] == ["a", "b", "c"]
+    assert all(r.time == "real" and r.search_type == "id" for r in batch)
+
+
+def test_split_batch_single_game():
+    batch, error = split_batch(RenderRequest(search_type="player", id_or_username="hikaru"))
+    assert error is None
+    assert len(batch) == 1
+
+
+def test_split_batch_errors():
+    ids = ",".join(str(i) for i in range(11))
+    _, error = split_batch(RenderRequest(search_type="id", id_or_username=ids))
+    assert error is not None
+
+    _, error = split_batch(RenderRequest(search_type="id", id_or_username=","))
+    assert error is not None
+
+    _, error = split_batch(RenderRequest(search_type="id", id_or_username="1", last=5))
+    assert error is not None
+
+    _, error = split_batch(RenderRequest(search_type="player", id_or_username="hikaru,magnus", last=6))
+    assert error is not None
+
+
+def test_split_batch_of_latest_games():
+    batch, error = split_batch(RenderRequest(search_type="player", id_or_username="hikaru,magnus", last=2))
+    assert error is None
+    assert [(request.id_or_username, request.game, request.last) for request in batch] == [
+        ("hikaru", 1, 1),
+        ("hikaru", 2, 1),
+        ("magnus", 1, 1),
+        ("magnus", 2, 1),
+    ]
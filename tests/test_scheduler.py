@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from chess_bot.scheduler import RenderScheduler, SchedulerBusyError
+
+
+def test_scheduler_runs_immediately_when_slots_are_free():
+    async def run():
+        scheduler = RenderScheduler(max_concurrency=2)
+        ticket = scheduler.enqueue("guild", "user")
+        assert ticket.queued is False
+        async with ticket:
+            assert scheduler.running == 1
+        assert scheduler.running == 0
+
+    asyncio.run(run())
+
+
+def test_scheduler_rejects_when_queue_is_full():
+    async def run():
+        scheduler = RenderScheduler(max_concurrency=1, max_queue_size=1)
+        scheduler.enqueue("guild", "user")
+        queued = scheduler.enqueue("guild", "user")
+        assert queued.queued is True
+        with pytest.raises(SchedulerBusyError):
+            scheduler.enqueue("guild", "user")
+
+    asyncio.run(run())
+
+
+def test_scheduler_limits_concurrency():
+    async def run():
+        scheduler = RenderScheduler(max_concurrency=2, max_queue_size=10)
+        peak = 0
+
+        async def job():
+            nonlocal peak
+            async with scheduler.enqueue("guild", "user"):
+                peak = max(peak, scheduler.running)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(job() for _ in range(6)))
+        assert peak == 2
+        assert scheduler.running == 0
+        assert scheduler.queue_depth == 0
+
+    asyncio.run(run())
+
+
+def test_scheduler_is_fair_across_guilds_and_users():
+    async def run():
+        scheduler = RenderScheduler(max_concurrency=1, max_queue_size=10)
+        order = []
+
+        blocker = scheduler.enqueue("blocker", "blocker")
+        requests = [("busy", "a"), ("busy", "a"), ("busy", "a"), ("busy", "b"), ("quiet", "c")]
+        tickets = [(request, scheduler.enqueue(*request)) for request in requests]
+
+        async def job(request, ticket):
+            async with ticket:
+                order.append(request)
+
+        # The quiet guild gets ahead of the busy one, however late it queued
+        assert [scheduler.ahead(ticket) for _, ticket in tickets] == [0, 3, 4, 2, 1]
+
+        tasks = [asyncio.ensure_future(job(request, ticket)) for request, ticket in tickets]
+        async with blocker:
+            pass
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(run())
+    assert order == [("busy", "a"), ("quiet", "c"), ("busy", "b"), ("busy", "a"), ("busy", "a")]
+
+
+def test_scheduler_reports_wait_time():
+    async def run():
+        scheduler = RenderScheduler(max_concurrency=1)
+        blocker = scheduler.enqueue("guild", "user")
+        ticket = scheduler.enqueue("guild", "user")
+
+        async def release_later():
+            async with blocker:
+                await asyncio.sleep(0.05)
+
+        task = asyncio.ensure_future(release_later())
+        async with ticket:
+            assert ticket.wait_time >= 0.05
+        await task
+
+    asyncio.run(run())
+
+
+def test_scheduler_cancelled_ticket_leaves_the_queue():
+    async def run():
+        scheduler = RenderScheduler(max_concurrency=1)
+        blocker = scheduler.enqueue("guild", "user")
+        ticket = scheduler.enqueue("guild", "user")
+
+        async def wait():
+            async with ticket:
+                pass
+
+        task = asyncio.ensure_future(wait())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert scheduler.queue_depth == 0
+        async with blocker:
+            pass
+        assert scheduler.running == 0
+
+    asyncio.run(run())
+
+
+def test_scheduler_releases_a_ticket_once():
+    async def run():
+        scheduler = RenderScheduler(max_concurrency=1)
+        unused = scheduler.enqueue("guild", "user")
+        queued = scheduler.enqueue("guild", "user")
+
+        # A ticket never used gives its slot to the next one, however many times it is cancelled
+        scheduler.cancel(unused)
+        scheduler.cancel(unused)
+        assert scheduler.running == 1
+        async with queued:
+            scheduler.cancel(queued)
+        assert scheduler.running == 0
+
+    asyncio.run(run())
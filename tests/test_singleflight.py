@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from chess_bot.singleflight import SingleFlight
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    calls = 0
+    cleaned = []
+
+    async def job():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "gif"
+
+    async def request(flight):
+        async with flight.join("key", job, cleanup=cleaned.append) as result:
+            await asyncio.sleep(0)
+            assert cleaned == []
+            return result
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(request(flight) for _ in range(5)))
+        assert "key" not in flight
+        return results
+
+    assert asyncio.run(run()) == ["gif"] * 5
+    assert calls == 1
+    assert cleaned == ["gif"]
+
+
+def test_single_flight_runs_again_once_finished():
+    calls = 0
+
+    async def job():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def run():
+        flight = SingleFlight()
+        async with flight.join("key", job) as first:
+            pass
+        async with flight.join("key", job) as second:
+            pass
+        return first, second
+
+    assert asyncio.run(run()) == (1, 2)
+
+
+def test_single_flight_keeps_running_when_one_caller_is_cancelled():
+    async def job():
+        await asyncio.sleep(0.05)
+        return "gif"
+
+    async def request(flight):
+        async with flight.join("key", job) as result:
+            return result
+
+    async def run():
+        flight = SingleFlight()
+        impatient = asyncio.ensure_future(request(flight))
+        patient = asyncio.ensure_future(request(flight))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+        return await patient
+
+    assert asyncio.run(run()) == "gif"
+
+
+def test_single_flight_cancels_job_without_callers():
+    cancelled = False
+
+    async def job():
+        nonlocal cancelled
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    async def request(flight):
+        async with flight.join("key", job):
+            pass
+
+    async def run():
+        flight = SingleFlight()
+        task = asyncio.ensure_future(request(flight))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        assert "key" not in flight
+
+    asyncio.run(run())
+    assert cancelled
+
+
+def test_single_flight_shares_exceptions():
+    async def job():
+        raise ValueError("no game")
+
+    async def request(flight):
+        async with flight.join("key", job):
+            pass
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(request(flight), request(flight), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
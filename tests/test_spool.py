@@ -0,0 +1,53 @@
+from chess_bot.spool import GIFSpool, RenderedGIF, SPOOL_FILE_PREFIX
+
+
+def test_rendered_gif_stays_in_memory_below_threshold(tmp_path):
+    gif = RenderedGIF("test.gif", tmp_path, threshold=10)
+    gif.write(b"GIF89a")
+    gif.finish()
+
+    assert not gif.spilled
+    assert gif.size == 6
+    assert gif.open().read() == b"GIF89a"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rendered_gif_spills_above_threshold(tmp_path):
+    gif = RenderedGIF("test.gif", tmp_path, threshold=10)
+    gif.write(b"GIF89a")
+    gif.write(b"0123456789")
+    gif.finish()
+
+    assert gif.spilled
+    assert gif.size == 16
+    assert gif.path is not None and gif.path.parent == tmp_path
+    with gif.open() as f:
+        assert f.read() == b"GIF89a0123456789"
+
+    gif.unlink()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rendered_gif_readers_are_independent(tmp_path):
+    gif = RenderedGIF("test.gif", tmp_path)
+    gif.write(b"GIF89a")
+    first, second = gif.open(), gif.open()
+    assert first.read(3) == b"GIF"
+    assert second.read() == b"GIF89a"
+
+
+def test_rendered_gif_to_file(tmp_path):
+    gif = RenderedGIF("test.gif", tmp_path)
+    gif.write(b"GIF89a")
+    gif_file = gif.to_file()
+    assert gif_file.filename == "test.gif"
+    assert gif_file.fp.read() == b"GIF89a"
+
+
+def test_gif_spool_removes_orphans_on_startup(tmp_path):
+    (tmp_path / f"{SPOOL_FILE_PREFIX}orphan.gif").write_bytes(b"GIF89a")
+    (tmp_path / "unrelated.txt").write_text("keep me")
+
+    spool = GIFSpool(tmp_path)
+    assert [p.name for p in tmp_path.iterdir()] == ["unrelated.txt"]
+    assert spool.new().name.endswith(".gif")
@@ -0,0 +1,98 @@
+import asyncio
+import sys
+
+from chess_bot.cli import SUPERVISOR_OPTIONS
+from chess_bot.supervisor import (
+    Supervisor,
+    parse_shard_ids,
+    plan_shards,
+    shard_directory,
+    shard_share,
+    strip_options,
+)
+
+SLEEPER = [sys.executable, "-c", "import time; time.sleep(60)"]
+
+
+def test_plan_shards_splits_evenly():
+    assert plan_shards(4, 2) == [[0, 2], [1, 3]]
+    assert plan_shards(5, 2) == [[0, 2, 4], [1, 3]]
+    assert plan_shards(2, 4) == [[0], [1]]
+    assert plan_shards(3, 1) == [[0, 1, 2]]
+
+
+def test_parse_shard_ids():
+    assert parse_shard_ids("0,1,2") == [0, 1, 2]
+    assert parse_shard_ids("3") == [3]
+    assert parse_shard_ids("4,") == [4]
+
+
+def test_shards_keep_their_files_apart_within_the_limits(tmp_path):
+    plan = plan_shards(4, 3)
+    directories = {shard_directory(tmp_path, shard_ids) for shard_ids in plan}
+    assert len(directories) == 3
+    assert shard_directory(tmp_path, [0, 3]) == tmp_path / "shards-0-3"
+    # Together, the processes keep their caches within the limit set for all of them
+    assert sum(shard_share(1000, shard_ids, 4) for shard_ids in plan) <= 1000
+    assert shard_share(1000, [0, 3], 4) == 500
+
+
+def test_strip_options_removes_supervisor_options():
+    args = ["--debug", "--processes", "2", "--shard-count=4", "--max-renders", "2", "--metrics-port", "9000"]
+    assert strip_options(args, SUPERVISOR_OPTIONS) == ["--debug", "--max-renders", "2"]
+    assert strip_options(args, SUPERVISOR_OPTIONS, flags={"--debug"}) == ["--max-renders", "2"]
+
+
+def test_supervisor_restarts_exited_process():
+    async def run():
+        commands = []
+
+        def command(index, shard_ids):
+            commands.append((index, list(shard_ids)))
+            return SLEEPER
+
+        supervisor = Supervisor([[0, 2], [1, 3]], command, restart_delay=0.01)
+        running = asyncio.ensure_future(supervisor.run())
+        while len(supervisor.processes) < 2:
+            await asyncio.sleep(0.01)
+
+        crashed = supervisor.processes[0]
+        untouched = supervisor.processes[1]
+        crashed.kill()
+        while supervisor.processes[0] is crashed:
+            await asyncio.sleep(0.01)
+
+        assert supervisor.restarts == {0: 1, 1: 0}
+        assert supervisor.processes[1] is untouched
+        assert untouched.returncode is None
+
+        supervisor.stop()
+        await asyncio.wait_for(running, timeout=10)
+        return commands, supervisor
+
+    commands, supervisor = asyncio.run(run())
+
+    assert sorted(commands) == [(0, [0, 2]), (0, [0, 2]), (1, [1, 3])]
+    assert all(process.returncode is not None for process in supervisor.processes.values())
+
+
+def test_supervisor_graceful_restart_keeps_other_processes():
+    async def run():
+        supervisor = Supervisor([[0], [1]], lambda index, shard_ids: SLEEPER, restart_delay=60)
+        running = asyncio.ensure_future(supervisor.run())
+        while len(supervisor.processes) < 2:
+            await asyncio.sleep(0.01)
+
+        first, second = supervisor.processes[0], supervisor.processes[1]
+        await asyncio.wait_for(supervisor.restart(0), timeout=10)
+
+        assert first.returncode is not None
+        assert supervisor.processes[0] is not first
+        assert supervisor.processes[1] is second
+        # A requested restart is neither counted as a crash nor delayed
+        assert supervisor.restarts == {0: 0, 1: 0}
+
+        supervisor.stop()
+        await asyncio.wait_for(running, timeout=10)
+
+    asyncio.run(run())
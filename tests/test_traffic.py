@@ -0,0 +1,72 @@
+import asyncio
+
+from chess_bot.request import parse_request
+from chess_bot.traffic import TraceEvent, TrafficRecorder, read_trace, write_trace
+from tests.fakes import FakeBot, FakeChannel, make_bot_user, make_message
+
+
+def test_recorder_writes_anonymized_requests(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    recorder = TrafficRecorder(FakeBot(make_bot_user()), path, salt=b"salt")
+    channel = FakeChannel()
+
+    async def run():
+        content = "player:Hikaru,DrNykterstein time:real format:webp"
+        await recorder.on_message(make_message(content, channel=channel))
+        await recorder.on_message(make_message("player:Hikaru", author_id=11, channel=channel))
+        await recorder.on_message(make_message("just chatting", channel=channel))
+        await recorder.on_message(make_message("time:real", channel=channel))
+
+    asyncio.run(run())
+    recorder.close()
+
+    first, second = read_trace(path)
+    assert "hikaru" not in path.read_text().lower()
+    assert first.search_type == "player"
+    assert len(first.targets) == 2
+    assert first.targets[0] == second.targets[0]
+    assert first.author != second.author
+    assert first.channel == second.channel
+    assert first.options == ("time:real", "format:webp")
+    assert first.at <= second.at
+    # Nothing is answered
+    assert channel.sent == []
+
+
+def test_restarted_recorders_keep_the_trace_on_one_timeline(tmp_path, monkeypatch):
+    path = tmp_path / "trace.jsonl"
+    now = [1000.0]
+    monkeypatch.setattr("chess_bot.traffic.time.time", lambda: now[0])
+
+    async def record(content):
+        # A new process every time, like a restarted bot or another shard
+        recorder = TrafficRecorder(FakeBot(make_bot_user()), path, salt=b"salt")
+        await recorder.on_message(make_message(content, channel=FakeChannel()))
+        recorder.close()
+
+    asyncio.run(record("id:1"))
+    now[0] = 1060.0
+    asyncio.run(record("id:2"))
+
+    first, second = read_trace(path)
+    assert (first.at, second.at) == (0.0, 60.0)
+
+
+def test_trace_events_replay_as_the_same_request(tmp_path):
+    event = TraceEvent(
+        at=1.5,
+        author="b0001",
+        channel="c0001",
+        guild=None,
+        search_type="id",
+        targets=("aa", "bb"),
+        options=("disable:coordinates", "ply:20"),
+    )
+    path = tmp_path / "trace.jsonl"
+    write_trace(path, [event._replace(at=2.0), event])
+    assert read_trace(path) == [event, event._replace(at=2.0)]
+
+    request, error = parse_request(event.to_content().split())
+    assert error is None
+    assert (request.search_type, request.id_or_username) == ("id", "aa,bb")
+    assert (request.disable, request.ply, request.format) == (("coordinates",), 20, "png")
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from chess_bot.logs import correlate
+from chess_bot.process import ProcessLimits, ProcessTimeoutError
+from chess_bot.spool import RenderedGIF
+from chess_bot.worker import (
+    JOB_FRAME,
+    NoRenderWorkersError,
+    RenderQueue,
+    TCPTransport,
+    UnixTransport,
+    parse_transport,
+    read_frame,
+    run_worker,
+)
+from tests.fakes import write_executable
+
+
+async def wait_for_workers(queue: RenderQueue, count: int):
+    while queue.workers < count:
+        await asyncio.sleep(0.01)
+
+
+async def wait_for_workers_gone(queue: RenderQueue, count: int):
+    while queue.workers > count:
+        await asyncio.sleep(0.01)
+
+
+async def connect_worker(queue: RenderQueue, transport):
+    """Connect to the queue as a worker, returning once the queue counts it"""
+    reader, writer = await transport.connect()
+    await wait_for_workers(queue, queue.workers + 1)
+    return reader, writer
+
+
+def test_parse_transport():
+    unix = parse_transport("unix:/run/chess-bot.sock")
+    assert isinstance(unix, UnixTransport)
+    assert unix.path == Path("/run/chess-bot.sock")
+
+    tcp = parse_transport("tcp:0.0.0.0:8765")
+    assert isinstance(tcp, TCPTransport)
+    assert (tcp.host, tcp.port) == ("0.0.0.0", 8765)
+
+    with pytest.raises(ValueError):
+        parse_transport("http://localhost")
+
+
+def test_worker_renders_queued_jobs(tmp_path, monkeypatch):
+    write_executable(
+        tmp_path, "c2g", "import sys; sys.stdout.buffer.write(b'GIF89a' + sys.argv[1].encode() * 100000)"
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    transport = UnixTransport(tmp_path / "queue.sock")
+
+    async def run():
+        queue = RenderQueue(transport)
+        await queue.start()
+        worker = asyncio.ensure_future(run_worker(transport, concurrency=2, reconnect_delay=0.01))
+        await wait_for_workers(queue, 2)
+        outputs = [RenderedGIF(f"{i}.gif", tmp_path) for i in range(3)]
+        try:
+            errors = await asyncio.gather(
+                *(queue.render([str(i), "-o", "/dev/stdout"], output) for i, output in enumerate(outputs))
+            )
+        finally:
+            worker.cancel()
+            await queue.close()
+        return errors, outputs
+
+    errors, outputs = asyncio.run(run())
+    assert errors == [None, None, None]
+    for i, output in enumerate(outputs):
+        assert output.open().read() == b"GIF89a" + str(i).encode() * 100000
+
+
+def test_worker_returns_render_errors(tmp_path, monkeypatch):
+    write_executable(tmp_path, "c2g", "import sys; sys.stderr.write('invalid pgn')")
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    transport = UnixTransport(tmp_path / "queue.sock")
+
+    async def run():
+        queue = RenderQueue(transport)
+        await queue.start()
+        worker = asyncio.ensure_future(run_worker(transport, concurrency=1))
+        await wait_for_workers(queue, 1)
+        try:
+            return await queue.render(["pgn", "-o", "/dev/stdout"], tmp_path / "out.gif")
+        finally:
+            worker.cancel()
+            await queue.close()
+
+    assert asyncio.run(run()) == "invalid pgn"
+
+
+def test_worker_reports_timeouts(tmp_path, monkeypatch):
+    write_executable(tmp_path, "c2g", "import time; time.sleep(30)")
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    transport = UnixTransport(tmp_path / "queue.sock")
+
+    async def run():
+        queue = RenderQueue(transport)
+        await queue.start()
+        limits = ProcessLimits(timeout=0.2)
+        worker = asyncio.ensure_future(run_worker(transport, concurrency=1, limits=limits))
+        await wait_for_workers(queue, 1)
+        try:
+            return await queue.render(["pgn", "-o", "/dev/stdout"], tmp_path / "out.gif")
+        finally:
+            worker.cancel()
+            await queue.close()
+
+    with pytest.raises(ProcessTimeoutError) as e:
+        asyncio.run(run())
+    assert e.value.timeout == 0.2
+
+
+def test_job_is_retried_when_a_worker_disconnects(tmp_path, monkeypatch):
+    write_executable(tmp_path, "c2g", "import sys; sys.stdout.buffer.write(b'GIF89a')")
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    transport = UnixTransport(tmp_path / "queue.sock")
+
+    async def run():
+        queue = RenderQueue(transport)
+        await queue.start()
+        output = RenderedGIF("test.gif", tmp_path)
+        reader, writer = await connect_worker(queue, transport)
+        render = asyncio.ensure_future(queue.render(["pgn", "-o", "/dev/stdout"], output))
+        kind, _ = await read_frame(reader)
+        assert kind == JOB_FRAME
+        writer.close()
+        worker = asyncio.ensure_future(run_worker(transport, concurrency=1))
+        try:
+            error = await render
+        finally:
+            worker.cancel()
+            await queue.close()
+        return error, output
+
+    error, output = asyncio.run(run())
+    assert error is None
+    assert output.open().read() == b"GIF89a"
+
+
+def test_idle_worker_disconnects_are_noticed(tmp_path):
+    transport = UnixTransport(tmp_path / "queue.sock")
+
+    async def run():
+        queue = RenderQueue(transport, max_attempts=1)
+        await queue.start()
+        _, idle = await connect_worker(queue, transport)
+        reader, writer = await connect_worker(queue, transport)
+        idle.close()
+        try:
+            await asyncio.wait_for(wait_for_workers_gone(queue, 1), 5)
+            render = asyncio.ensure_future(queue.render(["pgn"], tmp_path / "out.gif"))
+            # The job goes to the worker still connected, on its first and only attempt
+            kind, _ = await read_frame(reader)
+            render.cancel()
+            return kind
+        finally:
+            writer.close()
+            await queue.close()
+
+    assert asyncio.run(run()) == JOB_FRAME
+
+
+def test_jobs_carry_the_request_id(tmp_path):
+    transport = UnixTransport(tmp_path / "queue.sock")
+
+    async def run():
+        queue = RenderQueue(transport)
+        await queue.start()
+        reader, writer = await connect_worker(queue, transport)
+        with correlate("42"):
+            render = asyncio.ensure_future(queue.render(["pgn"], tmp_path / "out.gif"))
+        try:
+            return await read_frame(reader)
+        finally:
+            render.cancel()
+            writer.close()
+            await queue.close()
+
+    kind, payload = asyncio.run(run())
+    assert kind == JOB_FRAME
+    assert json.loads(payload) == {"args": ["pgn"], "request_id": "42"}
+
+
+def test_job_fails_after_too_many_disconnects(tmp_path):
+    transport = UnixTransport(tmp_path / "queue.sock")
+
+    async def run():
+        queue = RenderQueue(transport, max_attempts=2)
+        await queue.start()
+        reader, writer = await connect_worker(queue, transport)
+        render = asyncio.ensure_future(queue.render(["pgn"], tmp_path / "out.gif"))
+        try:
+            while True:
+                await read_frame(reader)
+                writer.close()
+                await asyncio.sleep(0.01)
+                if render.done():
+                    return await render
+                reader, writer = await transport.connect()
+        finally:
+            await queue.close()
+
+    assert asyncio.run(run()) == "render worker disconnected 2 times"
+
+
+def test_render_fails_fast_without_workers(tmp_path):
+    transport = UnixTransport(tmp_path / "queue.sock")
+
+    async def run():
+        queue = RenderQueue(transport)
+        await queue.start()
+        try:
+            with pytest.raises(NoRenderWorkersError):
+                await queue.render(["pgn"], tmp_path / "out.gif", timeout=60)
+            return queue.queue_depth
+        finally:
+            await queue.close()
+
+    assert asyncio.run(run()) == 0
+
+
+def test_render_times_out_waiting_on_a_stuck_worker(tmp_path):
+    transport = UnixTransport(tmp_path / "queue.sock")
+
+    async def run():
+        queue = RenderQueue(transport, queue_allowance=0.1)
+        await queue.start()
+        _, writer = await connect_worker(queue, transport)
+        try:
+            return await queue.render(["pgn"], tmp_path / "out.gif", timeout=0.1)
+        finally:
+            writer.close()
+            await queue.close()
+
+    with pytest.raises(ProcessTimeoutError) as e:
+        asyncio.run(run())
+    assert e.value.timeout == pytest.approx(0.2)
+
+
+def test_cancelled_render_kills_the_remote_c2g(tmp_path, monkeypatch):
+    pid_path = tmp_path / "c2g.pid"
+    # Hangs on the first job, renders the next ones
+    write_executable(
+        tmp_path,
+        "c2g",
+        f"import os, sys, time\n"
+        f"if not os.path.exists({str(pid_path)!r}):\n"
+        f"    open({str(pid_path)!r}, 'w').write(str(os.getpid())); time.sleep(30)\n"
+        f"sys.stdout.buffer.write(b'GIF89a')",
+    )
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    transport = UnixTransport(tmp_path / "queue.sock")
+
+    async def run():
+        queue = RenderQueue(transport)
+        await queue.start()
+        worker = asyncio.ensure_future(run_worker(transport, concurrency=1))
+        await wait_for_workers(queue, 1)
+        try:
+            render = asyncio.ensure_future(queue.render(["pgn", "-o", "/dev/stdout"], tmp_path / "1.gif"))
+            while not pid_path.exists() or not pid_path.read_text():
+                await asyncio.sleep(0.01)
+            render.cancel()
+            # The worker kills c2g and takes the next job over the same connection
+            error = await asyncio.wait_for(
+                queue.render(["pgn", "-o", "/dev/stdout"], tmp_path / "2.gif"), timeout=5
+            )
+            with pytest.raises(ProcessLookupError):
+                os.kill(int(pid_path.read_text()), 0)
+            return error, queue.workers
+        finally:
+            worker.cancel()
+            await queue.close()
+
+    assert asyncio.run(run()) == (None, 1)
+    assert (tmp_path / "2.gif").read_bytes() == b"GIF89a"